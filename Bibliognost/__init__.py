@@ -13,12 +13,15 @@ login_manager.login_view = 'auth.login'
 
 credentials = json.load(open('config.json', mode='r', encoding='UTF-8'))
 
-from .models import AnonymousUser, Permission
+from .models import AnonymousUser, Permission, user_cache
 login_manager.anonymous_user = AnonymousUser
 
 from connection import PostgresConnection
 db_connection = PostgresConnection(credentials)
 
+from workers import WorkerPool
+worker_pool = WorkerPool()
+
 
 def get_logger(name):
 	logging.basicConfig(level=logging.DEBUG)
@@ -29,7 +32,38 @@ def create_app(config_name):
 	biblio_app = Flask(__name__)
 	biblio_app.config.from_object(config[config_name])
 	login_manager.init_app(biblio_app)
+	user_cache.init_app(biblio_app)
 	db_connection.init_app(biblio_app)
+	worker_pool.init_app(biblio_app)
+
+	from .modules.sent_analysis.fastClassifier import model_registry, sentiment_cache
+	model_registry.init_app(biblio_app)
+	sentiment_cache.init_app(biblio_app)
+
+	from .modules.sent_analysis.ScoringService import scoring_service
+	scoring_service.init_app(biblio_app)
+
+	from .modules.scraper import review_fetcher
+	review_fetcher.init_app(biblio_app)
+
+	from .modules.goodreads import goodreads_client, book_meta_service
+	goodreads_client.init_app(biblio_app)
+	book_meta_service.init_app(biblio_app)
+
+	from .modules.reviews import review_aggregator, review_dedup, sentiment_summaries
+	review_aggregator.init_app(biblio_app)
+	review_dedup.init_app(biblio_app)
+	sentiment_summaries.init_app(biblio_app)
+
+	from .modules.store import book_store
+	book_store.init_app(biblio_app)
+
+	from .modules.jobs import job_queue
+	job_queue.init_app(biblio_app)
+
+	from .modules.prewarm import hit_tracker, prewarmer
+	hit_tracker.init_app(biblio_app)
+	prewarmer.init_app(biblio_app)
 
 	@biblio_app.context_processor
 	def inject_template_vars():
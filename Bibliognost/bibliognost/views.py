@@ -1,13 +1,22 @@
-import itertools
-import multiprocessing
+import json
+import time
+from collections import OrderedDict
 
-from flask import render_template, jsonify, request
+from flask import render_template, jsonify, request, Response, stream_with_context, url_for, abort, current_app
 
-from Bibliognost import get_logger
+from Bibliognost import get_logger, worker_pool, db_connection, user_cache
 from . import biblio
-from ..modules.amazon import AmazonBot
-from ..modules.goodreads import GoodReads, BookSearch, GoodReadsBot
+from ..modules.goodreads import BookSearch, book_meta_service, goodreads_client
+from ..modules.jobs import job_queue
+from ..modules.prewarm import ISBN, GOODREADS, hit_tracker
+from ..modules.reviews import (
+	SOURCES, REVIEWS_JOB, collect_reviews, iter_scored_pages, store_reviews, summarize, sentiment_summaries,
+	review_dedup
+)
+from ..modules.scraper import review_fetcher, merge_pages
+from ..modules.store import book_store
 from ..modules.sent_analysis import fastClassifier
+from ..modules.sent_analysis.ScoringService import scoring_service
 
 logger = get_logger(__file__)
 
@@ -19,17 +28,50 @@ def index():
 
 @biblio.route('/book/<book_id>')
 def book_details(book_id):
-	book = GoodReads(book_id)
-	return render_template('book-details.html', book_details=book.get_book_data())
+	hit_tracker.record(GOODREADS, book_id)
+	book = book_store.load_books([book_id]).get(book_id)
+	if book is None:
+		book = book_meta_service.get_book(book_id)
+		book_store.save_books([book])
+	return render_template(
+		'book-details.html', book_details=book, sentiment_summary=sentiment_summaries.get(book.get('isbn'))
+	)
 
 
 @biblio.route('/book-meta')
 def book_meta():
-	book_ids = request.args.get('book_ids').split(',')
-	pool = multiprocessing.Pool()
-	book_details_processes = [pool.apply_async(GoodReads(book_id).get_book_data) for book_id in book_ids]
-	book_details = [book_detail.get() for book_detail in book_details_processes]
-	return jsonify(book_details)
+	book_ids = [book_id for book_id in request.args.get('book_ids', '').split(',') if book_id]
+	for book_id in OrderedDict.fromkeys(book_ids):
+		hit_tracker.record(GOODREADS, book_id)
+	stored = book_store.load_books(book_ids)
+	#: with `stream=1` every book is sent as a line of json as soon as it's fetched
+	if request.args.get('stream', 0, type=int):
+		stream = book_meta_service.stream(book_ids, known=stored, on_book=lambda book: book_store.save_books([book]))
+		return Response(stream_with_context(stream), mimetype='application/x-ndjson')
+	missing = list(OrderedDict.fromkeys(book_id for book_id in book_ids if book_id not in stored))
+	fetched = dict(zip(missing, book_meta_service.get_books(missing)))
+	book_store.save_books(list(fetched.values()))
+	return jsonify([stored.get(book_id) or fetched[book_id] for book_id in book_ids])
+
+
+@biblio.route('/metrics')
+def metrics():
+	return jsonify({
+		'sentiment_model': fastClassifier.model_registry.metrics(),
+		'lemmatizer': fastClassifier.lemmatizer_metrics(),
+		'sentiment_cache': fastClassifier.sentiment_cache.metrics(),
+		'scoring_service': scoring_service.metrics(),
+		'worker_pool': worker_pool.metrics(),
+		'db_pool': db_connection.metrics(),
+		'user_cache': user_cache.metrics(),
+		'review_fetcher': review_fetcher.metrics(),
+		'goodreads_client': goodreads_client.metrics(),
+		'book_meta': book_meta_service.metrics(),
+		'job_queue': job_queue.metrics(),
+		'book_hits': hit_tracker.metrics(),
+		'sentiment_summaries': sentiment_summaries.metrics(),
+		'review_dedup': review_dedup.metrics()
+	})
 
 
 @biblio.route('/search')
@@ -38,36 +80,121 @@ def search():
 	return render_template('search-results.html', results=results)
 
 
-def amazon_reviews(isbn):
-	try:
-		amzn_reviews = AmazonBot(isbn).get_reviews()
-	except Exception as e:
-		logger.exception(e)
-		return []
-	else:
-		return amzn_reviews
-
-
-def goodreads_reviews(url):
-	try:
-		gr_reviews = GoodReadsBot(url, 100).get_reviews()
-	except Exception as e:
-		logger.exception(e)
-		return []
-	else:
-		return gr_reviews
+def format_event(kind, data, event_format):
+	"""
+	formats a record of a streamed response
+
+	:param kind: type of the record, i.e. 'page' or 'summary'
+	:param data: json serializable dict
+	:param event_format: 'sse' for server-sent events, newline delimited json otherwise
+	:return: str
+	"""
+	if event_format == 'sse':
+		return 'event: {kind}\ndata: {data}\n\n'.format(kind=kind, data=json.dumps(data))
+	return json.dumps(dict(data, type=kind)) + '\n'
+
+
+def stream_reviews(isbn, url, num_reviews, event_format):
+	"""
+	Yields every review page with sentiments as soon as it's fetched and scored,
+	then a summary record with the number of reviews and pages of every source
+	"""
+	start = time.time()
+	pages = {source: dict() for source in SOURCES}
+	for source, page_no, reviews in iter_scored_pages(isbn, url, num_reviews):
+		pages[source][page_no] = reviews
+		yield format_event('page', {'source': source, 'page': page_no, 'reviews': reviews}, event_format)
+	store_reviews(isbn, {source: merge_pages(source_pages) for source, source_pages in pages.items()})
+	yield format_event('summary', summarize(pages, start), event_format)
+
+
+def enqueue_reviews(isbn, url, num_reviews):
+	"""
+	Serves the result of a recent job for the book, or queues one, joining
+	the job in flight if there's one already
+
+	:return: response, 200 with the reviews or 202 with the id of the job
+	"""
+	result = job_queue.cached_result(REVIEWS_JOB, isbn)
+	if result is not None:
+		return jsonify(result)
+	job_id = job_queue.enqueue(REVIEWS_JOB, isbn, dict(isbn=isbn, url=url, num_reviews=num_reviews))
+	response = jsonify({'job_id': job_id, 'status_url': url_for('.job_status', job_id=job_id)})
+	response.status_code = 202
+	return response
 
 
 @biblio.route('/reviews')
 def reviews_with_sentiment():
-	pool = multiprocessing.Pool()
-	fetch_review_processes = [
-		pool.apply_async(amazon_reviews, args=(request.args.get('isbn'),)),
-		pool.apply_async(goodreads_reviews, args=(request.args.get('url'),))
-	]
-	amzn_reviews, gr_reviews = [reviews.get() for reviews in fetch_review_processes]
-	review_texts = [review.get('body') for review in itertools.chain(amzn_reviews, gr_reviews)]
-	sentiments = fastClassifier.predict_sentiment(review_texts)
-	for idx, response in enumerate(itertools.chain(amzn_reviews, gr_reviews)):
-		response['sentiment'] = float(sentiments[idx])
-	return jsonify({'amazon': amzn_reviews, 'goodreads': gr_reviews, 'num_reviews': len(review_texts)})
+	isbn, url = request.args.get('isbn'), request.args.get('url')
+	#: text_reviews_count of the book, one page of goodreads reviews is fetched if it's unknown
+	num_reviews = request.args.get('num_reviews', 30, type=int)
+	hit_tracker.record(ISBN, isbn, dict(url=url, num_reviews=num_reviews))
+	#: with `job=1` the reviews are fetched and scored by a background worker, see /jobs
+	if request.args.get('job', 0, type=int):
+		if not isbn:
+			abort(400)
+		return enqueue_reviews(isbn, url, num_reviews)
+	#: with `stream=ndjson` or `stream=sse` every page is sent as soon as it's scored
+	event_format = request.args.get('stream')
+	if event_format in ('ndjson', 'sse'):
+		return Response(
+			stream_with_context(stream_reviews(isbn, url, num_reviews, event_format)),
+			mimetype='text/event-stream' if event_format == 'sse' else 'application/x-ndjson',
+			headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+		)
+	reviews, summary = collect_reviews(isbn, url, num_reviews)
+	return jsonify(dict(reviews, num_reviews=summary['num_reviews']))
+
+
+@biblio.route('/sentiment-summary')
+def sentiment_summary():
+	isbn = request.args.get('isbn')
+	return jsonify(dict(sentiment_summaries.get(isbn), isbn=isbn))
+
+
+@biblio.route('/jobs/<int:job_id>')
+def job_status(job_id):
+	job = job_queue.get(job_id)
+	if job is None:
+		abort(404)
+	return jsonify(job)
+
+
+def stream_job(job_id, poll_interval, timeout):
+	"""
+	Yields a 'progress' event whenever the job reports progress, then a
+	'done' event with its result or a 'failed' event with its error, or a
+	'timeout' event if the job is still queued or running after `timeout` seconds
+	"""
+	last_update = None
+	deadline = time.time() + timeout
+	while True:
+		job = job_queue.get(job_id)
+		if job is None:
+			yield format_event('failed', {'id': job_id, 'error': 'no such job'}, 'sse')
+			return
+		if job['status'] == 'done':
+			yield format_event('done', job, 'sse')
+			return
+		if job['status'] == 'failed':
+			yield format_event('failed', job, 'sse')
+			return
+		if job['updated_at'] != last_update:
+			last_update = job['updated_at']
+			yield format_event('progress', {k: job[k] for k in ('id', 'status', 'progress', 'attempts')}, 'sse')
+		if time.time() >= deadline:
+			yield format_event('timeout', {k: job[k] for k in ('id', 'status', 'attempts')}, 'sse')
+			return
+		time.sleep(poll_interval)
+
+
+@biblio.route('/jobs/<int:job_id>/events')
+def job_events(job_id):
+	return Response(
+		stream_job(
+			job_id, current_app.config.get('JOB_POLL_INTERVAL', 1.0), current_app.config.get('JOB_EVENTS_TIMEOUT', 5 * 60)
+		),
+		mimetype='text/event-stream',
+		headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+	)
@@ -1,2 +1,6 @@
 from .role import Role, Permission
-from .user import User, AnonymousUser
+from .user import User, AnonymousUser, user_cache
+from .book import upsert_books, fetch_books, fetch_book_id
+from .review import upsert_reviews
+from .summary import upsert_summaries, fetch_summaries
+from .fingerprint import upsert_fingerprints, fetch_fingerprints
@@ -0,0 +1,112 @@
+from flask import g
+from psycopg2.extras import RealDictCursor
+
+#: core fields of the goodreads book data stored as columns of `books`, besides the goodreads id
+BOOK_FIELDS = (
+    'isbn', 'title', 'image_url', 'small_image_url', 'publication_year', 'publication_month',
+    'publication_day', 'publisher', 'description', 'url', 'num_pages',
+)
+META_FIELDS = ('ratings_count', 'reviews_count')
+
+
+def upsert_books(books, fetched_at):
+    """
+    persists the books, their authors and similar books in bulk
+
+    :param books: book data as returned by `GoodReads.get_book_data`
+    :type books: list[dict]
+    :param fetched_at: time the books were fetched from goodreads, in ms
+    :type fetched_at: int
+    :return: dict mapping the goodreads id of every book to its id in the db
+    """
+    books = list({book['id']: book for book in books if book.get('id')}.values())
+    if not books:
+        return dict()
+    columns = ('goodreads_id',) + BOOK_FIELDS + META_FIELDS
+    values = [[book['id'] for book in books]]
+    values += [[book.get(field) for book in books] for field in BOOK_FIELDS]
+    values += [[book.get('meta', {}).get(field) for book in books] for field in META_FIELDS]
+    cursor = g.db.cursor()
+    cursor.execute(
+        'INSERT INTO books ({0}, fetched_at) SELECT b.*, %s FROM unnest({1}) AS b ({0}) '
+        'ON CONFLICT (goodreads_id) DO UPDATE SET {2}, fetched_at = EXCLUDED.fetched_at '
+        'RETURNING goodreads_id, id'.format(
+            ', '.join(columns),
+            ', '.join(['%s::TEXT[]'] * len(columns)),
+            ', '.join('{0} = EXCLUDED.{0}'.format(column) for column in columns[1:])
+        ),
+        [fetched_at] + values
+    )
+    book_ids = dict(cursor.fetchall())
+
+    authors = dict()
+    book_authors = []
+    similar_books = []
+    for book in books:
+        for position, (author_id, author) in enumerate(book.get('authors', {}).items()):
+            authors[author_id] = author.get('name')
+            book_authors.append((book_ids[book['id']], author_id, position))
+        for position, similar_id in enumerate(book.get('similar_books', [])):
+            similar_books.append((book_ids[book['id']], similar_id, position))
+
+    cursor.execute('DELETE FROM book_authors WHERE book_id = ANY(%s)', (list(book_ids.values()), ))
+    cursor.execute('DELETE FROM similar_books WHERE book_id = ANY(%s)', (list(book_ids.values()), ))
+    if authors:
+        cursor.execute(
+            'INSERT INTO authors (id, name) SELECT * FROM unnest(%s::TEXT[], %s::TEXT[]) '
+            'ON CONFLICT (id) DO UPDATE SET name = EXCLUDED.name',
+            (list(authors.keys()), list(authors.values()))
+        )
+    for table, column, rows in (
+        ('book_authors', 'author_id', book_authors), ('similar_books', 'similar_goodreads_id', similar_books)
+    ):
+        if rows:
+            cursor.execute(
+                'INSERT INTO {0} (book_id, {1}, position) '
+                'SELECT * FROM unnest(%s::BIGINT[], %s::TEXT[], %s::SMALLINT[]) ON CONFLICT DO NOTHING'.format(table, column),
+                [list(column_values) for column_values in zip(*rows)]
+            )
+    return book_ids
+
+
+def fetch_books(goodreads_ids, fetched_after=0):
+    """
+    fetches stored books in the shape of `GoodReads.get_book_data`
+
+    :param goodreads_ids: goodreads ids of the books
+    :type goodreads_ids: list[str]
+    :param fetched_after: books fetched from goodreads before this time, in ms, are ignored
+    :type fetched_after: int
+    :return: dict mapping the goodreads id of every book found to its data
+    """
+    cursor = g.db.cursor(cursor_factory=RealDictCursor)
+    cursor.execute(
+        'SELECT b.*, '
+        '(SELECT json_agg(json_build_object(\'id\', a.id, \'name\', a.name) ORDER BY ba.position) '
+        'FROM book_authors ba JOIN authors a ON a.id = ba.author_id WHERE ba.book_id = b.id) AS authors, '
+        '(SELECT json_agg(s.similar_goodreads_id ORDER BY s.position) FROM similar_books s '
+        'WHERE s.book_id = b.id) AS similar_books '
+        'FROM books b WHERE b.goodreads_id = ANY(%s) AND b.fetched_at >= %s',
+        (list(goodreads_ids), fetched_after)
+    )
+    books = dict()
+    for row in cursor.fetchall():
+        book = {field: row[field] for field in BOOK_FIELDS if row[field]}
+        book['id'] = row['goodreads_id']
+        book['authors'] = {author['id']: author for author in row['authors'] or []}
+        book['similar_books'] = row['similar_books'] or []
+        book['meta'] = {field: row[field] or '' for field in META_FIELDS}
+        books[row['goodreads_id']] = book
+    return books
+
+
+def fetch_book_id(isbn):
+    """
+    :param isbn: isbn of the book
+    :type isbn: str
+    :return: id of the book in the db, None if it isn't stored
+    """
+    cursor = g.db.cursor()
+    cursor.execute('SELECT id FROM books WHERE isbn = %s ORDER BY fetched_at DESC LIMIT 1', (isbn, ))
+    row = cursor.fetchone()
+    return row[0] if row else None
@@ -0,0 +1,40 @@
+from flask import g
+
+
+def upsert_fingerprints(isbn, rows, updated_at):
+    """
+    persists the fingerprints of the distinct reviews of a book, adding to the sources already stored
+
+    :param isbn: isbn of the book
+    :type isbn: str
+    :param rows: exact hash, simhash as a signed 64 bit integer or None, and list of sources of every review
+    :type rows: list[tuple]
+    :param updated_at: time the fingerprints were updated, in ms
+    :type updated_at: int
+    """
+    if not rows:
+        return
+    cursor = g.db.cursor()
+    cursor.execute(
+        'INSERT INTO review_fingerprints (isbn, exact_hash, simhash, sources, updated_at) '
+        'SELECT %s, f.exact_hash, f.simhash, string_to_array(f.sources, \',\'), %s '
+        'FROM unnest(%s::TEXT[], %s::BIGINT[], %s::TEXT[]) AS f (exact_hash, simhash, sources) '
+        'ON CONFLICT (isbn, exact_hash) DO UPDATE SET '
+        'sources = ARRAY(SELECT DISTINCT s FROM unnest(review_fingerprints.sources || EXCLUDED.sources) AS s ORDER BY s), '
+        'updated_at = EXCLUDED.updated_at',
+        (
+            isbn, updated_at, [row[0] for row in rows], [row[1] for row in rows],
+            [','.join(row[2]) for row in rows]
+        )
+    )
+
+
+def fetch_fingerprints(isbn):
+    """
+    :param isbn: isbn of the book
+    :type isbn: str
+    :return: list of `tuple[str, int, list[str]]`, the exact hash, simhash and sources of every stored review
+    """
+    cursor = g.db.cursor()
+    cursor.execute('SELECT exact_hash, simhash, sources FROM review_fingerprints WHERE isbn = %s', (isbn, ))
+    return cursor.fetchall()
@@ -0,0 +1,38 @@
+from flask import g
+
+#: columns of `reviews` set from the scraped reviews, in the order `upsert_reviews` expects them
+REVIEW_COLUMNS = ('external_id', 'author', 'title', 'rating', 'date', 'reviewed_on', 'body', 'body_hash')
+_COLUMN_TYPES = ('TEXT', 'TEXT', 'TEXT', 'SMALLINT', 'TEXT', 'DATE', 'TEXT', 'TEXT')
+
+
+def upsert_reviews(book_id, source, rows, fetched_at):
+    """
+    persists the reviews of a book from a single source in bulk
+
+    :param book_id: id of the book in the db
+    :type book_id: int
+    :param source: name of the review source, i.e. 'amazon' or 'goodreads'
+    :type source: str
+    :param rows: values of `REVIEW_COLUMNS` for every review
+    :type rows: list[tuple]
+    :param fetched_at: time the reviews were scraped, in ms
+    :type fetched_at: int
+    :return: set of the external ids of the reviews which weren't stored yet
+    """
+    rows = list({row[0]: row for row in rows}.values())
+    if not rows:
+        return set()
+    cursor = g.db.cursor()
+    cursor.execute(
+        'INSERT INTO reviews (book_id, source, {0}, fetched_at) '
+        'SELECT %s, %s, r.*, %s FROM unnest({1}) AS r ({0}) '
+        'ON CONFLICT (book_id, source, external_id) DO UPDATE SET '
+        'title = EXCLUDED.title, rating = EXCLUDED.rating, fetched_at = EXCLUDED.fetched_at '
+        'RETURNING external_id, xmax = 0'.format(
+            ', '.join(REVIEW_COLUMNS), ', '.join('%s::{0}[]'.format(column_type) for column_type in _COLUMN_TYPES)
+        ),
+        [book_id, source, fetched_at] + [list(column_values) for column_values in zip(*rows)]
+    )
+    #: `xmax` is 0 for inserted rows only, updated rows carry the id of the updating transaction
+    return {external_id for external_id, inserted in cursor.fetchall() if inserted}
+
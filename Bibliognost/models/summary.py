@@ -0,0 +1,46 @@
+import json
+
+from flask import g
+
+#: first key of the advisory locks taken on the summaries of a book, the second is the hash of the isbn
+SUMMARY_LOCK_CLASS = 2401
+
+
+def upsert_summaries(isbn, summaries, updated_at):
+    """
+    persists the sentiment summaries of a book
+
+    :param isbn: isbn of the book
+    :type isbn: str
+    :param summaries: summary of every source, see `reviews.summary`
+    :type summaries: dict[str, dict]
+    :param updated_at: time the summaries were updated, in ms
+    :type updated_at: int
+    """
+    if not summaries:
+        return
+    sources = list(summaries)
+    cursor = g.db.cursor()
+    cursor.execute(
+        'INSERT INTO sentiment_summaries (isbn, source, summary, updated_at) '
+        'SELECT %s, s.source, s.summary::JSONB, %s FROM unnest(%s::TEXT[], %s::TEXT[]) AS s (source, summary) '
+        'ON CONFLICT (isbn, source) DO UPDATE SET summary = EXCLUDED.summary, updated_at = EXCLUDED.updated_at',
+        (isbn, updated_at, sources, [json.dumps(summaries[source]) for source in sources])
+    )
+
+
+def fetch_summaries(isbn, for_update=False):
+    """
+    :param isbn: isbn of the book
+    :type isbn: str
+    :param for_update: if True, the summaries of the book are locked until the end of the transaction,
+                       including the ones which don't exist yet
+    :type for_update: bool
+    :return: dict mapping every source with a stored summary to it
+    """
+    cursor = g.db.cursor()
+    if for_update:
+        #: `FOR UPDATE` can't lock the rows of a book without summaries yet
+        cursor.execute('SELECT pg_advisory_xact_lock(%s, hashtext(%s))', (SUMMARY_LOCK_CLASS, isbn))
+    cursor.execute('SELECT source, summary FROM sentiment_summaries WHERE isbn = %s', (isbn, ))
+    return dict(cursor.fetchall())
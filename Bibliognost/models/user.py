@@ -1,5 +1,8 @@
 import hashlib
+import threading
+import time
 import uuid
+from collections import OrderedDict
 from datetime import datetime
 
 from flask import g, request
@@ -12,6 +15,70 @@ from Bibliognost import login_manager
 from .role import Role
 
 
+#: columns of the users table a User object is built from
+USER_FIELDS = (
+    'id', 'name', 'email', 'password', 'role', 'avatarhash', 'bio', 'location', 'createtime', 'updatetime', 'lastscene'
+)
+
+
+class UserCache:
+    """
+    Short lived cache of the user rows, keyed by email, so an authenticated
+    request doesn't need a query to load its user.
+
+    Entries expire after `ttl` seconds. Every process has its own cache and
+    invalidates its entries on writes, the ttl bounds how long another process
+    may see an outdated user.
+    """
+
+    def __init__(self, ttl=30, max_size=10000):
+        self.ttl = ttl
+        self.max_size = max_size
+        self.__entries = OrderedDict()
+        self.__lock = threading.Lock()
+        self.__stats = dict(hits=0, misses=0)
+
+    def init_app(self, app):
+        self.ttl = app.config.get('USER_CACHE_TTL', self.ttl)
+        self.max_size = app.config.get('USER_CACHE_SIZE', self.max_size)
+
+    def get(self, email):
+        """
+        :return: dict, a copy of the cached row of the user, None if it isn't cached or expired
+        """
+        with self.__lock:
+            entry = self.__entries.get(email.lower())
+            if entry is None or time.time() - entry[0] >= self.ttl:
+                self.__stats['misses'] += 1
+                return None
+            self.__stats['hits'] += 1
+            return dict(entry[1])
+
+    def put(self, email, row):
+        with self.__lock:
+            self.__entries[email.lower()] = (time.time(), dict(row))
+            self.__entries.move_to_end(email.lower())
+            while len(self.__entries) > self.max_size:
+                self.__entries.popitem(last=False)
+
+    def update(self, email, **fields):
+        """updates the cached row of the user in place, if it's cached, without extending its ttl"""
+        with self.__lock:
+            entry = self.__entries.get(email.lower())
+            if entry is not None:
+                entry[1].update(fields)
+
+    def invalidate(self, email):
+        with self.__lock:
+            self.__entries.pop(email.lower(), None)
+
+    def metrics(self):
+        return dict(self.__stats, size=len(self.__entries), ttl=self.ttl)
+
+
+user_cache = UserCache()
+
+
 @login_manager.user_loader
 def load_user(email):
     """
@@ -21,7 +88,6 @@ def load_user(email):
     :type email: str
     :return: User object, if found, else None.
     """
-    
     return User.get(email=email)
 
 
@@ -80,6 +146,7 @@ class User(UserMixin):
     """
     REQUIRED_FIELDS = ("id", "name", "email", "password", "role", "createtime", "updatetime", "lastscene")
     READ_ONLY = ("createtime",)
+    PROFILE_FIELDS = ("name", "bio", "location")
 
     #: Assignment operators must not be used on read-only fields
     #: of the user object. They can be set only at the
@@ -98,12 +165,9 @@ class User(UserMixin):
         self._createtime = kwargs.get('createtime')
         self._role = kwargs.get('role')
 
+        #: the hash is derived from the email, no need to store it
         if self.email and not self.avatar_hash:
             self.avatar_hash = hashlib.md5(self.email.encode('utf-8')).hexdigest()
-            cursor = g.db.cursor()
-            cursor.execute(
-                'UPDATE users SET avatarhash = %s WHERE email = %s', (self.avatar_hash, self.email)
-            )
 
     @property
     def password(self):
@@ -127,7 +191,7 @@ class User(UserMixin):
     @property
     def role(self):
         if not self._role:
-            self.role = fetch_user_data_from_db('email', self.email, ('role_name',))['role_name']
+            self.role = fetch_user_data_from_db('email', self.email, ('role',))['role']
         return self._role
 
     @role.setter
@@ -153,10 +217,39 @@ class User(UserMixin):
         return self.name.split(' ')[0]
 
     def ping(self):
+        self.lastscene = datetime.timestamp(datetime.utcnow()) * 1000
+        cursor = g.db.cursor()
+        cursor.execute('UPDATE users SET lastscene = %s WHERE id = %s', (self.lastscene, self.id))
+        g.db.commit()
+        #: pinged on every request, dropping the entry would reload the user on the next one
+        user_cache.update(self.email, lastscene=self.lastscene)
+
+    def update_profile(self, **fields):
+        """
+        updates the profile of the user
+
+        :param fields: new values of `name`, `bio` or `location`
+        :type fields: dict
+        :raises: TypeError, if any other field is given
+        """
+        invalid_fields = tuple(field for field in fields if field not in self.PROFILE_FIELDS)
+        if invalid_fields:
+            raise TypeError('not a profile field, {0}'.format(invalid_fields))
+        if not fields:
+            return
+        self.updatetime = datetime.timestamp(datetime.utcnow()) * 1000
         cursor = g.db.cursor()
         cursor.execute(
-            'UPDATE users SET lastscene = %s WHERE id = %s', (datetime.timestamp(datetime.utcnow()) * 1000, self.id)
+            'UPDATE users SET {0}, updatetime = %s WHERE email = %s'.format(
+                ', '.join('{0} = %s'.format(field) for field in fields)
+            ),
+            tuple(fields.values()) + (self.updatetime, self.email)
         )
+        for field, value in fields.items():
+            setattr(self, field, value)
+        #: invalidated once committed, or a concurrent request could cache the old row again in between
+        g.db.commit()
+        user_cache.invalidate(self.email)
 
     def is_admin(self):
         """verifies if the user is admin"""
@@ -203,13 +296,16 @@ class User(UserMixin):
         user = cls(**user_info)
         user.password = user_info.pop('password')
         response = insert_user_data_to_db(**user_info, password=user._password_hash)
+        g.db.commit()
+        user_cache.invalidate(user.email)
         if response:
             return user
     
     @classmethod
     def get(cls, **field_name_with_val):
         """
-        Fetches user from the DB based on their email or id.
+        Fetches user from the DB based on their email or id,
+        users looked up by email are served from the `user_cache` if possible.
 
         :param field_name_with_val: key must be either 'email' or 'id' of the user, not both
         :type field_name_with_val: dict
@@ -221,7 +317,12 @@ class User(UserMixin):
         if has_both_keys or has_none_keys:
             raise TypeError('Invalid Argument: neither or both of `email` or `id` provided')
         field_name = "email" if "email" in field_name_with_val else "id"
-        user = fetch_user_data_from_db(field_name, field_name_with_val[field_name])
+        value = field_name_with_val[field_name]
+        user = user_cache.get(value) if field_name == "email" else None
+        if user is None:
+            user = fetch_user_data_from_db(field_name, value, USER_FIELDS)
+            if user:
+                user_cache.put(user['email'], user)
         if user:
             return cls(**user)
 
@@ -1,64 +1,95 @@
 import asyncio
-import selectors
 import time
 
-import aiohttp
 from bs4 import BeautifulSoup
 from bs4.element import Tag
 
 from Bibliognost import get_logger
+from ..scraper import Blocked, review_fetcher, notify_page
+from . import xpathparser
 
 logger = get_logger('amazonbot')
 
-#: TO-DO - Mark all the pages which could not be fetched
-#: due to any reason(remote server blocking our request to
-#: prevent DDOS attack, network errors etc). When another
-#: request comes with the same ISBN, try to fetch only those
-#: pages which couldn't be fetched in the last request. Keep
-#: doing this until all the reviews have been fetched.
+#: Pages which could not be fetched due to any reason (remote
+#: server blocking our request to prevent DDOS attack, network
+#: errors etc) are not recorded in the review ledger. When another
+#: request comes with the same ISBN, only those pages (and the
+#: stale ones) are fetched, see `reviews.ReviewLedger`.
 
 
 class AmazonBot(object):
-	def __init__(self, isbn):
+	def __init__(self, isbn, fetcher=review_fetcher, parser='soup'):
+		"""
+		initialize amazon review bot.
+
+		:param isbn: isbn of the book
+		:type isbn: str
+		:param fetcher: fetcher whose event loop and session are used for the requests
+		:type fetcher: Bibliognost.modules.scraper.ReviewFetcher
+		:param parser: 'soup' to walk a bs4 tree, 'xpath' to evaluate compiled xpath expressions on the lxml tree
+		:type parser: str
+		"""
+		if parser not in ('soup', 'xpath'):
+			raise ValueError('AmazonBot: unknown parser {p!r}'.format(p=parser))
 		self.url_template = 'http://www.amazon.in/product-reviews/' + isbn + '/?showViewpoints=1&pageNumber={page_no}'
 		self.headers = {'user-agent': 'Mozilla/5.0 (X11; Ubuntu; Linux x86_64; rv:49.0) Gecko/20100101 Firefox/49.0'}
+		self.fetcher = fetcher
+		self.parser = parser
 
-	async def create_soup(self, session, page_no):
+	def _parse_page(self, html):
 		"""
-		Makes async request to the server and parses the
-		responses using lxml tree builder
+		parses a response using lxml tree builder
 
-		:param session: aiohttp session object to fetch url
-		:type session: aiohttp.client.ClientSession
-		:param page_no: the webpage to fetch
-		:type page_no: int
-		:return: bs4.BeautifulSoup object
+		:param html: body of the response
+		:type html: str
+		:return: bs4.BeautifulSoup object, or the root lxml element with the xpath parser
+		:raises: Blocked if amazon answered with a captcha
 		"""
-		url = self.url_template.format(page_no=page_no)
-		async with session.get(url) as response:
-			html = await response.text()
-		return BeautifulSoup(html, 'lxml')
-
-	async def _num_review_pages(self, session):
-		"""
-		get the number of pages
-
-		:return: tuple[int, bs4.BeautifulSoup], total number of pages and soup object
-		"""
-		soup = await self.create_soup(session, 1)
-		if soup:
-			pagination_bar = soup.find('div', attrs={'id': 'cm_cr-pagination_bar'})
-			if pagination_bar:
-				page_btn_li = pagination_bar.findAll('li', class_='page-button')
-				return int(page_btn_li[-1].text.strip()), soup
-			#: No pagination bar on the page doesn't imply
-			#: that there are no reviews. It can also be due to
-			#: the fact that the number of reviews were few enough
-			#: to be accomodated on a single page only.
-			#: if latter is the case, num_pages must be set to `1`.
-			elif soup.find('div', attrs={'id': 'cm_cr-review_list'}):
-				return 1, soup
-		return 0, soup
+		if self.parser == 'xpath':
+			document = xpathparser.parse_document(html)
+			if xpathparser.is_blocked(document):
+				raise Blocked('captcha')
+			return document
+		soup = BeautifulSoup(html, 'lxml')
+		if soup.find('input', attrs={'id': 'captchacharacters'}):
+			raise Blocked('captcha')
+		return soup
+
+	def _count_pages(self, soup):
+		"""
+		get the number of pages from the first page
+
+		:param soup: first review page, as returned by `_parse_page`
+		:return: int, total number of pages
+		"""
+		if self.parser == 'xpath':
+			return xpathparser.num_review_pages(soup)
+		pagination_bar = soup.find('div', attrs={'id': 'cm_cr-pagination_bar'})
+		if pagination_bar:
+			page_btn_li = pagination_bar.findAll('li', class_='page-button')
+			return int(page_btn_li[-1].text.strip())
+		#: No pagination bar on the page doesn't imply
+		#: that there are no reviews. It can also be due to
+		#: the fact that the number of reviews were few enough
+		#: to be accomodated on a single page only.
+		#: if latter is the case, num_pages must be set to `1`.
+		elif soup.find('div', attrs={'id': 'cm_cr-review_list'}):
+			return 1
+		return 0
+
+	def _parse_first_page(self, html):
+		soup = self._parse_page(html)
+		return self._count_pages(soup), self._reviews_from_soup(soup)
+
+	async def _num_review_pages(self):
+		"""
+		get the number of pages, the first page is parsed
+		in the executor of the fetcher as a whole
+
+		:return: tuple[int, list[dict]], total number of pages and reviews of the first page
+		"""
+		url = self.url_template.format(page_no=1)
+		return await self.fetcher.fetch(url, parse_page=self._parse_first_page, headers=self.headers)
 
 	def build_review_dict(self, review):
 		"""
@@ -92,45 +123,53 @@ class AmazonBot(object):
 						reviews.append(self.build_review_dict(review))
 		return reviews
 
-	async def get_reviews_from_page(self, session, page_no, soup_obj=None):
-		soup = soup_obj if soup_obj else await self.create_soup(session, page_no)
-		reviews_list_node = soup.find('div', attrs={'id': 'cm_cr-review_list'})
+	def _reviews_from_soup(self, soup):
+		if self.parser == 'xpath':
+			return xpathparser.build_reviews_list(soup)
+		return self.build_reviews_list(soup.find('div', attrs={'id': 'cm_cr-review_list'}))
+
+	def _parse_reviews(self, html):
+		"""
+		builds the reviews of a page from the body of the response
+
+		:raises: Blocked if the page has no reviews, amazon serves those instead of refusing the request
+		"""
+		reviews = self._reviews_from_soup(self._parse_page(html))
+		if not reviews:
+			raise Blocked('no reviews on the page')
+		return reviews
+
+	async def get_reviews_from_page(self, page_no):
 		logger.info('Fetching page: {page}'.format(page=page_no))
-		return self.build_reviews_list(reviews_list_node)
+		url = self.url_template.format(page_no=page_no)
+		return await self.fetcher.fetch(url, parse_page=self._parse_reviews, headers=self.headers)
 
-	def get_reviews(self):
+	async def fetch_pages(self, skip=(), num_pages=None, on_page=None):
 		"""
-		Get reviews from all the pages,
+		Get reviews from the review pages,
 		requests to all the pages are made
 		concurrently, which decreases the overall
 		time required to fetch all reviews
 
-		:return: `list[dict]` which is json serializable
+		:param skip: pages which must not be fetched, unless page 1 is needed to count the pages
+		:type skip: set[int]
+		:param num_pages: number of review pages if already known, page 1 is fetched to count them otherwise
+		:type num_pages: int
+		:param on_page: called with the number, and the reviews or exception, of every page as soon as it's done
+		:return: `tuple[int, dict]`, the number of pages, and the reviews of every fetched
+				 page or the exception it failed with, keyed by page number
 		"""
-		selector = selectors.SelectSelector()
-		loop = asyncio.SelectorEventLoop(selector)
-		asyncio.set_event_loop(loop)
 		start = time.time()
-
-		with aiohttp.ClientSession() as session:
-			num_pages, soup = loop.run_until_complete(self._num_review_pages(session))
-			pending_fetch_review_tasks = []
-			for page in range(1, num_pages + 1):
-				if soup and page == 1:
-					pending_fetch_review_tasks.append(self.get_reviews_from_page(session, page, soup_obj=soup))
-				else:
-					pending_fetch_review_tasks.append(self.get_reviews_from_page(session, page))
-			reviews = loop.run_until_complete(asyncio.gather(*pending_fetch_review_tasks, return_exceptions=True))
-			loop.close()
-
-		logger.info('Fetched reviews from {p} page(s) in: {t} s'.format(t=time.time() - start, p=num_pages))
-
-		filtered_reviews = []
-		for index, reviews_list in enumerate(reviews):
-			if isinstance(reviews_list, Exception) or not reviews_list:
-				cause = 'request blocked by remote server' if not reviews_list else reviews_list
-				logger.warning('Failed to get result for page: {p}, cause={e}'.format(p=index + 1, e=cause))
-			else:
-				for review in reviews_list:
-					filtered_reviews.append(review)
-		return filtered_reviews
+		first_page = None
+		if num_pages is None:
+			num_pages, first_page = await self._num_review_pages()
+			if num_pages and on_page is not None:
+				on_page(1, first_page)
+		pages = [page for page in range(1, num_pages + 1) if page not in skip and not (first_page is not None and page == 1)]
+		pending_fetch_review_tasks = [notify_page(page, self.get_reviews_from_page(page), on_page) for page in pages]
+		reviews = dict(zip(pages, await asyncio.gather(*pending_fetch_review_tasks, return_exceptions=True)))
+		if first_page is not None and num_pages:
+			reviews[1] = first_page
+
+		logger.info('Fetched reviews from {p} page(s) in: {t} s'.format(t=time.time() - start, p=len(reviews)))
+		return num_pages, reviews
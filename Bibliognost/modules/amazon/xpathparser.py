@@ -0,0 +1,73 @@
+from lxml import etree
+
+#: The xpath expressions are compiled once and evaluated directly on the
+#: lxml tree, which pulls the review nodes without building a bs4 tree.
+_CAPTCHA = etree.XPath('//input[@id="captchacharacters"]')
+_REVIEW_LIST = etree.XPath('//div[@id="cm_cr-review_list"]')
+_PAGE_BUTTONS = etree.XPath(
+	'//div[@id="cm_cr-pagination_bar"]//li[contains(concat(" ", normalize-space(@class), " "), " page-button ")]'
+)
+_REVIEWS = etree.XPath('./*[@data-hook="review" and contains(concat(" ", normalize-space(@class), " "), " review ")]')
+_TITLE = etree.XPath('string(.//a[@data-hook="review-title"])')
+_AUTHOR = etree.XPath('string(.//a[@data-hook="review-author"])')
+_DATE = etree.XPath('string(.//span[@data-hook="review-date"])')
+_STAR_RATING_CLASS = etree.XPath('string(.//i[@data-hook="review-star-rating"]/@class)')
+_BODY = etree.XPath('string(.//span[@data-hook="review-body"])')
+
+
+def parse_document(html):
+	"""
+	:param html: body of the response
+	:type html: str
+	:return: lxml.etree._Element, root of the document, None if the body is empty
+	"""
+	return etree.HTML(html)
+
+
+def is_blocked(document):
+	"""
+	:return: `bool`, True if the document is missing or amazon answered with a captcha
+	"""
+	return document is None or bool(_CAPTCHA(document))
+
+
+def num_review_pages(document):
+	"""
+	same as `AmazonBot._num_review_pages` on an lxml tree
+
+	:return: int
+	"""
+	page_buttons = _PAGE_BUTTONS(document)
+	if page_buttons:
+		return int(page_buttons[-1].xpath('string()').strip())
+	return 1 if _REVIEW_LIST(document) else 0
+
+
+def build_review_dict(review):
+	"""
+	same as `AmazonBot.build_review_dict` on an lxml node
+
+	:param review: review node containing a single review's metadata
+	:type review: lxml.etree._Element
+	:return: dict
+	"""
+	return dict(
+		title=str(_TITLE(review)),
+		author=str(_AUTHOR(review)),
+		date=str(_DATE(review))[3:],
+		rating=str(_STAR_RATING_CLASS(review)).split()[2].split('-')[2],
+		body=str(_BODY(review))
+	)
+
+
+def build_reviews_list(document):
+	"""
+	same as `AmazonBot.build_reviews_list` on an lxml tree
+
+	:return: list containing all the reviews available on the page
+	"""
+	reviews = []
+	for reviews_list_node in _REVIEW_LIST(document)[:1]:
+		for review in _REVIEWS(reviews_list_node):
+			reviews.append(build_review_dict(review))
+	return reviews
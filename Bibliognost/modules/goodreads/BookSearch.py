@@ -1,18 +1,16 @@
-import xml.etree.ElementTree as elTree
-from urllib import parse
-
-import requests
-
 from . import grresponse
-from Bibliognost import credentials
+from .client import goodreads_client
 
 
 class BookSearch:
-	def __init__(self, book_title):
-		self.url = 'https://www.goodreads.com/search/index?{query_params}'
-		self.query_params = parse.urlencode({'key': credentials['goodreads']['key'], 'q': book_title, 'format': 'xml'})
-		self.response = requests.get(self.url.format(query_params=self.query_params))
-		self.root = elTree.fromstring(self.response.content)
+	def __init__(self, book_title, client=goodreads_client):
+		"""
+		:param book_title: the search query
+		:type book_title: str
+		:param client: client the `search/index` response is fetched with
+		:type client: GoodreadsClient
+		"""
+		self.root = client.get_xml('search/index', q=book_title)
 		self.search_node = self.root.find(grresponse.SEARCH_NODE_TAG)
 
 	def get_results(self):
@@ -1,4 +1,6 @@
+from .client import GoodreadsClient, goodreads_client
 from .goodreads import GoodReads
 from .BookSearch import BookSearch
+from .bookmeta import BookMetaService, book_meta_service
 from .goodreadsbot import GoodReadsBot
 from . import grresponse
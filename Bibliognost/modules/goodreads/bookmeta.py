@@ -0,0 +1,141 @@
+import json
+import queue
+import threading
+from collections import OrderedDict
+
+from Bibliognost import get_logger, worker_pool
+from .goodreads import GoodReads
+
+logger = get_logger('bookmeta')
+
+
+def fetch_book_data(book_id, revalidate=False):
+	return GoodReads(book_id, revalidate=revalidate).get_book_data()
+
+
+class BookMetaService(object):
+	"""
+	Looks up the metadata of many books at once.
+
+	The ids of a batch are deduplicated and looked up in parallel on the worker
+	pool, at most `max_concurrency` at a time per batch. A lookup of a book
+	which is already in flight, for this or any concurrent request, waits for
+	that lookup instead of calling goodreads again. Revalidating lookups, which
+	bypass the cache of the goodreads client, only join each other.
+	"""
+
+	def __init__(self, fetch=fetch_book_data, max_concurrency=8):
+		"""
+		:param fetch: function returning the metadata of a single book, revalidated if `revalidate` is True
+		:param max_concurrency: maximum number of lookups of a batch in flight at a time
+		:type max_concurrency: int
+		"""
+		self.fetch = fetch
+		self.max_concurrency = max_concurrency
+		self._in_flight = dict()
+		self._lock = threading.Lock()
+		self._stats = dict(lookups=0, coalesced=0)
+
+	def init_app(self, app):
+		self.max_concurrency = app.config.get('BOOK_META_CONCURRENCY', self.max_concurrency)
+
+	def _forget(self, key, future):
+		with self._lock:
+			if self._in_flight.get(key) is future:
+				del self._in_flight[key]
+
+	def lookup(self, book_id, revalidate=False):
+		"""
+		starts the lookup of a book, or joins the one in flight
+
+		:param book_id: goodreads id of the book
+		:type book_id: str
+		:param revalidate: if True, the cached goodreads response is revalidated first
+		:type revalidate: bool
+		:return: concurrent.futures.Future resolving to the metadata of the book
+		"""
+		key = (book_id, revalidate)
+		with self._lock:
+			future = self._in_flight.get(key)
+			if future is not None:
+				self._stats['coalesced'] += 1
+				return future
+			self._stats['lookups'] += 1
+			future = worker_pool.submit(self.fetch, book_id, revalidate=revalidate)
+			self._in_flight[key] = future
+		future.add_done_callback(lambda done: self._forget(key, done))
+		return future
+
+	def get_book(self, book_id):
+		"""
+		:return: dict, the metadata of the book
+		"""
+		return self.lookup(book_id).result()
+
+	def iter_books(self, book_ids, max_concurrency=None, revalidate=False):
+		"""
+		looks up the books of a batch, yielding every book as soon as its lookup finishes
+
+		:param book_ids: goodreads ids of the books, duplicates are looked up once
+		:type book_ids: list[str]
+		:param max_concurrency: maximum number of lookups in flight, defaults to `max_concurrency` of the service
+		:type max_concurrency: int
+		:param revalidate: if True, the cached goodreads responses are revalidated first
+		:type revalidate: bool
+		:return: generator of `tuple[str, concurrent.futures.Future]`, in completion order
+		"""
+		pending = list(OrderedDict.fromkeys(book_ids))
+		finished = queue.Queue()
+		in_flight = 0
+		max_concurrency = max_concurrency or self.max_concurrency
+		while pending or in_flight:
+			while pending and in_flight < max_concurrency:
+				book_id = pending.pop(0)
+				self.lookup(book_id, revalidate).add_done_callback(lambda done, book_id=book_id: finished.put((book_id, done)))
+				in_flight += 1
+			book_id, future = finished.get()
+			in_flight -= 1
+			yield book_id, future
+
+	def get_books(self, book_ids):
+		"""
+		:param book_ids: goodreads ids of the books
+		:type book_ids: list[str]
+		:return: list with the metadata of every book, in the order of the ids
+		:raises: the first exception raised by a lookup
+		"""
+		books = {book_id: future.result() for book_id, future in self.iter_books(book_ids)}
+		return [books[book_id] for book_id in book_ids]
+
+	def stream(self, book_ids, known=None, on_book=None):
+		"""
+		same as `get_books`, as newline delimited json in completion order
+
+		:param book_ids: goodreads ids of the books
+		:type book_ids: list[str]
+		:param known: metadata of books already at hand, sent first and not looked up
+		:type known: dict[str, dict]
+		:param on_book: called with the metadata of every book looked up successfully
+		:return: generator of `str`, a json object per book with its `id` and
+				 either the `book` metadata or the `error` its lookup failed with
+		"""
+		known = known or dict()
+		for book_id in OrderedDict.fromkeys(book_ids):
+			if book_id in known:
+				yield json.dumps(dict(id=book_id, book=known[book_id])) + '\n'
+		for book_id, future in self.iter_books([book_id for book_id in book_ids if book_id not in known]):
+			try:
+				line = dict(id=book_id, book=future.result())
+			except Exception as e:
+				logger.warning('Failed to look up book {id}: {e}'.format(id=book_id, e=e))
+				line = dict(id=book_id, error=str(e))
+			else:
+				if on_book is not None:
+					on_book(line['book'])
+			yield json.dumps(line) + '\n'
+
+	def metrics(self):
+		return dict(self._stats, in_flight=len(self._in_flight), max_concurrency=self.max_concurrency)
+
+
+book_meta_service = BookMetaService()
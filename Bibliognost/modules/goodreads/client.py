@@ -0,0 +1,184 @@
+import os
+import threading
+import time
+import xml.etree.ElementTree as elTree
+from collections import OrderedDict, namedtuple
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from Bibliognost import credentials, get_logger, worker_pool
+
+logger = get_logger('goodreadsclient')
+
+#: A cached api response, with the validators needed to revalidate it
+_CacheEntry = namedtuple('_CacheEntry', ('content', 'etag', 'last_modified', 'fetched_at'))
+
+
+class GoodreadsClient(object):
+	"""
+	Client of the goodreads xml api shared by the views.
+
+	Requests go through a connection-pooled `requests.Session` per process,
+	with timeouts. Responses are cached in a bounded LRU keyed by the endpoint
+	and the parameters:
+
+	- for `ttl` seconds a response is served from the cache as is,
+	- for `stale_ttl` more seconds it's still served, and revalidated in the
+	  background by the worker pool,
+	- after that it's revalidated before being served, with `If-None-Match`
+	  and `If-Modified-Since` when goodreads sent validators.
+
+	If a request fails while a cached response of any age exists, the cached
+	response is served instead.
+	"""
+
+	def __init__(self, base_url='https://www.goodreads.com/', ttl=60 * 60, stale_ttl=24 * 60 * 60,
+				 max_entries=2000, timeout=(3.05, 10), pool_size=16):
+		"""
+		:param base_url: url the endpoints are relative to
+		:type base_url: str
+		:param ttl: seconds a response is served without revalidation
+		:type ttl: int
+		:param stale_ttl: seconds after `ttl` a response is served while revalidated in the background
+		:type stale_ttl: int
+		:param max_entries: maximum number of cached responses
+		:type max_entries: int
+		:param timeout: connect and read timeouts of a request, in seconds
+		:type timeout: tuple[float, float]
+		:param pool_size: maximum number of connections kept open to goodreads
+		:type pool_size: int
+		"""
+		self.base_url = base_url
+		self.ttl = ttl
+		self.stale_ttl = stale_ttl
+		self.max_entries = max_entries
+		self.timeout = timeout
+		self.pool_size = pool_size
+		self._session = None
+		self._pid = None
+		self._entries = OrderedDict()
+		self._refreshing = set()
+		self._lock = threading.Lock()
+		self._stats = dict(hits=0, stale_hits=0, misses=0, not_modified=0, refreshes=0, errors=0)
+
+	def init_app(self, app):
+		self.ttl = app.config.get('GOODREADS_API_TTL', self.ttl)
+		self.stale_ttl = app.config.get('GOODREADS_API_STALE_TTL', self.stale_ttl)
+		self.max_entries = app.config.get('GOODREADS_API_CACHE_SIZE', self.max_entries)
+		self.timeout = app.config.get('GOODREADS_API_TIMEOUT', self.timeout)
+		self.pool_size = app.config.get('GOODREADS_API_POOL_SIZE', self.pool_size)
+
+	@property
+	def session(self):
+		"""The session of the current process, pooled connections don't survive a fork"""
+		if self._pid != os.getpid():
+			with self._lock:
+				if self._pid != os.getpid():
+					session = requests.Session()
+					adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_size)
+					session.mount('https://', adapter)
+					session.mount('http://', adapter)
+					self._session = session
+					self._pid = os.getpid()
+		return self._session
+
+	def _remember(self, key, entry):
+		with self._lock:
+			self._entries[key] = entry
+			self._entries.move_to_end(key)
+			while len(self._entries) > self.max_entries:
+				self._entries.popitem(last=False)
+
+	def _fetch(self, endpoint, params, key, entry=None):
+		"""
+		requests an endpoint, conditionally if a cached response is given, and caches the response
+
+		:return: _CacheEntry
+		"""
+		headers = dict()
+		if entry is not None and entry.etag:
+			headers['If-None-Match'] = entry.etag
+		if entry is not None and entry.last_modified:
+			headers['If-Modified-Since'] = entry.last_modified
+		response = self.session.get(
+			self.base_url + endpoint, params=dict(params, key=credentials['goodreads']['key']),
+			headers=headers, timeout=self.timeout
+		)
+		if response.status_code == 304 and entry is not None:
+			self._stats['not_modified'] += 1
+			entry = entry._replace(fetched_at=time.time())
+		else:
+			response.raise_for_status()
+			entry = _CacheEntry(
+				response.content, response.headers.get('ETag'), response.headers.get('Last-Modified'), time.time()
+			)
+		self._remember(key, entry)
+		return entry
+
+	def _refresh(self, endpoint, params, key, entry):
+		try:
+			self._fetch(endpoint, params, key, entry)
+		except requests.RequestException as e:
+			logger.warning('Failed to revalidate {e}: {err}'.format(e=endpoint, err=e))
+		finally:
+			with self._lock:
+				self._refreshing.discard(key)
+
+	def _refresh_in_background(self, endpoint, params, key, entry):
+		with self._lock:
+			if key in self._refreshing:
+				return
+			self._refreshing.add(key)
+		self._stats['refreshes'] += 1
+		worker_pool.submit(self._refresh, endpoint, params, key, entry)
+
+	def get(self, endpoint, revalidate=False, **params):
+		"""
+		returns the body of the response of an endpoint, from the cache if it's fresh enough
+
+		:param endpoint: path of the endpoint relative to `base_url`, i.e. 'book/show'
+		:type endpoint: str
+		:param revalidate: if True, a cached response is revalidated before it's returned, however fresh it is,
+						   and it isn't served if the request fails
+		:type revalidate: bool
+		:param params: query parameters, without the api key
+		:return: `bytes`, body of the response
+		:raises: requests.RequestException if the request fails and nothing is cached, or `revalidate` is True
+		"""
+		key = (endpoint, tuple(sorted(params.items())))
+		with self._lock:
+			entry = self._entries.get(key)
+			if entry is not None:
+				self._entries.move_to_end(key)
+		age = time.time() - entry.fetched_at if entry is not None and not revalidate else None
+		if age is not None and age < self.ttl:
+			self._stats['hits'] += 1
+			return entry.content
+		if age is not None and age < self.ttl + self.stale_ttl:
+			self._stats['stale_hits'] += 1
+			self._refresh_in_background(endpoint, params, key, entry)
+			return entry.content
+		self._stats['misses'] += 1
+		try:
+			return self._fetch(endpoint, params, key, entry).content
+		except requests.RequestException as e:
+			self._stats['errors'] += 1
+			if entry is None or revalidate:
+				raise
+			logger.warning('Serving a stale response of {e}: {err}'.format(e=endpoint, err=e))
+			return entry.content
+
+	def get_xml(self, endpoint, revalidate=False, **params):
+		"""
+		same as `get`, with the body parsed
+
+		:return: xml.etree.ElementTree.Element, root of the response
+		"""
+		return elTree.fromstring(self.get(endpoint, revalidate=revalidate, format='xml', **params))
+
+	def metrics(self):
+		return dict(self._stats, size=len(self._entries), max_entries=self.max_entries, refreshing=len(self._refreshing))
+
+
+goodreads_client = GoodreadsClient()
@@ -1,25 +1,22 @@
 import re
-import xml.etree.ElementTree as elTree
-from urllib import parse
-
-import requests
 
 from . import grresponse
-from Bibliognost import credentials
+from .client import goodreads_client
 
 
 class GoodReads(object):
-	def __init__(self, book_id):
-		self.url = self.__build_url(book_id)
-		self.response = requests.get(self.url)
-		self.root = elTree.fromstring(self.response.content)
+	def __init__(self, book_id, client=goodreads_client, revalidate=False):
+		"""
+		:param book_id: goodreads id of the book
+		:type book_id: str
+		:param client: client the `book/show` response is fetched with
+		:type client: GoodreadsClient
+		:param revalidate: if True, a cached response is revalidated first, see `GoodreadsClient.get`
+		:type revalidate: bool
+		"""
+		self.root = client.get_xml('book/show', revalidate=revalidate, id=book_id)
 		self.book_node = self.root.find(grresponse.BOOK_NODE_TAG)
 
-	def __build_url(self, book_id):
-		url = 'https://www.goodreads.com/book/show?{query_params}'
-		query_params = parse.urlencode({'key': credentials['goodreads']['key'], 'id': book_id, 'format': 'xml'})
-		return url.format(query_params=query_params)
-
 	def remove_tags(self, input):
 		return re.sub(r'<[^>]*>', " ", input)
 
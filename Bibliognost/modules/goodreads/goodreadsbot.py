@@ -1,20 +1,22 @@
 import asyncio
-import selectors
 import time
 from collections import Counter
 
-import aiohttp
 import math
+from urllib import parse
+
 from bs4 import BeautifulSoup
 from bs4.element import Tag
 
 from Bibliognost import get_logger
+from ..scraper import Blocked, review_fetcher, notify_page
+from . import xpathparser
 
 logger = get_logger('goodreadsbot')
 
 
 class GoodReadsBot(object):
-	def __init__(self, url, num_reviews):
+	def __init__(self, url, num_reviews, fetcher=review_fetcher, max_pages=None, concurrency=5, parser='soup'):
 		"""
 		initialize goodreads review bot.
 
@@ -22,26 +24,55 @@ class GoodReadsBot(object):
 		:type url: str
 		:param num_reviews: total number of reviews for that book
 		:type num_reviews: int
+		:param fetcher: fetcher whose event loop and session are used for the requests
+		:type fetcher: Bibliognost.modules.scraper.ReviewFetcher
+		:param max_pages: maximum number of review pages to fetch, None to fetch all of them
+		:type max_pages: int
+		:param concurrency: maximum number of pages fetched at the same time
+		:type concurrency: int
+		:param parser: 'soup' to walk a bs4 tree, 'xpath' to evaluate compiled xpath expressions on the lxml tree
+		:type parser: str
 		"""
+		if parser not in ('soup', 'xpath'):
+			raise ValueError('GoodReadsBot: unknown parser {p!r}'.format(p=parser))
 		self.url = url
 		self.num_reviews = num_reviews
 		self.headers = {'user-agent': 'Mozilla/5.0 (X11; Ubuntu; Linux x86_64; rv:49.0) Gecko/20100101 Firefox/49.0'}
+		self.fetcher = fetcher
+		self.max_pages = max_pages
+		self.concurrency = concurrency
+		self.parser = parser
 
-	async def _create_soup(self, session):
+	def _page_url(self, page_no):
 		"""
-		Makes async request to the server and parses the
-		responses using lxml tree builder
+		returns the url of a review page of the book
 
-		:param session: aiohttp session object to fetch url
-		:type session: aiohttp.client.ClientSession
-		:return: bs4.BeautifulSoup object
+		:param page_no: the review page, starting at 1
+		:type page_no: int
+		:return: `str`
 		"""
-		async with session.get(self.url) as response:
-			html = await response.text()
-		return BeautifulSoup(html, 'lxml')
+		if page_no == 1:
+			return self.url
+		parts = parse.urlsplit(self.url)
+		query = parse.parse_qsl(parts.query) + [('page', page_no)]
+		return parse.urlunsplit(parts._replace(query=parse.urlencode(query)))
 
-	async def _fetch_dynamically_loaded_reviews(self):
-		pass
+	async def _fetch_dynamically_loaded_reviews(self, pages, slots, on_page=None):
+		"""
+		fetches the review pages concurrently, at most `concurrency` at a time
+
+		:param pages: the review pages to fetch
+		:type pages: iterable[int]
+		:param slots: semaphore bounding the number of pages in flight
+		:type slots: asyncio.Semaphore
+		:param on_page: called with the number, and the reviews or exception, of every page as soon as it's done
+		:return: list with the reviews of every page, or the exception it failed with, in page order
+		"""
+		async def fetch_page(page_no):
+			async with slots:
+				return await notify_page(page_no, self.get_reviews_from_page(page_no), on_page)
+
+		return await asyncio.gather(*[fetch_page(page_no) for page_no in pages], return_exceptions=True)
 
 	def _get_review_body(self, review_body_span):
 		"""
@@ -96,7 +127,7 @@ class GoodReadsBot(object):
 		review = dict()
 		review['author'] = review_header.find('a', class_='user').getText()
 		review['date'] = review_header.find('a', class_='reviewDate createdAt right').getText()
-		review['rating'] = self._get_rating(review_header.find('span', class_=' staticStars'))
+		review['rating'] = self._get_rating(review_header.find('span', class_='staticStars'))
 		review['body'] = self._get_review_body(review_body.find('span', class_='readable'))
 		review['title'] = review.get('body')[:50] + '...'
 		return review
@@ -120,28 +151,43 @@ class GoodReadsBot(object):
 					logger.exception(e)
 		return reviews
 
-	async def build_reviews_from_soup(self, session):
-		soup = await self._create_soup(session)
-		book_reviews_node = soup.find('div', attrs={'id': 'bookReviews'})
-		assert book_reviews_node
-		book_reviews_child_nodes = book_reviews_node.children
-		logger.info('Fetching page')
-		return self._build_reviews_list(book_reviews_child_nodes)
+	def _parse_reviews(self, html):
+		"""
+		builds the reviews of a page from the body of the response
+
+		:raises: Blocked if the page has no reviews
+		"""
+		if self.parser == 'xpath':
+			reviews = xpathparser.build_reviews_list(html)
+		else:
+			book_reviews_node = BeautifulSoup(html, 'lxml').find('div', attrs={'id': 'bookReviews'})
+			reviews = self._build_reviews_list(book_reviews_node.children) if book_reviews_node else None
+		if reviews is None:
+			raise Blocked('no reviews node on the page')
+		if not reviews:
+			raise Blocked('no reviews on the page')
+		return reviews
 
-	def get_reviews(self):
+	async def get_reviews_from_page(self, page_no=1):
 		"""
-		Fetches the first page first, then makes
-		an asynchronous request to remaining pages
-		and waits until all the ajax requests have
-		completed. Once all the reviews are loaded,
-		parses the html for each page to get the
-		reviews in desired format.
+		fetches a review page and builds its reviews with the parser of the bot
 
-		:return: `list[dict]` which is json serializable
+		:param page_no: the review page to fetch
+		:type page_no: int
+		:return: `list[dict]`, reviews of the page
+		:raises: Blocked if the page has no reviews
+		"""
+		logger.info('Fetching page: {page}'.format(page=page_no))
+		return await self.fetcher.fetch(self._page_url(page_no), parse_page=self._parse_reviews, headers=self.headers)
+
+	def num_review_pages(self):
+		"""
+		Returns the number of review pages to fetch
+
+		:return: int
 		"""
 		if not self.num_reviews:
-			logger.info('No reviews available')
-			return []
+			return 0
 		#: goodreads shows a max of 30 reviews per page
 		#: and we already know the total number of reviews.
 		#: We can take advantage of this info to calculate
@@ -149,21 +195,30 @@ class GoodReadsBot(object):
 		#: formulated as:
 		#:     num_pages = ceil(num_reviews / 30), if num_reviews > 0
 		num_pages = math.ceil(self.num_reviews / 30)
-		selector = selectors.SelectSelector()
-		loop = asyncio.SelectorEventLoop(selector)
-		asyncio.set_event_loop(loop)
+		if self.max_pages:
+			num_pages = min(num_pages, self.max_pages)
+		return num_pages
+
+	async def fetch_pages(self, skip=(), on_page=None):
+		"""
+		Makes an asynchronous request to every
+		review page, with a bounded number of them
+		in flight, and waits until all of them have
+		completed.
+
+		:param skip: pages which must not be fetched
+		:type skip: set[int]
+		:param on_page: called with the number, and the reviews or exception, of every page as soon as it's done
+		:return: `tuple[int, dict]`, the number of pages, and the reviews of every fetched
+				 page or the exception it failed with, keyed by page number
+		"""
+		num_pages = self.num_review_pages()
+		if not num_pages:
+			logger.info('No reviews available')
+			return 0, dict()
+		pages = [page for page in range(1, num_pages + 1) if page not in skip]
 		start = time.time()
-		with aiohttp.ClientSession() as session:
-			reviews_from_first_page = loop.run_until_complete(
-				asyncio.gather(self.build_reviews_from_soup(session), return_exceptions=True)
-			)
-		logger.info('Fetched reviews from {p} page(s) in: {t} s'.format(t=time.time() - start, p=num_pages))
-		filtered_reviews = []
-		for index, reviews_list in enumerate(reviews_from_first_page):
-			if isinstance(reviews_list, Exception) or not reviews_list:
-				cause = 'request blocked by remote server' if not reviews_list else reviews_list
-				logger.warning('Failed to get result for page: {p}, cause={e}'.format(p=index + 1, e=cause))
-			else:
-				for review in reviews_list:
-					filtered_reviews.append(review)
-		return filtered_reviews
+		slots = asyncio.Semaphore(self.concurrency)
+		reviews = await self._fetch_dynamically_loaded_reviews(pages, slots, on_page)
+		logger.info('Fetched reviews from {p} page(s) in: {t} s'.format(t=time.time() - start, p=len(pages)))
+		return num_pages, dict(zip(pages, reviews))
@@ -0,0 +1,85 @@
+from lxml import etree
+
+from Bibliognost import get_logger
+
+logger = get_logger('goodreadsbot')
+
+#: The xpath expressions are compiled once and evaluated directly on the
+#: lxml tree, which pulls the review nodes without building a bs4 tree.
+_BOOK_REVIEWS = etree.XPath('//div[@id="bookReviews"]')
+_REVIEWS = etree.XPath('./*[normalize-space(@class)="friendReviews elementListBrown"]')
+_HEADER = etree.XPath('.//div[normalize-space(@class)="reviewHeader uitext stacked"]')
+_TEXT = etree.XPath('.//div[normalize-space(@class)="reviewText stacked"]')
+_AUTHOR = etree.XPath('string(.//a[contains(concat(" ", normalize-space(@class), " "), " user ")])')
+_DATE = etree.XPath('string(.//a[normalize-space(@class)="reviewDate createdAt right"])')
+_STARS = etree.XPath('.//span[contains(concat(" ", normalize-space(@class), " "), " staticStars ")]')
+_FULL_STARS = etree.XPath('count(./span[contains(concat(" ", normalize-space(@class), " "), " p10 ")])')
+_READABLE = etree.XPath('.//span[contains(concat(" ", normalize-space(@class), " "), " readable ")]')
+_TEXT_ID = etree.XPath('./a/@data-text-id')
+_FREE_TEXT = etree.XPath('.//span[@id=$id]')
+_FIRST_SPAN = etree.XPath('.//span')
+
+
+def _contents(node):
+	"""
+	same as the `contents` of a bs4 node joined like `GoodReadsBot._get_review_body`,
+	text as is and child elements as markup
+	"""
+	contents = [node.text] if node.text else []
+	for child in node:
+		contents.append(etree.tostring(child, encoding='unicode', with_tail=False))
+		if child.tail:
+			contents.append(child.tail)
+	return ' '.join(contents)
+
+
+def _get_review_body(review_body_span):
+	text_id = _TEXT_ID(review_body_span)
+	if text_id:
+		return _contents(_FREE_TEXT(review_body_span, id='freeText{id}'.format(id=text_id[0]))[0])
+	return _contents(_FIRST_SPAN(review_body_span)[0])
+
+
+def _get_rating(review_header):
+	stars = _STARS(review_header)
+	return int(_FULL_STARS(stars[0])) if stars else 0
+
+
+def build_review_dict(review_header, review_body):
+	"""
+	same as `GoodReadsBot._build_review_dict` on lxml nodes
+
+	:param review_header: node containing header info of review i.e. title, author, etc
+	:type review_header: lxml.etree._Element
+	:param review_body: node containing body of review
+	:type review_body: lxml.etree._Element
+	:return: dict
+	"""
+	review = dict()
+	review['author'] = str(_AUTHOR(review_header))
+	review['date'] = str(_DATE(review_header))
+	review['rating'] = _get_rating(review_header)
+	review['body'] = _get_review_body(_READABLE(review_body)[0])
+	review['title'] = review.get('body')[:50] + '...'
+	return review
+
+
+def build_reviews_list(html):
+	"""
+	builds the list of all reviews available on a page
+
+	:param html: body of the response
+	:type html: str
+	:return: list containing all the reviews available on the page, None if the page has no reviews node
+	"""
+	document = etree.HTML(html)
+	book_reviews_nodes = _BOOK_REVIEWS(document) if document is not None else []
+	if not book_reviews_nodes:
+		return None
+	reviews = []
+	for child in _REVIEWS(book_reviews_nodes[0]):
+		try:
+			reviews.append(build_review_dict(_HEADER(child)[0], _TEXT(child)[0]))
+		except Exception as e:
+			logger.exception(e)
+	return reviews
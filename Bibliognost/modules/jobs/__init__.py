@@ -0,0 +1,2 @@
+from .jobqueue import JobQueue, job_queue
+from .worker import JobWorker
@@ -0,0 +1,264 @@
+import json
+import time
+
+from Bibliognost import db_connection, get_logger
+
+logger = get_logger('jobqueue')
+
+QUEUED = 'queued'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+
+
+def _now():
+	return int(time.time() * 1000)
+
+
+class JobQueue(object):
+	"""
+	Queue of background jobs in the `jobs` table.
+
+	A job is identified by its kind and a dedupe key, i.e. the isbn of a book.
+	At most one job with the same kind and key is queued or running at a time,
+	enqueueing it again returns the job in flight. Workers claim jobs with
+	`FOR UPDATE SKIP LOCKED`, so any number of them can poll the same table.
+	Jobs which raised, or ran for longer than `timeout` seconds and so were
+	abandoned by a dead worker, are queued again up to `max_attempts` times.
+
+	A worker only updates a job while it's running the attempt it claimed, once
+	the job was requeued as abandoned its updates are ignored.
+
+	Every call uses its own pooled connection and commits right away, so jobs
+	are visible to the workers before the request enqueueing them ends.
+	"""
+
+	def __init__(self, connections=db_connection, timeout=5 * 60, max_attempts=3, result_ttl=6 * 60 * 60):
+		"""
+		:param connections: pool the connections are checked out of
+		:type connections: connection.PostgresConnection
+		:param timeout: seconds after which a running job is considered abandoned
+		:type timeout: int
+		:param max_attempts: number of times a job is run before it's failed for good
+		:type max_attempts: int
+		:param result_ttl: seconds the result of a job is served to later requests for the same key
+		:type result_ttl: int
+		"""
+		self.connections = connections
+		self.timeout = timeout
+		self.max_attempts = max_attempts
+		self.result_ttl = result_ttl
+		self._stats = dict(enqueued=0, coalesced=0, cache_hits=0, claimed=0, done=0, failed=0, requeued=0)
+
+	def init_app(self, app):
+		self.timeout = app.config.get('JOB_TIMEOUT', self.timeout)
+		self.max_attempts = app.config.get('JOB_MAX_ATTEMPTS', self.max_attempts)
+		self.result_ttl = app.config.get('JOB_RESULT_TTL', self.result_ttl)
+
+	def enqueue(self, kind, key, params):
+		"""
+		queues a job, unless one with the same kind and key is already queued or running
+
+		:param kind: name of the handler of the job
+		:type kind: str
+		:param key: dedupe key of the job
+		:type key: str
+		:param params: json serializable parameters of the handler
+		:type params: dict
+		:return: `int`, id of the new job or of the one in flight
+		"""
+		with self.connections.connection() as connection:
+			cursor = connection.cursor()
+			#: the job in flight may finish between the insert and the select, the insert succeeds then
+			while True:
+				cursor.execute(
+					'INSERT INTO jobs (kind, dedupe_key, params, status, attempts, created_at, updated_at) '
+					'VALUES (%s, %s, %s, %s, 0, %s, %s) '
+					'ON CONFLICT (kind, dedupe_key) WHERE status IN (\'queued\', \'running\') DO NOTHING RETURNING id',
+					(kind, key, json.dumps(params), QUEUED, _now(), _now())
+				)
+				row = cursor.fetchone()
+				if row is not None:
+					self._stats['enqueued'] += 1
+					return row[0]
+				cursor.execute(
+					'SELECT id FROM jobs WHERE kind = %s AND dedupe_key = %s AND status IN (\'queued\', \'running\')',
+					(kind, key)
+				)
+				row = cursor.fetchone()
+				if row is not None:
+					self._stats['coalesced'] += 1
+					return row[0]
+
+	def cached_result(self, kind, key):
+		"""
+		:return: dict, the result of the latest job of that kind and key done less than `result_ttl` ago, else None
+		"""
+		with self.connections.connection() as connection:
+			cursor = connection.cursor()
+			cursor.execute(
+				'SELECT result FROM jobs WHERE kind = %s AND dedupe_key = %s AND status = %s AND finished_at >= %s '
+				'ORDER BY finished_at DESC LIMIT 1',
+				(kind, key, DONE, _now() - self.result_ttl * 1000)
+			)
+			row = cursor.fetchone()
+			if row is None:
+				return None
+			self._stats['cache_hits'] += 1
+			return row[0]
+
+	def get(self, job_id):
+		"""
+		:return: dict with the status, progress, result and error of the job, None if there's no such job
+		"""
+		with self.connections.connection() as connection:
+			cursor = connection.cursor()
+			cursor.execute(
+				'SELECT id, kind, status, progress, result, error, attempts, created_at, updated_at FROM jobs '
+				'WHERE id = %s',
+				(job_id, )
+			)
+			row = cursor.fetchone()
+			if row is None:
+				return None
+			return dict(zip(
+				('id', 'kind', 'status', 'progress', 'result', 'error', 'attempts', 'created_at', 'updated_at'), row
+			))
+
+	def active_keys(self, kind):
+		"""
+		:return: set of the dedupe keys of the jobs of that kind queued or running
+		"""
+		with self.connections.connection() as connection:
+			cursor = connection.cursor()
+			cursor.execute(
+				'SELECT dedupe_key FROM jobs WHERE kind = %s AND status IN (\'queued\', \'running\')', (kind, )
+			)
+			return {row[0] for row in cursor.fetchall()}
+
+	def done_keys(self, kind, keys, since):
+		"""
+		:param keys: dedupe keys to look for
+		:type keys: list[str]
+		:param since: time in ms
+		:type since: int
+		:return: set of those keys with a job of that kind done since then
+		"""
+		if not keys:
+			return set()
+		with self.connections.connection() as connection:
+			cursor = connection.cursor()
+			cursor.execute(
+				'SELECT DISTINCT dedupe_key FROM jobs WHERE kind = %s AND dedupe_key = ANY(%s) '
+				'AND status = %s AND finished_at >= %s',
+				(kind, list(keys), DONE, since)
+			)
+			return {row[0] for row in cursor.fetchall()}
+
+	def claim(self):
+		"""
+		marks the oldest queued job as running
+
+		:return: dict with the id, kind, params and attempts of the job, None if nothing is queued
+		"""
+		with self.connections.connection() as connection:
+			cursor = connection.cursor()
+			cursor.execute(
+				'UPDATE jobs SET status = %s, attempts = attempts + 1, started_at = %s, updated_at = %s '
+				'WHERE id = (SELECT id FROM jobs WHERE status = %s ORDER BY id LIMIT 1 FOR UPDATE SKIP LOCKED) '
+				'RETURNING id, kind, params, attempts',
+				(RUNNING, _now(), _now(), QUEUED)
+			)
+			row = cursor.fetchone()
+			if row is None:
+				return None
+			self._stats['claimed'] += 1
+			return dict(zip(('id', 'kind', 'params', 'attempts'), row))
+
+	def _update(self, job_id, attempts, **fields):
+		"""
+		updates a job if it's still running the attempt `attempts`
+
+		:return: `bool`, False if the job was taken over by another worker, or is gone
+		"""
+		fields['updated_at'] = _now()
+		with self.connections.connection() as connection:
+			cursor = connection.cursor()
+			cursor.execute(
+				'UPDATE jobs SET {0} WHERE id = %s AND status = %s AND attempts = %s'.format(
+					', '.join('{0} = %s'.format(field) for field in fields)
+				),
+				tuple(fields.values()) + (job_id, RUNNING, attempts)
+			)
+			if not cursor.rowcount:
+				logger.warning('Ignored the update of job {id}, attempt {n} is over'.format(id=job_id, n=attempts))
+			return bool(cursor.rowcount)
+
+	def report_progress(self, job_id, attempts, progress):
+		"""
+		:param attempts: attempt of the job being run, as claimed
+		:type attempts: int
+		:param progress: json serializable progress of the running job
+		:type progress: dict
+		"""
+		self._update(job_id, attempts, progress=json.dumps(progress))
+
+	def finish(self, job_id, attempts, result):
+		"""
+		:param attempts: attempt of the job being run, as claimed
+		:type attempts: int
+		:param result: json serializable result of the job
+		:type result: dict
+		"""
+		if self._update(job_id, attempts, status=DONE, result=json.dumps(result), finished_at=_now()):
+			self._stats['done'] += 1
+
+	def fail(self, job_id, attempts, error):
+		"""
+		:param attempts: attempt of the job being run, as claimed
+		:type attempts: int
+		"""
+		if self._update(job_id, attempts, status=FAILED, error=str(error), finished_at=_now()):
+			self._stats['failed'] += 1
+
+	def retry(self, job_id, attempts, error):
+		"""
+		queues a job which raised again, or fails it once it ran out of attempts
+
+		:param attempts: attempt of the job being run, as claimed
+		:type attempts: int
+		:return: `bool`, True if the job was queued again
+		"""
+		if attempts < self.max_attempts:
+			requeued = self._update(job_id, attempts, status=QUEUED, error=str(error))
+			if requeued:
+				self._stats['requeued'] += 1
+			return requeued
+		self.fail(job_id, attempts, error)
+		return False
+
+	def requeue_abandoned(self):
+		"""
+		queues the jobs abandoned by dead workers again, or fails them once they ran out of attempts
+
+		:return: `int`, number of jobs requeued or failed
+		"""
+		with self.connections.connection() as connection:
+			cursor = connection.cursor()
+			cursor.execute(
+				'UPDATE jobs SET status = CASE WHEN attempts < %s THEN %s ELSE %s END, '
+				'error = CASE WHEN attempts < %s THEN error ELSE \'abandoned\' END, updated_at = %s '
+				'WHERE status = %s AND started_at < %s',
+				(self.max_attempts, QUEUED, FAILED, self.max_attempts, _now(), RUNNING, _now() - self.timeout * 1000)
+			)
+			if cursor.rowcount:
+				self._stats['requeued'] += cursor.rowcount
+				logger.warning('Requeued or failed {n} abandoned job(s)'.format(n=cursor.rowcount))
+			return cursor.rowcount
+
+	def metrics(self):
+		"""counters of this process, the web workers enqueue and the job workers claim"""
+		return dict(self._stats, timeout=self.timeout, max_attempts=self.max_attempts, result_ttl=self.result_ttl)
+
+
+job_queue = JobQueue()
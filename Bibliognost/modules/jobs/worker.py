@@ -0,0 +1,91 @@
+import time
+
+import psycopg2
+from flask import g
+
+from Bibliognost import db_connection, get_logger
+from connection import RequestConnection
+from .jobqueue import job_queue
+
+logger = get_logger('jobworker')
+
+
+class JobWorker(object):
+	"""
+	Runs the jobs of the queue, one at a time, in the process it's started in.
+
+	Every job runs in an app context with a `RequestConnection` on `g.db`, like
+	a request, so the stores and the review ledger work as they do in the views.
+	The connection is committed when the job is done and rolled back if it
+	failed. Start as many worker processes as the hosts can scrape for.
+	"""
+
+	def __init__(self, app, handlers, queue=job_queue, poll_interval=1.0):
+		"""
+		:param app: app the jobs run in the context of
+		:type app: flask.Flask
+		:param handlers: function of every kind of job, called with the params of
+						 the job and a function reporting its progress, returning its result
+		:type handlers: dict[str, callable]
+		:param queue: queue the jobs are claimed from
+		:type queue: JobQueue
+		:param poll_interval: seconds slept when the queue is empty
+		:type poll_interval: float
+		"""
+		self.app = app
+		self.handlers = handlers
+		self.queue = queue
+		self.poll_interval = app.config.get('JOB_POLL_INTERVAL', poll_interval)
+
+	def _run(self, job):
+		handler = self.handlers[job['kind']]
+		with self.app.app_context():
+			g.db = RequestConnection(db_connection)
+			error = None
+			try:
+				return handler(
+					job['params'], lambda progress: self.queue.report_progress(job['id'], job['attempts'], progress)
+				)
+			except Exception as e:
+				error = e
+				raise
+			finally:
+				g.db.release(error)
+
+	def run_once(self):
+		"""
+		claims and runs a single job, a job which raises is queued again until it ran out of attempts
+
+		:return: `bool`, False if the queue was empty
+		"""
+		job = self.queue.claim()
+		if job is None:
+			return False
+		if job['kind'] not in self.handlers:
+			logger.error('Job {id} failed, no handler for jobs of kind {kind}'.format(id=job['id'], kind=job['kind']))
+			self.queue.fail(job['id'], job['attempts'], 'no handler for jobs of kind {0}'.format(job['kind']))
+			return True
+		start = time.time()
+		try:
+			result = self._run(job)
+		except Exception as e:
+			requeued = self.queue.retry(job['id'], job['attempts'], e)
+			logger.exception('Job {id} ({kind}) failed{again}'.format(
+				id=job['id'], kind=job['kind'], again=', queued again' if requeued else ''
+			))
+		else:
+			self.queue.finish(job['id'], job['attempts'], result)
+			logger.info('Job {id} ({kind}) done in {t:.2f} s'.format(id=job['id'], kind=job['kind'], t=time.time() - start))
+		return True
+
+	def run(self):
+		"""runs jobs until the process is stopped, requeueing the ones abandoned by dead workers between them"""
+		logger.info('Job worker started')
+		while True:
+			try:
+				self.queue.requeue_abandoned()
+				if not self.run_once():
+					time.sleep(self.poll_interval)
+			except psycopg2.OperationalError as e:
+				logger.warning('Job queue unavailable: {e}'.format(e=e))
+				time.sleep(self.poll_interval)
@@ -0,0 +1,2 @@
+from .hits import ISBN, GOODREADS, HitTracker, hit_tracker
+from .prewarmer import Prewarmer, prewarmer
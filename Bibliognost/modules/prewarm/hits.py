@@ -0,0 +1,126 @@
+import atexit
+import json
+import threading
+import time
+
+import psycopg2
+
+from Bibliognost import db_connection, worker_pool, get_logger
+
+logger = get_logger('hits')
+
+#: kinds of the tracked keys
+ISBN = 'isbn'
+GOODREADS = 'goodreads'
+
+
+class HitTracker(object):
+	"""
+	Counts the requests for every book, by isbn and by goodreads id, in the `book_hits` table.
+
+	Every key has a score which grows by one per request and halves every
+	`half_life` seconds, so the hottest books are the ones requested often
+	and lately. Hits are counted in memory and written in bulk at most every
+	`flush_interval` seconds, on the worker pool, so requests never wait for
+	the write. The parameters of the latest request for a key are kept with
+	it, for the reviews of an isbn that's the url of its amazon page.
+	"""
+
+	def __init__(self, connections=db_connection, half_life=24 * 60 * 60, flush_interval=10, enabled=True):
+		"""
+		:param connections: pool the connections are checked out of
+		:type connections: connection.PostgresConnection
+		:param half_life: seconds after which a hit counts half as much
+		:type half_life: int
+		:param flush_interval: seconds the hits are counted in memory before being written
+		:type flush_interval: int
+		:param enabled: if False, nothing is counted
+		:type enabled: bool
+		"""
+		self.connections = connections
+		self.half_life = half_life
+		self.flush_interval = flush_interval
+		self.enabled = enabled
+		self._pending = dict()
+		self._lock = threading.Lock()
+		self._last_flush = time.time()
+
+	def init_app(self, app):
+		self.half_life = app.config.get('BOOK_HITS_HALF_LIFE', self.half_life)
+		self.flush_interval = app.config.get('BOOK_HITS_FLUSH_INTERVAL', self.flush_interval)
+		self.enabled = app.config.get('BOOK_HITS', self.enabled)
+		if self.enabled:
+			atexit.register(self.flush)
+
+	def record(self, kind, key, params=None):
+		"""
+		counts a request for a book
+
+		:param kind: `ISBN` or `GOODREADS`
+		:param key: isbn or goodreads id of the book
+		:type key: str
+		:param params: json serializable parameters needed to refresh the book
+		:type params: dict
+		"""
+		if not self.enabled or not key:
+			return
+		with self._lock:
+			hits, _ = self._pending.get((kind, key), (0, None))
+			self._pending[(kind, key)] = (hits + 1, params)
+			due = time.time() - self._last_flush >= self.flush_interval
+			if due:
+				self._last_flush = time.time()
+		if due:
+			worker_pool.submit(self.flush)
+
+	def flush(self):
+		"""writes the hits counted so far"""
+		with self._lock:
+			pending, self._pending = self._pending, dict()
+		if not pending:
+			return
+		now = int(time.time() * 1000)
+		keys = sorted(pending)
+		try:
+			with self.connections.connection() as connection:
+				cursor = connection.cursor()
+				cursor.execute(
+					'INSERT INTO book_hits (kind, key, hits, score, params, last_hit_at) '
+					'SELECT h.kind, h.key, h.hits, h.hits, h.params::JSONB, %s '
+					'FROM unnest(%s::TEXT[], %s::TEXT[], %s::BIGINT[], %s::TEXT[]) AS h (kind, key, hits, params) '
+					'ON CONFLICT (kind, key) DO UPDATE SET '
+					'hits = book_hits.hits + EXCLUDED.hits, '
+					'score = book_hits.score * power(0.5, (EXCLUDED.last_hit_at - book_hits.last_hit_at) / %s) '
+					'+ EXCLUDED.score, '
+					'params = COALESCE(EXCLUDED.params, book_hits.params), last_hit_at = EXCLUDED.last_hit_at',
+					(
+						now, [kind for kind, _ in keys], [key for _, key in keys],
+						[pending[key][0] for key in keys],
+						[json.dumps(pending[key][1]) if pending[key][1] is not None else None for key in keys],
+						self.half_life * 1000.0
+					)
+				)
+		except psycopg2.DatabaseError as e:
+			logger.warning('Failed to record {n} book hit(s): {e}'.format(n=len(keys), e=e))
+
+	def top(self, kind, limit):
+		"""
+		:param kind: `ISBN` or `GOODREADS`
+		:param limit: number of books
+		:type limit: int
+		:return: list of `tuple[str, dict]`, the key and params of the hottest books, hottest first
+		"""
+		with self.connections.connection() as connection:
+			cursor = connection.cursor()
+			cursor.execute(
+				'SELECT key, params FROM book_hits WHERE kind = %s '
+				'ORDER BY score * power(0.5, (%s - last_hit_at) / %s) DESC LIMIT %s',
+				(kind, int(time.time() * 1000), self.half_life * 1000.0, limit)
+			)
+			return [(key, params or dict()) for key, params in cursor.fetchall()]
+
+	def metrics(self):
+		return dict(pending=len(self._pending), half_life=self.half_life, flush_interval=self.flush_interval)
+
+
+hit_tracker = HitTracker()
@@ -0,0 +1,138 @@
+import time
+
+import psycopg2
+from flask import g
+
+from Bibliognost import db_connection, get_logger
+from connection import RequestConnection
+from ..goodreads import book_meta_service
+from ..jobs import job_queue
+from ..reviews import REVIEWS_JOB
+from ..store import book_store
+from .hits import ISBN, GOODREADS, hit_tracker
+
+logger = get_logger('prewarmer')
+
+
+class Prewarmer(object):
+	"""
+	Keeps the data of the hottest books fresh before anyone asks for it again.
+
+	Every `interval` seconds the metadata of the `top_n` most requested books
+	is looked up again if it's older than `refresh_age` seconds, revalidating the
+	response cached by the goodreads client, and a reviews job is queued for the
+	`top_n` most requested isbns without one done in that time. The job workers scrape and score them, which also refreshes the review
+	ledger and the sentiment cache, so the books stay warm as long as
+	`refresh_age` is below `JOB_RESULT_TTL`, `REVIEW_PAGE_TTL` and `BOOK_STORE_TTL`.
+
+	At most `concurrency` lookups are in flight, and at most `concurrency`
+	reviews jobs are queued or running, including the ones queued by requests.
+	"""
+
+	def __init__(self, tracker=hit_tracker, queue=job_queue, top_n=50, interval=15 * 60, concurrency=4,
+				 refresh_age=3 * 60 * 60):
+		"""
+		:param tracker: counter of the requests for every book
+		:type tracker: HitTracker
+		:param queue: queue the reviews jobs are queued in
+		:type queue: JobQueue
+		:param top_n: number of books kept warm, of every kind
+		:type top_n: int
+		:param interval: seconds between two rounds
+		:type interval: int
+		:param concurrency: maximum number of lookups in flight and of reviews jobs queued or running
+		:type concurrency: int
+		:param refresh_age: seconds after which the data of a book is refreshed
+		:type refresh_age: int
+		"""
+		self.tracker = tracker
+		self.queue = queue
+		self.top_n = top_n
+		self.interval = interval
+		self.concurrency = concurrency
+		self.refresh_age = refresh_age
+
+	def init_app(self, app):
+		self.top_n = app.config.get('PREWARM_TOP_N', self.top_n)
+		self.interval = app.config.get('PREWARM_INTERVAL', self.interval)
+		self.concurrency = app.config.get('PREWARM_CONCURRENCY', self.concurrency)
+		self.refresh_age = app.config.get('PREWARM_REFRESH_AGE', self.refresh_age)
+
+	def warm_books(self):
+		"""
+		:return: `int`, number of books looked up again
+		"""
+		book_ids = [book_id for book_id, _ in self.tracker.top(GOODREADS, self.top_n)]
+		fresh = book_store.load_books(book_ids, max_age=self.refresh_age)
+		refreshed = 0
+		for book_id, future in book_meta_service.iter_books(
+			[book_id for book_id in book_ids if book_id not in fresh], max_concurrency=self.concurrency, revalidate=True
+		):
+			try:
+				book_store.save_books([future.result()])
+				refreshed += 1
+			except Exception as e:
+				logger.warning('Failed to refresh book {id}: {e}'.format(id=book_id, e=e))
+		return refreshed
+
+	def warm_reviews(self):
+		"""
+		:return: `int`, number of reviews jobs queued
+		"""
+		books = self.tracker.top(ISBN, self.top_n)
+		active = self.queue.active_keys(REVIEWS_JOB)
+		done = self.queue.done_keys(
+			REVIEWS_JOB, [isbn for isbn, _ in books], int((time.time() - self.refresh_age) * 1000)
+		)
+		budget = self.concurrency - len(active)
+		queued = 0
+		for isbn, params in books:
+			if queued >= budget:
+				break
+			if isbn in active or isbn in done:
+				continue
+			self.queue.enqueue(
+				REVIEWS_JOB, isbn, dict(isbn=isbn, url=params.get('url'), num_reviews=params.get('num_reviews', 30))
+			)
+			queued += 1
+		return queued
+
+	def run_once(self, app):
+		"""
+		runs a round in an app context, with a pooled connection on `g.db` for the book store
+
+		:param app: app the round runs in the context of
+		:type app: flask.Flask
+		"""
+		start = time.time()
+		books = jobs = 0
+		try:
+			with app.app_context():
+				g.db = RequestConnection(db_connection)
+				error = None
+				try:
+					books = self.warm_books()
+					jobs = self.warm_reviews()
+				except Exception as e:
+					error = e
+					raise
+				finally:
+					g.db.release(error)
+		finally:
+			logger.info('Prewarmed {books} book(s) and queued {jobs} reviews job(s) in {t:.2f} s'.format(
+				books=books, jobs=jobs, t=time.time() - start
+			))
+
+	def run(self, app):
+		"""runs a round every `interval` seconds until the process is stopped"""
+		while True:
+			try:
+				self.run_once(app)
+			except psycopg2.OperationalError as e:
+				logger.warning('Prewarming skipped, database unavailable: {e}'.format(e=e))
+			except Exception:
+				logger.exception('Prewarming failed')
+			time.sleep(self.interval)
+
+
+prewarmer = Prewarmer()
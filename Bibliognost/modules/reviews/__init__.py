@@ -0,0 +1,5 @@
+from .ledger import ReviewLedger, LedgerPage, review_ledger
+from .aggregator import SOURCES, ReviewAggregator, review_aggregator
+from .dedup import DedupRun, ReviewDedupIndex, review_dedup
+from .summary import SentimentSummaries, sentiment_summaries
+from .pipeline import REVIEWS_JOB, collect_reviews, store_reviews, iter_scored_pages, summarize, run_reviews_job
@@ -0,0 +1,131 @@
+import asyncio
+import queue
+import time
+from functools import partial
+
+from Bibliognost import get_logger
+from ..amazon import AmazonBot
+from ..goodreads import GoodReadsBot
+from ..scraper import review_fetcher, successful_pages
+from .ledger import review_ledger
+
+logger = get_logger('reviewaggregator')
+
+SOURCES = ('amazon', 'goodreads')
+
+
+class ReviewAggregator(object):
+	"""
+	Collects the reviews of a book from every source concurrently,
+	as coroutines on the event loop of a `ReviewFetcher`, fetching
+	only the pages missing or stale in the `ReviewLedger`.
+	"""
+
+	def __init__(self, fetcher=review_fetcher, ledger=review_ledger, goodreads_max_pages=None, goodreads_concurrency=5,
+				 parsers=None):
+		"""
+		:param fetcher: fetcher whose event loop and session are used for the requests
+		:type fetcher: Bibliognost.modules.scraper.ReviewFetcher
+		:param ledger: ledger of the review pages already fetched
+		:type ledger: ReviewLedger
+		:param goodreads_max_pages: maximum number of goodreads review pages fetched for a book
+		:type goodreads_max_pages: int
+		:param goodreads_concurrency: maximum number of goodreads review pages of a book fetched at a time
+		:type goodreads_concurrency: int
+		:param parsers: parser of every source, 'soup' or 'xpath', see `AmazonBot` and `GoodReadsBot`
+		:type parsers: dict[str, str]
+		"""
+		self.fetcher = fetcher
+		self.ledger = ledger
+		self.goodreads_max_pages = goodreads_max_pages
+		self.goodreads_concurrency = goodreads_concurrency
+		self.parsers = dict(amazon='soup', goodreads='soup', **(parsers or dict()))
+
+	def init_app(self, app):
+		self.goodreads_max_pages = app.config.get('GOODREADS_REVIEW_MAX_PAGES', self.goodreads_max_pages)
+		self.goodreads_concurrency = app.config.get('GOODREADS_REVIEW_CONCURRENCY', self.goodreads_concurrency)
+		self.parsers.update(app.config.get('REVIEW_PARSERS', dict()))
+		self.ledger.init_app(app)
+
+	async def fetch_pages(self, isbn, url, num_reviews, stored=None, on_page=None):
+		"""
+		fetches the amazon and goodreads review pages of a book at the same time
+
+		:param isbn: isbn of the book, used for amazon
+		:type isbn: str
+		:param url: goodreads url of the book
+		:type url: str
+		:param num_reviews: number of text reviews of the book on goodreads
+		:type num_reviews: int
+		:param stored: pages of every source already in the ledger, fresh ones are not fetched again
+		:type stored: dict[str, dict[int, LedgerPage]]
+		:param on_page: called on the event loop with the source, number, and reviews or exception of every page
+		:return: dict with the number of pages and the fetch result of every page for every source,
+				 the number of pages is None for a source which failed altogether
+		"""
+		stored = stored or dict()
+		amazon_stored = stored.get('amazon', dict())
+		goodreads_stored = stored.get('goodreads', dict())
+		start = time.time()
+		results = await asyncio.gather(
+			AmazonBot(isbn, fetcher=self.fetcher, parser=self.parsers['amazon']).fetch_pages(
+				skip=self.ledger.fresh_pages(amazon_stored), num_pages=self.ledger.known_num_pages(amazon_stored),
+				on_page=partial(on_page, 'amazon') if on_page else None
+			),
+			GoodReadsBot(
+				url, num_reviews, fetcher=self.fetcher,
+				max_pages=self.goodreads_max_pages, concurrency=self.goodreads_concurrency,
+				parser=self.parsers['goodreads']
+			).fetch_pages(
+				skip=self.ledger.fresh_pages(goodreads_stored), on_page=partial(on_page, 'goodreads') if on_page else None
+			),
+			return_exceptions=True
+		)
+		pages = dict()
+		for source, result in zip(SOURCES, results):
+			if isinstance(result, Exception):
+				logger.error('Failed to fetch {s} reviews: {e!r}'.format(s=source, e=result))
+				result = None, dict()
+			pages[source] = result
+		logger.info('Fetched reviews from all the sources in: {t} s'.format(t=time.time() - start))
+		return pages
+
+	def iter_pages(self, isbn, url, num_reviews):
+		"""
+		Yields the review pages of a book from all the sources as soon as they're available, for the request threads.
+
+		Pages fresh in the ledger come first, the rest as they are fetched on the
+		event loop of the fetcher. Once every page is fetched, the fetched pages
+		are recorded in the ledger, and the pages which couldn't be fetched again
+		are served from it, even if they're stale.
+
+		:return: generator of `tuple[str, int, list[dict]]`, the source, number and reviews of every page
+		"""
+		book_keys = dict(amazon=isbn, goodreads=url)
+		stored = {source: self.ledger.load(source, book_keys[source]) for source in SOURCES}
+		fresh = {source: self.ledger.fresh_pages(stored[source]) for source in SOURCES}
+		for source in SOURCES:
+			for page_no in sorted(fresh[source]):
+				if page_no <= stored[source][page_no].num_pages:
+					yield source, page_no, stored[source][page_no].reviews
+
+		finished = queue.Queue()
+		future = self.fetcher.submit(self.fetch_pages(
+			isbn, url, num_reviews, stored, on_page=lambda *page: finished.put(page)
+		))
+		future.add_done_callback(lambda done: finished.put(None))
+		for source, page_no, result in iter(finished.get, None):
+			if result and not isinstance(result, Exception):
+				yield source, page_no, result
+
+		fetched = future.result()
+		for source in SOURCES:
+			num_pages, results = fetched[source]
+			pages = successful_pages(results)
+			self.ledger.record(source, book_keys[source], num_pages, pages)
+			for page_no, page in sorted(stored[source].items()):
+				if page_no not in fresh[source] and page_no not in pages and (num_pages is None or page_no <= num_pages):
+					yield source, page_no, page.reviews
+
+
+review_aggregator = ReviewAggregator()
@@ -0,0 +1,272 @@
+import hashlib
+import re
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+import psycopg2
+from flask import g, has_app_context
+
+from Bibliognost import get_logger
+from Bibliognost.models import upsert_fingerprints, fetch_fingerprints
+from connection import savepoint
+
+logger = get_logger('dedup')
+
+#: number of bits of a simhash, and of the bands it's split into for the lookup of near duplicates
+SIMHASH_BITS = 64
+SIMHASH_BANDS = 8
+#: maximum number of differing bits of two near duplicates, below SIMHASH_BANDS
+#: so two near duplicates always have a band in common
+MAX_DISTANCE = 6
+#: reviews with fewer words are only matched exactly, their simhash isn't telling
+MIN_WORDS = 12
+
+_NON_WORD = re.compile(r'[\W_]+', re.UNICODE)
+_BAND_MASK = (1 << (SIMHASH_BITS // SIMHASH_BANDS)) - 1
+
+
+def normalize(text):
+	"""
+	:return: `str`, the text lowercased, without punctuation and with single spaces
+	"""
+	return _NON_WORD.sub(' ', (text or '').lower()).strip()
+
+
+def exact_hash(words):
+	"""
+	:param words: words of the normalized text
+	:type words: list[str]
+	:return: `str`, hex digest
+	"""
+	return hashlib.sha1(' '.join(words).encode('utf-8')).hexdigest()
+
+
+def simhash(words):
+	"""
+	Every bit of the simhash is the majority of that bit among the hashes of
+	the distinct words of the text, so texts differing in a few words differ in
+	a few bits. Repeated words count once, or the most common ones would make
+	unrelated reviews look alike
+
+	:param words: words of the normalized text
+	:type words: list[str]
+	:return: `int`, unsigned
+	"""
+	words = set(words)
+	digests = b''.join(hashlib.md5(word.encode('utf-8')).digest()[:SIMHASH_BITS // 8] for word in words)
+	bits = np.unpackbits(np.frombuffer(digests, dtype=np.uint8)).reshape(len(words), SIMHASH_BITS)
+	majority = bits.sum(axis=0) * 2 > len(words)
+	return int.from_bytes(np.packbits(majority).tobytes(), 'big')
+
+
+def _bands(value):
+	return [(band, (value >> (band * SIMHASH_BITS // SIMHASH_BANDS)) & _BAND_MASK) for band in range(SIMHASH_BANDS)]
+
+
+def _to_signed(value):
+	if value is None:
+		return None
+	return value - (1 << SIMHASH_BITS) if value >= 1 << (SIMHASH_BITS - 1) else value
+
+
+def _to_unsigned(value):
+	if value is None:
+		return None
+	return value + (1 << SIMHASH_BITS) if value < 0 else value
+
+
+class _Fingerprint(object):
+	__slots__ = ('exact_hash', 'simhash', 'sources', 'review', 'changed')
+
+	def __init__(self, exact_hash, simhash, sources):
+		self.exact_hash = exact_hash
+		self.simhash = simhash
+		self.sources = set(sources)
+		self.review = None
+		self.changed = False
+
+
+class DedupRun(object):
+	"""
+	Drops the duplicate reviews of a book while its pages come in, for a single
+	request or job.
+
+	The first occurrence of a review is kept and labeled with the `sources` it
+	was seen on, including the ones remembered from earlier runs, later
+	occurrences on any page of any source are dropped and add their source to
+	the label of the kept one. A review is a duplicate if its normalized text is
+	the same, or if their simhashes differ in at most `MAX_DISTANCE` bits.
+	"""
+
+	def __init__(self, fingerprints=()):
+		"""
+		:param fingerprints: exact hash, simhash, None for short reviews, and sources of the reviews seen before
+		:type fingerprints: list[tuple[str, int, list[str]]]
+		"""
+		self._exact = dict()
+		self._bands = dict()
+		self.dropped = 0
+		for exact, value, sources in fingerprints:
+			self._add(_Fingerprint(exact, _to_unsigned(value), sources))
+
+	def _add(self, fingerprint):
+		self._exact[fingerprint.exact_hash] = fingerprint
+		if fingerprint.simhash is not None:
+			for band in _bands(fingerprint.simhash):
+				self._bands.setdefault(band, []).append(fingerprint)
+
+	def _match(self, exact, value):
+		fingerprint = self._exact.get(exact)
+		if fingerprint is not None or value is None:
+			return fingerprint
+		for band in _bands(value):
+			for candidate in self._bands.get(band, ()):
+				if bin(candidate.simhash ^ value).count('1') <= MAX_DISTANCE:
+					return candidate
+
+	def filter(self, source, reviews):
+		"""
+		:param source: name of the source of the reviews
+		:type source: str
+		:param reviews: scraped reviews of a page
+		:type reviews: list[dict]
+		:return: `list[dict]`, the reviews which weren't seen in this run yet, labeled with their `sources`
+		"""
+		kept = []
+		for review in reviews:
+			words = normalize(review.get('body')).split()
+			if not words:
+				review['sources'] = [source]
+				kept.append(review)
+				continue
+			exact = exact_hash(words)
+			value = simhash(words) if len(words) >= MIN_WORDS else None
+			fingerprint = self._match(exact, value)
+			if fingerprint is None:
+				fingerprint = _Fingerprint(exact, value, ())
+				fingerprint.changed = True
+				self._add(fingerprint)
+			elif fingerprint.exact_hash != exact:
+				self._exact[exact] = fingerprint
+			if source not in fingerprint.sources:
+				fingerprint.sources.add(source)
+				fingerprint.changed = True
+			if fingerprint.review is None:
+				fingerprint.review = review
+				kept.append(review)
+			else:
+				self.dropped += 1
+			fingerprint.review['sources'] = sorted(fingerprint.sources)
+		return kept
+
+	def changes(self):
+		"""
+		:return: list of the fingerprints added or updated by this run, as stored by `upsert_fingerprints`
+		"""
+		seen = set()
+		rows = []
+		for fingerprint in self._exact.values():
+			if fingerprint.changed and id(fingerprint) not in seen:
+				seen.add(id(fingerprint))
+				rows.append((
+					fingerprint.exact_hash, _to_signed(fingerprint.simhash), sorted(fingerprint.sources)
+				))
+		return rows
+
+
+class ReviewDedupIndex(object):
+	"""
+	Index of the review fingerprints of every book, persisting across requests.
+
+	The fingerprints of the `max_size` most recently deduplicated books are
+	kept in memory for `ttl` seconds, and all of them in the `review_fingerprints`
+	table, through the connection of the request. With `enabled` False every
+	run starts from scratch and nothing is stored.
+	"""
+
+	def __init__(self, max_size=1000, ttl=60, enabled=True):
+		"""
+		:param max_size: maximum number of books kept in memory
+		:type max_size: int
+		:param ttl: seconds the fingerprints of a book are served from memory
+		:type ttl: int
+		:param enabled: if False, the fingerprints are neither loaded nor stored
+		:type enabled: bool
+		"""
+		self.max_size = max_size
+		self.ttl = ttl
+		self.enabled = enabled
+		self._entries = OrderedDict()
+		self._lock = threading.Lock()
+		self._stats = dict(runs=0, dropped=0, hits=0, misses=0)
+
+	def init_app(self, app):
+		self.max_size = app.config.get('REVIEW_DEDUP_CACHE_SIZE', self.max_size)
+		self.ttl = app.config.get('REVIEW_DEDUP_TTL', self.ttl)
+		self.enabled = app.config.get('REVIEW_DEDUP_STORE', self.enabled)
+
+	def _connection(self):
+		if self.enabled and has_app_context():
+			return getattr(g, 'db', None)
+
+	def _load(self, isbn):
+		with self._lock:
+			entry = self._entries.get(isbn)
+			if entry is not None and time.time() - entry[0] < self.ttl:
+				self._stats['hits'] += 1
+				return entry[1]
+			self._stats['misses'] += 1
+		connection = self._connection()
+		if connection is None:
+			return []
+		try:
+			with savepoint(connection):
+				fingerprints = fetch_fingerprints(isbn)
+		except psycopg2.DatabaseError as e:
+			logger.warning('Failed to read the review fingerprints: {e}'.format(e=e))
+			return []
+		self._remember(isbn, fingerprints)
+		return fingerprints
+
+	def _remember(self, isbn, fingerprints):
+		with self._lock:
+			self._entries[isbn] = (time.time(), fingerprints)
+			self._entries.move_to_end(isbn)
+			while len(self._entries) > self.max_size:
+				self._entries.popitem(last=False)
+
+	def start(self, isbn):
+		"""
+		:param isbn: isbn of the book
+		:type isbn: str
+		:return: DedupRun, knowing the reviews of the book seen in earlier runs
+		"""
+		self._stats['runs'] += 1
+		return DedupRun(self._load(isbn) if isbn and self.enabled else ())
+
+	def finish(self, isbn, run):
+		"""
+		stores the fingerprints added or updated by a run
+
+		:type run: DedupRun
+		"""
+		self._stats['dropped'] += run.dropped
+		connection = self._connection()
+		rows = run.changes()
+		if connection is None or not isbn or not rows:
+			return
+		with self._lock:
+			self._entries.pop(isbn, None)
+		try:
+			with savepoint(connection):
+				upsert_fingerprints(isbn, rows, int(time.time() * 1000))
+		except psycopg2.DatabaseError as e:
+			logger.warning('Failed to store the review fingerprints: {e}'.format(e=e))
+
+	def metrics(self):
+		return dict(self._stats, size=len(self._entries), max_size=self.max_size)
+
+
+review_dedup = ReviewDedupIndex()
@@ -0,0 +1,145 @@
+import hashlib
+import json
+import time
+from collections import namedtuple
+
+import psycopg2
+from flask import g, has_app_context
+
+from Bibliognost import get_logger
+from connection import savepoint
+
+logger = get_logger('reviewledger')
+
+#: A review page stored in the ledger
+LedgerPage = namedtuple('LedgerPage', ('page_no', 'num_pages', 'fetched_at', 'content_hash', 'reviews'))
+
+
+def content_hash(reviews):
+	"""
+	Returns the hash of the reviews of a page, to tell whether a page changed between two fetches
+
+	:param reviews: reviews of a page
+	:type reviews: list[dict]
+	:return: `str`, hex digest
+	"""
+	return hashlib.sha1(json.dumps(reviews, sort_keys=True).encode('utf-8')).hexdigest()
+
+
+class ReviewLedger(object):
+	"""
+	Remembers, per source and book, which review pages were fetched successfully,
+	when, with what content hash, and their reviews, in the `review_pages` table.
+
+	Pages fetched less than `ttl` seconds ago are served from the ledger, only the
+	missing and stale pages are fetched again. Pages which failed are never recorded,
+	so the next request for the same book retries exactly those.
+
+	It uses the connection opened for the request by `PostgresConnection`,
+	outside of a request every page is treated as missing.
+	"""
+
+	def __init__(self, ttl=6 * 60 * 60, enabled=True):
+		"""
+		:param ttl: seconds after which a stored page is fetched again
+		:type ttl: int
+		:param enabled: if False, nothing is stored or served from the ledger
+		:type enabled: bool
+		"""
+		self.ttl = ttl
+		self.enabled = enabled
+
+	def init_app(self, app):
+		self.ttl = app.config.get('REVIEW_PAGE_TTL', self.ttl)
+		self.enabled = app.config.get('REVIEW_LEDGER', self.enabled)
+
+	def _connection(self):
+		if self.enabled and has_app_context():
+			return getattr(g, 'db', None)
+
+	def load(self, source, book_key):
+		"""
+		fetches the stored pages of a book
+
+		:param source: name of the review source, i.e. 'amazon' or 'goodreads'
+		:type source: str
+		:param book_key: identifier of the book for that source
+		:type book_key: str
+		:return: `dict[int, LedgerPage]` keyed by page number
+		"""
+		connection = self._connection()
+		if connection is None or not book_key:
+			return dict()
+		try:
+			with savepoint(connection):
+				cursor = connection.cursor()
+				cursor.execute(
+					'SELECT page_no, num_pages, fetched_at, content_hash, reviews FROM review_pages '
+					'WHERE source = %s AND book_key = %s',
+					(source, book_key)
+				)
+				return {row[0]: LedgerPage(*row) for row in cursor.fetchall()}
+		except psycopg2.DatabaseError as e:
+			logger.warning('Failed to read the review ledger: {e}'.format(e=e))
+			return dict()
+
+	def fresh_pages(self, stored):
+		"""
+		Returns the stored pages which don't have to be fetched again
+
+		:param stored: pages returned by `load`
+		:type stored: dict[int, LedgerPage]
+		:return: set[int]
+		"""
+		oldest = (time.time() - self.ttl) * 1000
+		return {page_no for page_no, page in stored.items() if page.fetched_at >= oldest}
+
+	def known_num_pages(self, stored):
+		"""
+		Returns the number of pages of the book if the first page is fresh, else None
+
+		:param stored: pages returned by `load`
+		:type stored: dict[int, LedgerPage]
+		:return: int
+		"""
+		if 1 in self.fresh_pages(stored):
+			return stored[1].num_pages
+
+	def record(self, source, book_key, num_pages, pages):
+		"""
+		stores the pages which were fetched successfully
+
+		:param source: name of the review source
+		:type source: str
+		:param book_key: identifier of the book for that source
+		:type book_key: str
+		:param num_pages: number of review pages of the book at the time of the fetch
+		:type num_pages: int
+		:param pages: reviews of every successfully fetched page, keyed by page number
+		:type pages: dict[int, list[dict]]
+		"""
+		connection = self._connection()
+		if connection is None or not book_key or not pages:
+			return
+		page_numbers = sorted(pages)
+		try:
+			with savepoint(connection):
+				cursor = connection.cursor()
+				cursor.execute(
+					'INSERT INTO review_pages (source, book_key, page_no, num_pages, fetched_at, content_hash, reviews) '
+					'SELECT %s, %s, page_no, %s, %s, content_hash, reviews::JSONB '
+					'FROM unnest(%s::INT[], %s::TEXT[], %s::TEXT[]) AS p (page_no, content_hash, reviews) '
+					'ON CONFLICT (source, book_key, page_no) DO UPDATE SET '
+					'num_pages = EXCLUDED.num_pages, fetched_at = EXCLUDED.fetched_at, '
+					'content_hash = EXCLUDED.content_hash, reviews = EXCLUDED.reviews',
+					(
+						source, book_key, num_pages, int(time.time() * 1000), page_numbers,
+						[content_hash(pages[page_no]) for page_no in page_numbers],
+						[json.dumps(pages[page_no]) for page_no in page_numbers]
+					)
+				)
+		except psycopg2.DatabaseError as e:
+			logger.warning('Failed to update the review ledger: {e}'.format(e=e))
+
+
+review_ledger = ReviewLedger()
@@ -0,0 +1,104 @@
+import time
+
+from ..scraper import merge_pages
+from ..sent_analysis.ScoringService import scoring_service
+from ..store import book_store
+from .aggregator import SOURCES, review_aggregator
+from .dedup import review_dedup
+from .summary import sentiment_summaries
+
+#: kind of the background job running `collect_reviews`
+REVIEWS_JOB = 'reviews'
+
+
+def score_reviews(reviews):
+	"""
+	adds the probability of being positive to every review, as `sentiment`
+
+	:param reviews: list of scraped reviews
+	:type reviews: list[dict]
+	:return: the same list
+	"""
+	sentiments = scoring_service.predict_sentiment([review.get('body') for review in reviews])
+	for review, sentiment in zip(reviews, sentiments):
+		review['sentiment'] = float(sentiment)
+	return reviews
+
+
+def iter_scored_pages(isbn, url, num_reviews):
+	"""
+	same as `ReviewAggregator.iter_pages`, with the duplicate reviews dropped
+	before the reviews of every page are scored, see `DedupRun`
+
+	:return: generator of `tuple[str, int, list[dict]]`, the source, number and reviews of every page
+	"""
+	run = review_dedup.start(isbn)
+	for source, page_no, reviews in review_aggregator.iter_pages(isbn, url, num_reviews):
+		yield source, page_no, score_reviews(run.filter(source, reviews))
+	review_dedup.finish(isbn, run)
+
+
+def summarize(pages, start):
+	"""
+	:param pages: reviews of every page of every source
+	:type pages: dict[str, dict[int, list[dict]]]
+	:param start: time the pipeline started at
+	:type start: float
+	:return: dict with the number of reviews and the pages of every source
+	"""
+	counts = {source: sum(len(reviews) for reviews in source_pages.values()) for source, source_pages in pages.items()}
+	return dict(
+		counts,
+		num_reviews=sum(counts.values()),
+		pages={source: sorted(source_pages) for source, source_pages in pages.items()},
+		elapsed=time.time() - start
+	)
+
+
+def store_reviews(isbn, reviews):
+	"""
+	stores the scored reviews of a book, and counts the new ones in its sentiment summaries
+
+	:param reviews: list of scored reviews of every source
+	:type reviews: dict[str, list[dict]]
+	"""
+	new_reviews = book_store.save_reviews(isbn, reviews)
+	sentiment_summaries.update(isbn, reviews, new_reviews)
+
+
+def collect_reviews(isbn, url, num_reviews, on_page=None):
+	"""
+	Fetches and scores the reviews of a book from all the sources, and stores them
+
+	:param on_page: called with the source, number and scored reviews of every page as soon as it's done
+	:return: `tuple[dict, dict]`, the list of reviews of every source and the summary, see `summarize`
+	"""
+	start = time.time()
+	pages = {source: dict() for source in SOURCES}
+	for source, page_no, reviews in iter_scored_pages(isbn, url, num_reviews):
+		pages[source][page_no] = reviews
+		if on_page is not None:
+			on_page(source, page_no, reviews)
+	reviews = {source: merge_pages(source_pages) for source, source_pages in pages.items()}
+	store_reviews(isbn, reviews)
+	return reviews, summarize(pages, start)
+
+
+def run_reviews_job(params, report_progress):
+	"""
+	handler of the `REVIEWS_JOB` background jobs
+
+	:param params: isbn, url and num_reviews of the book
+	:type params: dict
+	:param report_progress: called with the summary of the pages done so far
+	:return: dict, same as the response of /reviews
+	"""
+	start = time.time()
+	pages = {source: dict() for source in SOURCES}
+
+	def on_page(source, page_no, page_reviews):
+		pages[source][page_no] = page_reviews
+		report_progress(summarize(pages, start))
+
+	reviews, summary = collect_reviews(params.get('isbn'), params.get('url'), params.get('num_reviews'), on_page)
+	return dict(reviews, num_reviews=summary['num_reviews'])
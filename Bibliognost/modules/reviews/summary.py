@@ -0,0 +1,206 @@
+import copy
+import threading
+import time
+from collections import OrderedDict
+
+import psycopg2
+from flask import g, has_app_context
+
+from Bibliognost import get_logger
+from Bibliognost.models import upsert_summaries, fetch_summaries
+from connection import savepoint
+from dateparser import parse_review_date
+from ..sent_analysis.fastClassifier import model_registry
+
+logger = get_logger('summary')
+
+#: number of equal width buckets the sentiments are counted in, for the histogram
+SENTIMENT_BUCKETS = 5
+#: key of the histogram row of the reviews without a star rating
+UNRATED = 'unrated'
+
+
+def empty_summary(model_version):
+	"""
+	:param model_version: version of the model the sentiments were computed by
+	:type model_version: str
+	:return: dict, the summary of no reviews
+	"""
+	return dict(model_version=model_version, count=0, sentiment_sum=0.0, positive=0, histogram=dict(), trend=dict())
+
+
+def add_reviews(summary, reviews):
+	"""
+	counts scored reviews in a summary, in place. Every counter is a sum, so
+	adding the new reviews of a book to its summary is the same as summarizing
+	all of its reviews again
+
+	:param summary: summary, see `empty_summary`
+	:type summary: dict
+	:param reviews: reviews with their `sentiment`, the ones without are skipped
+	:type reviews: list[dict]
+	:return: the same summary
+	"""
+	for review in reviews:
+		sentiment = review.get('sentiment')
+		if sentiment is None:
+			continue
+		summary['count'] += 1
+		summary['sentiment_sum'] += sentiment
+		summary['positive'] += sentiment >= 0.5
+		try:
+			rating = str(int(review.get('rating')))
+		except (TypeError, ValueError):
+			rating = UNRATED
+		row = summary['histogram'].setdefault(rating, [0] * SENTIMENT_BUCKETS)
+		row[min(int(sentiment * SENTIMENT_BUCKETS), SENTIMENT_BUCKETS - 1)] += 1
+		date = parse_review_date(review.get('date'))
+		if date is not None:
+			month = summary['trend'].setdefault(date.strftime('%Y-%m'), [0, 0.0])
+			month[0] += 1
+			month[1] += sentiment
+	return summary
+
+
+def describe(summary):
+	"""
+	:param summary: summary, see `empty_summary`
+	:type summary: dict
+	:return: dict, the summary with the mean sentiment, overall and per month, for the clients
+	"""
+	count = summary['count']
+	return dict(
+		model_version=summary['model_version'],
+		count=count,
+		mean=summary['sentiment_sum'] / count if count else None,
+		positive=summary['positive'] / count if count else None,
+		histogram=summary['histogram'],
+		trend=[
+			dict(month=month, count=month_count, mean=month_sum / month_count)
+			for month, (month_count, month_sum) in sorted(summary['trend'].items())
+		]
+	)
+
+
+class SentimentSummaries(object):
+	"""
+	Sentiment of every book per source: the mean, a histogram of the star
+	ratings against the sentiments and the mean sentiment of every month.
+
+	The summaries are updated with the reviews stored for the first time only,
+	they're rebuilt from all the reviews at hand when the book has no summary
+	yet, the sentiment model changed, or the new reviews aren't known because
+	the book store is disabled. The `max_size` most recently used summaries are
+	kept in memory for `ttl` seconds, the other workers may update them in the
+	meantime, and all of them in the `sentiment_summaries` table, through the
+	connection of the request. Updates merge the new reviews into the stored
+	summaries, locked until the request commits, so the concurrent updates of
+	other workers aren't lost.
+	"""
+
+	def __init__(self, max_size=10000, ttl=60, enabled=True):
+		"""
+		:param max_size: maximum number of books kept in memory
+		:type max_size: int
+		:param ttl: seconds a summary is served from memory
+		:type ttl: int
+		:param enabled: if False, the summaries are kept in memory only
+		:type enabled: bool
+		"""
+		self.max_size = max_size
+		self.ttl = ttl
+		self.enabled = enabled
+		self._entries = OrderedDict()
+		self._lock = threading.Lock()
+		self._stats = dict(hits=0, misses=0, updates=0, rebuilds=0)
+
+	def init_app(self, app):
+		self.max_size = app.config.get('SENTIMENT_SUMMARY_CACHE_SIZE', self.max_size)
+		self.ttl = app.config.get('SENTIMENT_SUMMARY_TTL', self.ttl)
+		self.enabled = app.config.get('SENTIMENT_SUMMARY_STORE', self.enabled)
+
+	def _connection(self):
+		if self.enabled and has_app_context():
+			return getattr(g, 'db', None)
+
+	def _remember(self, isbn, summaries):
+		with self._lock:
+			self._entries[isbn] = (time.time(), summaries)
+			self._entries.move_to_end(isbn)
+			while len(self._entries) > self.max_size:
+				self._entries.popitem(last=False)
+
+	def _load(self, isbn):
+		with self._lock:
+			entry = self._entries.get(isbn)
+			if entry is not None and time.time() - entry[0] < self.ttl:
+				self._stats['hits'] += 1
+				self._entries.move_to_end(isbn)
+				return entry[1]
+			self._stats['misses'] += 1
+		connection = self._connection()
+		if connection is None:
+			return entry[1] if entry is not None else dict()
+		try:
+			with savepoint(connection):
+				summaries = fetch_summaries(isbn)
+		except psycopg2.DatabaseError as e:
+			logger.warning('Failed to read the sentiment summaries: {e}'.format(e=e))
+			return entry[1] if entry is not None else dict()
+		self._remember(isbn, summaries)
+		return summaries
+
+	def get(self, isbn):
+		"""
+		:param isbn: isbn of the book
+		:type isbn: str
+		:return: dict mapping every source with a summary to it, see `describe`
+		"""
+		if not isbn:
+			return dict()
+		return {source: describe(summary) for source, summary in self._load(isbn).items()}
+
+	def update(self, isbn, reviews, new_reviews=None):
+		"""
+		counts the scored reviews of a book in its summaries
+
+		:param isbn: isbn of the book
+		:type isbn: str
+		:param reviews: all the scored reviews of every source at hand
+		:type reviews: dict[str, list[dict]]
+		:param new_reviews: the ones among them which weren't counted yet, None if that's unknown
+		:type new_reviews: dict[str, list[dict]]
+		"""
+		if not isbn:
+			return
+		connection = self._connection()
+		if connection is None:
+			summaries = self._merge(copy.deepcopy(self._load(isbn)), reviews, new_reviews)
+			self._remember(isbn, summaries)
+			return
+		try:
+			with savepoint(connection):
+				summaries = self._merge(fetch_summaries(isbn, for_update=True), reviews, new_reviews)
+				upsert_summaries(isbn, summaries, int(time.time() * 1000))
+		except psycopg2.DatabaseError as e:
+			logger.warning('Failed to store the sentiment summaries: {e}'.format(e=e))
+		with self._lock:
+			self._entries.pop(isbn, None)
+
+	def _merge(self, summaries, reviews, new_reviews):
+		model_version = model_registry.version
+		for source, source_reviews in reviews.items():
+			summary = summaries.get(source)
+			if new_reviews is None or summary is None or summary['model_version'] != model_version:
+				summaries[source] = add_reviews(empty_summary(model_version), source_reviews)
+				self._stats['rebuilds'] += 1
+			else:
+				add_reviews(summary, new_reviews.get(source, []))
+				self._stats['updates'] += 1
+		return summaries
+
+	def metrics(self):
+		return dict(self._stats, size=len(self._entries), max_size=self.max_size)
+
+
+sentiment_summaries = SentimentSummaries()
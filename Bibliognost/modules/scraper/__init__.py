@@ -0,0 +1,3 @@
+from .ratelimit import Blocked, HostLimiter
+from .fetcher import ReviewFetcher, review_fetcher
+from .pages import successful_pages, merge_pages, notify_page
@@ -0,0 +1,200 @@
+import asyncio
+import atexit
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from urllib import parse
+
+import aiohttp
+
+from Bibliognost import get_logger
+from .ratelimit import Blocked, HostLimiter, backoff_delay
+
+logger = get_logger('reviewfetcher')
+
+
+class ReviewFetcher(object):
+	"""
+	Owns the event loop and the HTTP session used by the review bots.
+
+	Every process runs a single long-lived event loop in a background thread,
+	with one connection-pooled `aiohttp.ClientSession` kept alive between
+	requests. Coroutines are scheduled on it from the request threads with `submit`.
+
+	The requests to every host, from every bot, go through a single `HostLimiter`,
+	which adapts the request rate and concurrency to how many requests the host
+	blocks. Blocked and failed requests are retried with jittered exponential backoff.
+
+	Responses are parsed in a small thread pool instead of the loop thread,
+	so parsing a page doesn't hold up the requests of the other pages.
+	"""
+
+	def __init__(self, limit_per_host=10, keepalive_timeout=30, request_timeout=20,
+				 rate_per_host=5.0, max_rate_per_host=20.0, burst=5, max_retries=3, backoff=0.5, max_backoff=8.0,
+				 parse_workers=4):
+		"""
+		:param limit_per_host: maximum number of concurrent requests to a host
+		:type limit_per_host: int
+		:param keepalive_timeout: seconds an idle connection is kept open
+		:type keepalive_timeout: int
+		:param request_timeout: seconds after which a single request is abandoned
+		:type request_timeout: int
+		:param rate_per_host: initial number of requests per second to a host
+		:type rate_per_host: float
+		:param max_rate_per_host: maximum number of requests per second to a host
+		:type max_rate_per_host: float
+		:param burst: maximum number of requests sent back to back to a host
+		:type burst: int
+		:param max_retries: number of times a blocked or failed request is retried
+		:type max_retries: int
+		:param backoff: seconds before the first retry, doubled by every further retry
+		:type backoff: float
+		:param max_backoff: maximum seconds before a retry
+		:type max_backoff: float
+		:param parse_workers: number of threads parsing the responses
+		:type parse_workers: int
+		"""
+		self.limit_per_host = limit_per_host
+		self.keepalive_timeout = keepalive_timeout
+		self.request_timeout = request_timeout
+		self.rate_per_host = rate_per_host
+		self.max_rate_per_host = max_rate_per_host
+		self.burst = burst
+		self.max_retries = max_retries
+		self.backoff = backoff
+		self.max_backoff = max_backoff
+		self.parse_workers = parse_workers
+		self._loop = None
+		self._parse_executor = None
+		self._session = None
+		self._limiters = dict()
+		self._retries = 0
+		self._pid = None
+		self._lock = threading.Lock()
+
+	def init_app(self, app):
+		self.limit_per_host = app.config.get('REVIEW_FETCH_LIMIT_PER_HOST', self.limit_per_host)
+		self.keepalive_timeout = app.config.get('REVIEW_FETCH_KEEPALIVE', self.keepalive_timeout)
+		self.request_timeout = app.config.get('REVIEW_FETCH_TIMEOUT', self.request_timeout)
+		self.rate_per_host = app.config.get('REVIEW_FETCH_RATE', self.rate_per_host)
+		self.max_rate_per_host = app.config.get('REVIEW_FETCH_MAX_RATE', self.max_rate_per_host)
+		self.burst = app.config.get('REVIEW_FETCH_BURST', self.burst)
+		self.max_retries = app.config.get('REVIEW_FETCH_RETRIES', self.max_retries)
+		self.backoff = app.config.get('REVIEW_FETCH_BACKOFF', self.backoff)
+		self.max_backoff = app.config.get('REVIEW_FETCH_MAX_BACKOFF', self.max_backoff)
+		self.parse_workers = app.config.get('REVIEW_PARSE_WORKERS', self.parse_workers)
+		atexit.register(self.close)
+
+	@staticmethod
+	def _run_loop(loop):
+		asyncio.set_event_loop(loop)
+		loop.run_forever()
+
+	@property
+	def loop(self):
+		"""The event loop of the current process, started on first use"""
+		#: the loop thread doesn't survive a fork, every process starts its own
+		if self._pid != os.getpid():
+			with self._lock:
+				if self._pid != os.getpid():
+					self._loop = asyncio.new_event_loop()
+					self._session = None
+					self._limiters = dict()
+					self._parse_executor = ThreadPoolExecutor(max_workers=self.parse_workers)
+					loop_thread = threading.Thread(target=self._run_loop, args=(self._loop,), name='review-fetcher')
+					loop_thread.daemon = True
+					loop_thread.start()
+					self._pid = os.getpid()
+		return self._loop
+
+	@property
+	def session(self):
+		"""The shared session, must only be used from the event loop thread"""
+		if self._session is None:
+			connector = aiohttp.TCPConnector(keepalive_timeout=self.keepalive_timeout)
+			self._session = aiohttp.ClientSession(connector=connector)
+		return self._session
+
+	def _limiter(self, url):
+		host = parse.urlsplit(url).netloc
+		if host not in self._limiters:
+			self._limiters[host] = HostLimiter(
+				rate=self.rate_per_host, max_rate=self.max_rate_per_host,
+				burst=self.burst, max_concurrency=self.limit_per_host
+			)
+		return self._limiters[host]
+
+	async def _get(self, url, headers):
+		async with self.session.get(url, headers=headers) as response:
+			if response.status in (429, 503):
+				raise Blocked('{url} responded with {status}'.format(url=url, status=response.status))
+			return await response.text()
+
+	async def fetch(self, url, parse_page=None, headers=None):
+		"""
+		fetches a page through the shared session and the limiter of its host
+
+		:param url: url of the page
+		:type url: str
+		:param parse_page: function building the result from the body of the response, called in a worker
+						   thread, it raises `Blocked` if the page shows that the request was blocked
+		:param headers: extra request headers
+		:type headers: dict
+		:return: the result of `parse_page`, the body of the response if there is none
+		:raises: the last `Blocked`, `aiohttp.ClientError` or timeout once the retries are exhausted
+		"""
+		limiter = self._limiter(url)
+		attempt = 0
+		while True:
+			await limiter.acquire()
+			ok = None
+			try:
+				html = await asyncio.wait_for(self._get(url, headers), self.request_timeout)
+				if parse_page:
+					result = await self._loop.run_in_executor(self._parse_executor, parse_page, html)
+				else:
+					result = html
+				ok = True
+			except (Blocked, aiohttp.ClientError, asyncio.TimeoutError) as e:
+				ok = False
+				if attempt >= self.max_retries:
+					raise
+				cause = e
+			finally:
+				#: the slot is freed even if the fetch is cancelled, shielded so a second cancellation can't leak it
+				await asyncio.shield(limiter.release(ok))
+			if ok:
+				return result
+			delay = backoff_delay(attempt, self.backoff, self.max_backoff)
+			logger.info('Retrying {url} in {d:.2f} s, cause={e!r}'.format(url=url, d=delay, e=cause))
+			self._retries += 1
+			attempt += 1
+			await asyncio.sleep(delay)
+
+	def submit(self, coro):
+		"""
+		schedules a coroutine on the shared event loop
+
+		:param coro: coroutine to run, it must not be bound to another loop
+		:return: concurrent.futures.Future of the result of the coroutine
+		"""
+		return asyncio.run_coroutine_threadsafe(coro, self.loop)
+
+	def close(self):
+		"""closes the session and stops the event loop of the current process"""
+		if self._pid != os.getpid() or self._loop is None:
+			return
+		if self._session is not None:
+			session, self._session = self._session, None
+			self._loop.call_soon_threadsafe(session.close)
+		self._loop.call_soon_threadsafe(self._loop.stop)
+		self._parse_executor.shutdown(wait=False)
+
+	def metrics(self):
+		return dict(
+			limit_per_host=self.limit_per_host, retries=self._retries,
+			hosts={host: limiter.metrics() for host, limiter in self._limiters.items()}
+		)
+
+
+review_fetcher = ReviewFetcher()
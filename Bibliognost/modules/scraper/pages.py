@@ -0,0 +1,57 @@
+from Bibliognost import get_logger
+
+logger = get_logger('scraper')
+
+
+def successful_pages(results):
+	"""
+	drops the review pages which could not be fetched
+
+	:param results: dict mapping the page number to its reviews, or the exception it failed with
+	:type results: dict[int, list[dict] | Exception]
+	:return: `dict[int, list[dict]]`, only the pages with reviews
+	"""
+	pages = dict()
+	for page_no, reviews_list in sorted(results.items()):
+		if isinstance(reviews_list, Exception) or not reviews_list:
+			cause = 'request blocked by remote server' if not reviews_list else reviews_list
+			logger.warning('Failed to get result for page: {p}, cause={e}'.format(p=page_no, e=cause))
+		else:
+			pages[page_no] = reviews_list
+	return pages
+
+
+def merge_pages(pages):
+	"""
+	concatenates the reviews of the pages in page order
+
+	:param pages: dict mapping the page number to its reviews
+	:type pages: dict[int, list[dict]]
+	:return: `list[dict]` which is json serializable
+	"""
+	filtered_reviews = []
+	for page_no in sorted(pages):
+		for review in pages[page_no]:
+			filtered_reviews.append(review)
+	return filtered_reviews
+
+
+async def notify_page(page_no, reviews, on_page=None):
+	"""
+	awaits the reviews of a page, handing them or the exception they failed with to `on_page`
+
+	:param page_no: number of the page
+	:type page_no: int
+	:param reviews: coroutine returning the reviews of the page
+	:param on_page: called with the page number and the reviews or exception
+	:return: `list[dict]`, the reviews of the page
+	"""
+	try:
+		result = await reviews
+	except Exception as e:
+		if on_page is not None:
+			on_page(page_no, e)
+		raise
+	if on_page is not None:
+		on_page(page_no, result)
+	return result
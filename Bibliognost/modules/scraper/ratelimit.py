@@ -0,0 +1,117 @@
+import asyncio
+import random
+import time
+
+
+class Blocked(Exception):
+	"""Raised when a remote server refuses to serve a page, i.e. a 429/503, a captcha or a page without reviews"""
+
+
+def backoff_delay(attempt, base, cap):
+	"""
+	Returns the seconds to wait before retrying a request, exponential
+	in the number of attempts with full jitter, so the retries of the
+	pages blocked together don't hit the server together again
+
+	:param attempt: number of attempts already made, starting at 0
+	:type attempt: int
+	:param base: delay of the first retry
+	:type base: float
+	:param cap: maximum delay
+	:type cap: float
+	:return: float
+	"""
+	return random.uniform(0, min(cap, base * 2 ** attempt))
+
+
+class HostLimiter(object):
+	"""
+	Schedules the requests to a single host with a token bucket and an adaptive
+	concurrency limit.
+
+	Both the request rate and the number of requests in flight grow additively
+	while requests succeed, and are halved when the host blocks a request, at
+	most once per `cooldown` seconds since every request in flight usually gets
+	blocked at the same time. The throughput settles around the highest rate
+	the host accepts. It must only be used from the event loop thread.
+	"""
+
+	def __init__(self, rate=5.0, max_rate=20.0, min_rate=0.5, burst=5, max_concurrency=10, cooldown=1.0):
+		"""
+		:param rate: initial number of requests per second
+		:type rate: float
+		:param max_rate: maximum number of requests per second
+		:type max_rate: float
+		:param min_rate: minimum number of requests per second
+		:type min_rate: float
+		:param burst: maximum number of requests sent back to back after an idle period
+		:type burst: int
+		:param max_concurrency: maximum number of requests in flight
+		:type max_concurrency: int
+		:param cooldown: minimum seconds between two decreases
+		:type cooldown: float
+		"""
+		self.rate = float(min(rate, max_rate))
+		self.max_rate = max_rate
+		self.min_rate = min_rate
+		self.burst = burst
+		self.max_concurrency = max_concurrency
+		self.concurrency = float(max_concurrency)
+		self.cooldown = cooldown
+		self.in_flight = 0
+		self._tokens = float(burst)
+		self._updated = time.monotonic()
+		self._last_decrease = 0
+		self._slots = asyncio.Condition()
+		self._stats = dict(requests=0, blocked=0, decreases=0)
+
+	async def _take_token(self):
+		while True:
+			now = time.monotonic()
+			self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+			self._updated = now
+			if self._tokens >= 1:
+				self._tokens -= 1
+				return
+			await asyncio.sleep((1 - self._tokens) / self.rate)
+
+	async def acquire(self):
+		"""waits for a free slot and a token, the slot is freed again if it's cancelled while waiting for the token"""
+		async with self._slots:
+			while self.in_flight >= int(self.concurrency):
+				await self._slots.wait()
+			self.in_flight += 1
+		try:
+			await self._take_token()
+		except asyncio.CancelledError:
+			await asyncio.shield(self.release())
+			raise
+		self._stats['requests'] += 1
+
+	async def release(self, ok=None):
+		"""
+		frees the slot of a request and adapts the limits to its outcome
+
+		:param ok: True if the host served the request, False if it blocked it, None if it says nothing about the host
+		:type ok: bool
+		"""
+		async with self._slots:
+			self.in_flight -= 1
+			if ok:
+				self.concurrency = min(self.max_concurrency, self.concurrency + 1 / self.concurrency)
+				self.rate = min(self.max_rate, self.rate + 1 / self.rate)
+			elif ok is False:
+				self._stats['blocked'] += 1
+				now = time.monotonic()
+				if now - self._last_decrease >= self.cooldown:
+					self._last_decrease = now
+					self._stats['decreases'] += 1
+					self.concurrency = max(1.0, self.concurrency / 2)
+					self.rate = max(self.min_rate, self.rate / 2)
+					self._tokens = 0.0
+			self._slots.notify_all()
+
+	def metrics(self):
+		return dict(
+			self._stats, rate=round(self.rate, 2), concurrency=int(self.concurrency), in_flight=self.in_flight
+		)
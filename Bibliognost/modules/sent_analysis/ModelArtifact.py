@@ -0,0 +1,282 @@
+import json
+import os
+import struct
+
+import numpy as np
+import scipy.sparse as sp
+from sklearn.preprocessing import normalize
+
+from .Vectorizer import (
+	POS_TAG_PREFIXES, LinguisticVectorizer, LemmatizedTfidfVectorizer, LemmatizedHashingVectorizer,
+	ChunkedTransformMixin, shared_lemma_memo
+)
+
+#: Layout of a model artifact:
+#:     magic (8 bytes) | format version (uint32) | header length (uint32) | json header | arrays
+#: The json header describes the vectorizer and the classifier and holds
+#: the dtype, shape and offset of every array. Arrays are stored raw and
+#: aligned to `ALIGNMENT` bytes, so they can be memory mapped as they are
+#: and every process using the model shares the pages of the same file.
+MAGIC = b'BGNSTMDL'
+FORMAT_VERSION = 1
+PREAMBLE = struct.Struct('<8sII')
+ALIGNMENT = 64
+
+#: parameters needed to rebuild the analyzer of the lemmatizing vectorizers
+ANALYZER_PARAMS = (
+	'analyzer', 'ngram_range', 'lowercase', 'token_pattern', 'strip_accents', 'stop_words', 'encoding', 'decode_error'
+)
+#: parameters of the stateless hashing vectorizer on top of the analyzer ones
+HASHING_PARAMS = ('n_features', 'binary', 'norm', 'non_negative')
+
+
+def _aligned(offset):
+	return (offset + ALIGNMENT - 1) // ALIGNMENT * ALIGNMENT
+
+
+def read_header(path):
+	"""
+	reads the json header of an artifact without touching the arrays
+
+	:param path: path of the artifact
+	:type path: str
+	:return: dict
+	:raises: ValueError, if the file is not a model artifact of a supported version
+	"""
+	with open(path, 'rb') as f:
+		magic, format_version, header_length = PREAMBLE.unpack(f.read(PREAMBLE.size))
+		if magic != MAGIC:
+			raise ValueError('{0} is not a model artifact'.format(path))
+		if format_version != FORMAT_VERSION:
+			raise ValueError('Unsupported model artifact format version {0}'.format(format_version))
+		header = json.loads(f.read(header_length).decode('utf-8'))
+	header['data_offset'] = _aligned(PREAMBLE.size + header_length)
+	return header
+
+
+def _vectorizer_spec(vectorizer):
+	"""
+	flattens the fitted FeatureUnion of `fastClassifier` into header params and arrays
+
+	:return: tuple[dict, dict[str, np.ndarray]]
+	"""
+	(_, linguistic), (_, lemmatized) = vectorizer.transformer_list
+	if not isinstance(linguistic, LinguisticVectorizer) or getattr(vectorizer, 'transformer_weights', None):
+		raise ValueError('Only the vectorizers built by fastClassifier can be exported')
+	params = {name: lemmatized.get_params()[name] for name in ANALYZER_PARAMS}
+	if isinstance(lemmatized, LemmatizedHashingVectorizer):
+		params.update({name: lemmatized.get_params()[name] for name in HASHING_PARAMS})
+		return dict(kind='hashing', params=params), dict()
+	if not isinstance(lemmatized, LemmatizedTfidfVectorizer):
+		raise ValueError('Only the vectorizers built by fastClassifier can be exported')
+	terms = [term.encode('utf-8') for term in lemmatized.vocabulary_]
+	#: an empty vocabulary still gets a valid fixed width dtype
+	terms = np.array(terms, dtype='S{0}'.format(max(map(len, terms), default=1)))
+	columns = np.array([lemmatized.vocabulary_[term] for term in lemmatized.vocabulary_], dtype='i4')
+	order = np.argsort(terms, kind='mergesort')
+	arrays = dict(terms=terms[order], term_columns=columns[order])
+	if lemmatized.use_idf:
+		arrays['idf'] = np.asarray(lemmatized.idf_, dtype='f8')
+	spec = dict(
+		kind='tfidf', params=params, n_terms=len(terms), binary=lemmatized.binary,
+		sublinear_tf=lemmatized.sublinear_tf, norm=lemmatized.norm
+	)
+	return spec, arrays
+
+
+def export_model(vectorizer, clf, path, model_version):
+	"""
+	writes the vectorizer and the MultinomialNB classifier as a model artifact
+
+	:param vectorizer: fitted vectorizer returned by `fastClassifier.all_feature_vectorizer` or
+					   `fastClassifier.streaming_feature_vectorizer`
+	:param clf: fitted MultinomialNB classifier
+	:param path: destination of the artifact, written atomically
+	:type path: str
+	:param model_version: version recorded in the header
+	:type model_version: str
+	"""
+	vectorizer_spec, arrays = _vectorizer_spec(vectorizer)
+	#: stored as (features x classes) to multiply the sparse feature matrix without a copy
+	arrays['feature_log_prob'] = np.ascontiguousarray(np.asarray(clf.feature_log_prob_, dtype='f8').T)
+	arrays['class_log_prior'] = np.asarray(clf.class_log_prior_, dtype='f8')
+
+	offset = 0
+	array_specs = dict()
+	for name, array in arrays.items():
+		array_specs[name] = dict(dtype=array.dtype.str, shape=array.shape, offset=offset)
+		offset = _aligned(offset + array.nbytes)
+	header = json.dumps(dict(
+		model_version=model_version, vectorizer=vectorizer_spec,
+		classes=np.asarray(clf.classes_).tolist(), arrays=array_specs
+	)).encode('utf-8')
+
+	tmp_path = '{path}.tmp'.format(path=path)
+	with open(tmp_path, 'wb') as f:
+		f.write(PREAMBLE.pack(MAGIC, FORMAT_VERSION, len(header)))
+		f.write(header)
+		data_offset = _aligned(PREAMBLE.size + len(header))
+		for name, array in arrays.items():
+			f.seek(data_offset + array_specs[name]['offset'])
+			f.write(array.tobytes())
+	os.replace(tmp_path, path)
+
+
+def _artifact_vectorizer(path, model_version):
+	"""
+	loads the vectorizer of an artifact inside a transform worker
+
+	:return: CompactVectorizer, None if the artifact on the disk isn't that version anymore
+	"""
+	vectorizer, _, version = load_model(path)
+	return vectorizer if version == model_version else None
+
+
+class CompactVectorizer(ChunkedTransformMixin):
+	"""
+	Transforms documents the same way as the exported FeatureUnion.
+
+	The vocabulary is a sorted array of terms looked up with binary search,
+	so no per process dict has to be built when the model is loaded. Large
+	batches are sharded across a pool of processes, like `ChunkedFeatureUnion`,
+	the workers memory map the same artifact.
+	"""
+
+	def __init__(self, spec, arrays, path=None, model_version=None, n_workers=1, chunk_size=500):
+		"""
+		:param path: path of the artifact, the transform workers load the vectorizer from it
+		:type path: str
+		:param model_version: version of the artifact
+		:type model_version: str
+		:param n_workers: number of worker processes, None to use every core
+		:type n_workers: int
+		:param chunk_size: number of documents transformed by a worker at a time
+		:type chunk_size: int
+		"""
+		self.spec = spec
+		self.path = path
+		self.model_version = model_version
+		#: without an artifact to load from, everything is transformed in the calling process
+		self.n_workers = n_workers if path is not None else 1
+		self.chunk_size = chunk_size
+		self.linguistic = LinguisticVectorizer()
+		if spec['kind'] == 'hashing':
+			self.lemmatized = LemmatizedHashingVectorizer(**spec['params'])
+		else:
+			#: only used to build the analyzer, it is never fitted
+			self.lemmatized = LemmatizedTfidfVectorizer(**spec['params'])
+		#: a reloaded model keeps the lemmas looked up by the previous one
+		self.lemmatized._lemma_memo = self.lemma_memo = shared_lemma_memo
+		self.analyse = self.lemmatized.build_analyzer()
+		self.terms = arrays.get('terms')
+		self.term_columns = arrays.get('term_columns')
+		self.idf = arrays.get('idf')
+
+	@property
+	def n_features_out(self):
+		"""number of columns of the feature matrix"""
+		if self.spec['kind'] == 'hashing':
+			return len(POS_TAG_PREFIXES) + self.spec['params']['n_features']
+		return len(POS_TAG_PREFIXES) + self.spec['n_terms']
+
+	def _tfidf(self, documents):
+		tokens, doc_ids = [], []
+		for idx, doc in enumerate(documents):
+			doc_tokens = self.analyse(doc)
+			tokens.extend(doc_tokens)
+			doc_ids.extend([idx] * len(doc_tokens))
+		shape = (len(documents), self.spec['n_terms'])
+		if not tokens or not len(self.terms):
+			return sp.csr_matrix(shape)
+		encoded = [token.encode('utf-8') for token in tokens]
+		#: tokens longer than the widest term can't be in the vocabulary,
+		#: and would be truncated to a wrong match by the fixed width array
+		width = self.terms.dtype.itemsize
+		keep = np.array([len(token) <= width for token in encoded])
+		encoded = np.array(encoded, dtype=self.terms.dtype)
+		positions = np.minimum(np.searchsorted(self.terms, encoded), len(self.terms) - 1)
+		found = keep & (self.terms[positions] == encoded)
+		columns = self.term_columns[positions[found]]
+		rows = np.asarray(doc_ids)[found]
+		X = sp.csr_matrix((np.ones(len(columns)), (rows, columns)), shape=shape)
+		X.sum_duplicates()
+		if self.spec['binary']:
+			X.data.fill(1)
+		if self.spec['sublinear_tf']:
+			np.log(X.data, X.data)
+			X.data += 1
+		if self.idf is not None:
+			X.data *= self.idf[X.indices]
+		if self.spec['norm']:
+			X = normalize(X, norm=self.spec['norm'], copy=False)
+		return X
+
+	def transform_local(self, documents):
+		"""
+		Returns the feature matrix of the documents, computed in the calling process
+
+		:param documents: list of document strings
+		:return: sparse matrix of dimension (M x N)
+		"""
+		if self.spec['kind'] == 'hashing':
+			lemmatized = self.lemmatized.transform(documents)
+		else:
+			lemmatized = self._tfidf(documents)
+		return sp.hstack([self.linguistic.transform(documents), lemmatized]).tocsr()
+
+	def transform_pool_args(self):
+		return _artifact_vectorizer, (self.path, self.model_version)
+
+
+class CompactClassifier(object):
+	"""Computes the same probabilities as the exported MultinomialNB"""
+
+	def __init__(self, classes, arrays):
+		self.classes_ = np.asarray(classes)
+		self.feature_log_prob = arrays['feature_log_prob']
+		self.class_log_prior = arrays['class_log_prior']
+
+	@property
+	def n_features_in(self):
+		"""number of columns of the feature matrix the classifier expects"""
+		return self.feature_log_prob.shape[0]
+
+	def predict_proba(self, X):
+		"""
+		Returns the probability of every class for every row of X
+
+		:param X: sparse feature matrix returned by `CompactVectorizer.transform`
+		:return: np array of dimension (M x number of classes)
+		"""
+		jll = X.dot(self.feature_log_prob) + self.class_log_prior
+		jll -= jll.max(axis=1)[:, np.newaxis]
+		proba = np.exp(jll)
+		return proba / proba.sum(axis=1)[:, np.newaxis]
+
+
+def load_model(path):
+	"""
+	memory maps a model artifact
+
+	:param path: path of the artifact
+	:type path: str
+	:return: tuple[CompactVectorizer, CompactClassifier, str], the model and its version
+	"""
+	header = read_header(path)
+	arrays = dict()
+	for name, spec in header['arrays'].items():
+		#: zero length arrays can't be memory mapped
+		if not np.prod(spec['shape']):
+			arrays[name] = np.zeros(tuple(spec['shape']), dtype=np.dtype(spec['dtype']))
+			continue
+		arrays[name] = np.memmap(
+			path, dtype=np.dtype(spec['dtype']), mode='r',
+			offset=header['data_offset'] + spec['offset'], shape=tuple(spec['shape'])
+		)
+	vectorizer_spec = header['vectorizer']
+	vectorizer_spec['params']['ngram_range'] = tuple(vectorizer_spec['params']['ngram_range'])
+	return (
+		CompactVectorizer(vectorizer_spec, arrays, path=path, model_version=header['model_version']),
+		CompactClassifier(header['classes'], arrays),
+		header['model_version']
+	)
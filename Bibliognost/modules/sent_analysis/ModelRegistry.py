@@ -0,0 +1,207 @@
+import os
+import pickle
+import threading
+import time
+
+from Bibliognost import get_logger
+from . import PathInfo
+from .PathInfo import pickle_path
+from .ModelArtifact import read_header, load_model
+from .Vectorizer import POS_TAG_PREFIXES, LinguisticVectorizer
+
+logger = get_logger('modelregistry')
+
+
+def pickles_version():
+	"""
+	Version of the pickled vectorizer and classifier, their latest modification
+	time in nanoseconds, so two models saved within the same second differ
+
+	:return: `str`
+	:raises: OSError if a pickle is missing
+	"""
+	return str(max(
+		os.stat(pickle_path(PathInfo.INIT_VECTORIZER)).st_mtime_ns,
+		os.stat(pickle_path(PathInfo.INIT_CLASSIFIER)).st_mtime_ns
+	))
+
+
+def feature_widths(vectorizer, clf):
+	"""
+	Number of features the vectorizer outputs and the classifier expects. They are
+	computed without transforming a document, which would load the nltk tagger.
+
+	:param vectorizer: a `CompactVectorizer`, or the FeatureUnion of `fastClassifier`
+	:param clf: the `CompactClassifier` or MultinomialNB classifier loaded along with it
+	:return: `tuple[int, int]`
+	"""
+	if hasattr(vectorizer, 'n_features_out'):
+		return vectorizer.n_features_out, clf.n_features_in
+	#: an empty document has no token for the lemmatizing step to lemmatize
+	width = sum(
+		len(POS_TAG_PREFIXES) if isinstance(transformer, LinguisticVectorizer) else transformer.transform(['']).shape[1]
+		for _, transformer in vectorizer.transformer_list
+	)
+	return width, clf.feature_log_prob_.shape[1]
+
+
+class ModelRegistry(object):
+	"""
+	Holds the vectorizer and classifier of the current process.
+
+	The model is loaded once and served from memory afterwards. Every
+	`reload_interval` seconds the disk is checked for a newer version,
+	which is loaded on the side and swapped in as a single reference, so
+	readers always see a consistent (vectorizer, classifier) pair.
+	"""
+
+	def __init__(self, trainer=None, reload_interval=30, n_workers=1, chunk_size=500):
+		"""
+		:param trainer: callable which trains and persists a model, used when no pickles are available
+		:type trainer: callable
+		:param reload_interval: minimum number of seconds between two checks for a newer model
+		:type reload_interval: int
+		:param n_workers: number of processes the vectorizer transforms large batches with
+		:type n_workers: int
+		:param chunk_size: number of documents transformed by a process at a time
+		:type chunk_size: int
+		"""
+		self.trainer = trainer
+		self.reload_interval = reload_interval
+		self.n_workers = n_workers
+		self.chunk_size = chunk_size
+		#: passed on to the trainer, see `fastClassifier.train_and_persist`
+		self.streaming_training = False
+		self._model = None
+		self._last_check = 0
+		self._lock = threading.Lock()
+		self._stats = dict(version=None, kind=None, load_time=None, loaded_at=None, loads=0, failed_loads=0)
+
+	def init_app(self, app):
+		self.reload_interval = app.config.get('SENTIMENT_RELOAD_INTERVAL', self.reload_interval)
+		self.n_workers = app.config.get('SENTIMENT_WORKERS', self.n_workers)
+		self.chunk_size = app.config.get('SENTIMENT_CHUNK_SIZE', self.chunk_size)
+		self.streaming_training = app.config.get('SENTIMENT_STREAMING_TRAINING', self.streaming_training)
+		if app.config.get('SENTIMENT_PREWARM'):
+			self.get()
+
+	def _current_version(self):
+		"""
+		Version of the model on the disk. The version header of a model artifact is
+		preferred, pickles are versioned by their modification time, see `pickles_version`.
+
+		:return: `tuple[str, str]`, the kind of model and its version, if one is available, else None
+		"""
+		try:
+			return 'artifact', read_header(pickle_path(PathInfo.INIT_MODEL))['model_version']
+		except OSError:
+			pass
+		except ValueError as e:
+			logger.warning('Ignoring the model artifact: {e}'.format(e=e))
+		try:
+			return 'pickle', pickles_version()
+		except OSError:
+			return None
+
+	def _load(self, version):
+		"""
+		loads the model and makes sure the vectorizer and classifier can be used together
+
+		:param version: kind and version of the model being loaded, see `_current_version`
+		:type version: tuple[str, str]
+		:return: tuple[vectorizer, classifier, tuple[str, str]]
+		"""
+		start = time.time()
+		kind, model_version = version
+		if kind == 'artifact':
+			vectorizer, clf, _ = load_model(pickle_path(PathInfo.INIT_MODEL))
+		else:
+			with open(pickle_path(PathInfo.INIT_VECTORIZER), 'rb') as vect_f:
+				vectorizer = pickle.load(vect_f)
+			with open(pickle_path(PathInfo.INIT_CLASSIFIER), 'rb') as clf_f:
+				clf = pickle.load(clf_f)
+		#: the two pickles are written one after another, a
+		#: classifier which can't consume the vectorizer output
+		#: means we caught a half written model on the disk.
+		n_features_out, n_features_in = feature_widths(vectorizer, clf)
+		if n_features_out != n_features_in:
+			raise ValueError('The vectorizer outputs {o} features, the classifier expects {i}'.format(
+				o=n_features_out, i=n_features_in
+			))
+		#: models pickled before the vectorizer supported chunked
+		#: transforms keep transforming in the calling process.
+		if hasattr(vectorizer, 'n_workers'):
+			vectorizer.n_workers = self.n_workers
+			vectorizer.chunk_size = self.chunk_size
+		load_time = time.time() - start
+		self._stats.update(version=model_version, kind=kind, load_time=load_time, loaded_at=time.time())
+		self._stats['loads'] += 1
+		logger.info('Loaded sentiment {k} version {v} in {t:.3f} s'.format(k=kind, v=model_version, t=load_time))
+		return vectorizer, clf, version
+
+	def _refresh(self):
+		version = self._current_version()
+		if version is None:
+			if self._model is not None:
+				return
+			if self.trainer is None:
+				raise RuntimeError('No sentiment model available at {0}'.format(pickle_path('')))
+			logger.warning('No sentiment model found, training a new one')
+			self.trainer(streaming=self.streaming_training)
+			version = self._current_version()
+		if self._model is not None and self._model[2] == version:
+			return
+		try:
+			previous, self._model = self._model, self._load(version)
+		except Exception as e:
+			self._stats['failed_loads'] += 1
+			if self._model is None:
+				raise
+			logger.warning('Keeping model version {v}, failed to load a newer one: {e}'.format(
+				v=self._model[2][1], e=e
+			))
+		else:
+			#: the processes transforming for the previous model are stopped once it's swapped out
+			if previous is not None and hasattr(previous[0], 'close'):
+				previous[0].close()
+
+	def get(self):
+		"""
+		Returns the current model, loading it on first use
+
+		:return: tuple[vectorizer, classifier]
+		"""
+		vectorizer, clf, _ = self.get_versioned()
+		return vectorizer, clf
+
+	def get_versioned(self):
+		"""
+		Returns the current model along with its version, loading it on first use
+
+		:return: tuple[vectorizer, classifier, str]
+		"""
+		now = time.time()
+		if self._model is None or now - self._last_check >= self.reload_interval:
+			#: only one thread checks the disk, the rest keep
+			#: serving the model they already have.
+			if self._lock.acquire(blocking=self._model is None):
+				try:
+					if self._model is None or now - self._last_check >= self.reload_interval:
+						self._refresh()
+						self._last_check = time.time()
+				finally:
+					self._lock.release()
+		vectorizer, clf, (_, model_version) = self._model
+		return vectorizer, clf, model_version
+
+	@property
+	def version(self):
+		return self._stats['version']
+
+	def metrics(self):
+		"""
+		Returns the load statistics of the model
+
+		:return: dict
+		"""
+		return dict(self._stats)
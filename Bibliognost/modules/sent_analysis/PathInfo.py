@@ -1,4 +1,7 @@
 # contains directory path to pickle and training datasets
+import os
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 
 DATA_BASE_DIR = 'Data/'
 PICKLE_BASE_DIR = 'Pickle/'
@@ -15,3 +18,14 @@ NEW_CLASSIFIER = 'newclassifier.pickle'
 SENT_SCORE_DICT = 'sent_score.pickle'
 
 INIT_VECTORIZER = 'init_vectorizer.pickle'
+INIT_MODEL = 'init_model.bgm'
+
+
+def pickle_path(file):
+	"""
+	Returns the absolute path of a file inside the pickle directory
+
+	:param file: `str`, name of the pickle file
+	:return: `str`, absolute path of the file
+	"""
+	return os.path.join(BASE_DIR, PICKLE_BASE_DIR + file)
@@ -0,0 +1,143 @@
+import itertools
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+from Bibliognost import get_logger
+from .fastClassifier import model_registry, classify, predict_sentiment
+
+logger = get_logger('scoringservice')
+
+
+class _ScoringJob(object):
+	def __init__(self, reviews):
+		self.reviews = reviews
+		self.future = Future()
+
+
+class ScoringService(object):
+	"""
+	Classifies the reviews of concurrent requests together.
+
+	Requests put their uncached reviews on a queue and wait. A single scoring
+	thread per process collects jobs for up to `max_latency` seconds, or until
+	`max_batch_size` reviews are gathered, runs one transform and predict_proba
+	over all of them, and hands every request its own slice of the result.
+	"""
+
+	def __init__(self, max_latency=0.005, max_batch_size=256, enabled=True):
+		"""
+		:param max_latency: maximum number of seconds the first job of a batch waits for company
+		:type max_latency: float
+		:param max_batch_size: number of reviews after which a batch is classified right away
+		:type max_batch_size: int
+		:param enabled: if False, every request classifies its reviews in its own thread
+		:type enabled: bool
+		"""
+		self.max_latency = max_latency
+		self.max_batch_size = max_batch_size
+		self.enabled = enabled
+		self._queue = None
+		self._pid = None
+		self._lock = threading.Lock()
+		self._queued_reviews = 0
+		self._stats = dict(batches=0, batched_reviews=0, last_batch_size=0, max_batch_size_seen=0)
+
+	def init_app(self, app):
+		self.max_latency = app.config.get('SENTIMENT_BATCH_LATENCY', self.max_latency)
+		self.max_batch_size = app.config.get('SENTIMENT_BATCH_SIZE', self.max_batch_size)
+		self.enabled = app.config.get('SENTIMENT_BATCHING', self.enabled)
+
+	def _ensure_started(self):
+		#: the thread doesn't survive a fork, every process starts its own
+		if self._pid == os.getpid():
+			return
+		with self._lock:
+			if self._pid != os.getpid():
+				self._queue = queue.Queue()
+				self._queued_reviews = 0
+				threading.Thread(target=self._run, name='sentiment-scoring', daemon=True).start()
+				self._pid = os.getpid()
+
+	def _next_batch(self):
+		batch = [self._queue.get()]
+		num_reviews = len(batch[0].reviews)
+		deadline = time.time() + self.max_latency
+		while num_reviews < self.max_batch_size:
+			timeout = deadline - time.time()
+			if timeout <= 0:
+				break
+			try:
+				job = self._queue.get(timeout=timeout)
+			except queue.Empty:
+				break
+			batch.append(job)
+			num_reviews += len(job.reviews)
+		with self._lock:
+			self._queued_reviews -= num_reviews
+		return batch, num_reviews
+
+	def _run(self):
+		while True:
+			batch, num_reviews = self._next_batch()
+			self._stats['batches'] += 1
+			self._stats['batched_reviews'] += num_reviews
+			self._stats['last_batch_size'] = num_reviews
+			self._stats['max_batch_size_seen'] = max(self._stats['max_batch_size_seen'], num_reviews)
+			try:
+				vectorizer, clf, model_version = model_registry.get_versioned()
+				probabilities = classify(list(itertools.chain.from_iterable(job.reviews for job in batch)), vectorizer, clf)
+			except Exception as e:
+				logger.exception(e)
+				for job in batch:
+					job.future.set_exception(e)
+				continue
+			start = 0
+			for job in batch:
+				job.future.set_result((probabilities[start:start + len(job.reviews)], model_version))
+				start += len(job.reviews)
+
+	def score(self, reviews):
+		"""
+		Queues the reviews and waits for the batch they end up in to be classified
+
+		:param reviews: list of review strings
+		:return: tuple, np array of probabilities and the version of the model used
+		"""
+		self._ensure_started()
+		job = _ScoringJob(reviews)
+		with self._lock:
+			self._queued_reviews += len(reviews)
+		self._queue.put(job)
+		return job.future.result()
+
+	def predict_sentiment(self, reviews):
+		"""
+		Same as `fastClassifier.predict_sentiment`, with cache misses classified in shared batches
+
+		:param reviews: list of review strings
+		:return: np array with the probability of every review being positive
+		"""
+		if not self.enabled:
+			return predict_sentiment(reviews)
+		return predict_sentiment(reviews, scorer=self.score)
+
+	def metrics(self):
+		"""
+		Returns the queue depth and batch size statistics of the service
+
+		:return: dict
+		"""
+		batches = self._stats['batches']
+		return dict(
+			self._stats,
+			queue_depth=self._queue.qsize() if self._queue else 0,
+			queued_reviews=self._queued_reviews,
+			avg_batch_size=self._stats['batched_reviews'] / batches if batches else None,
+			max_latency=self.max_latency, max_batch_size=self.max_batch_size, enabled=self.enabled
+		)
+
+
+scoring_service = ScoringService()
@@ -0,0 +1,156 @@
+import hashlib
+import threading
+from collections import OrderedDict
+
+import psycopg2
+from flask import g, has_app_context
+
+from Bibliognost import get_logger
+from connection import savepoint
+
+logger = get_logger('sentimentcache')
+
+
+def review_hash(text):
+	"""
+	Returns the hash identifying the body of a review
+
+	:param text: body of the review
+	:type text: str
+	:return: `str`, hex digest
+	"""
+	return hashlib.sha1(text.encode('utf-8')).hexdigest()
+
+
+class PostgresSentimentStore(object):
+	"""
+	Second cache tier in the `sentiment_scores` table, shared by every worker.
+
+	It uses the connection opened for the request by `PostgresConnection`,
+	outside of a request it finds nothing and stores nothing.
+	"""
+
+	@staticmethod
+	def _connection():
+		if has_app_context():
+			return getattr(g, 'db', None)
+
+	def get_many(self, model_version, body_hashes):
+		"""
+		:return: dict mapping the hashes which were found to their probability
+		"""
+		connection = self._connection()
+		if connection is None or not body_hashes:
+			return dict()
+		try:
+			with savepoint(connection):
+				cursor = connection.cursor()
+				cursor.execute(
+					'SELECT body_hash, probability FROM sentiment_scores WHERE model_version = %s AND body_hash = ANY(%s)',
+					(model_version, list(body_hashes))
+				)
+				return dict(cursor.fetchall())
+		except psycopg2.DatabaseError as e:
+			logger.warning('Failed to read cached sentiments: {e}'.format(e=e))
+			return dict()
+
+	def put_many(self, model_version, scores):
+		"""
+		:param scores: dict mapping the review hashes to their probability
+		"""
+		connection = self._connection()
+		if connection is None or not scores:
+			return
+		try:
+			with savepoint(connection):
+				cursor = connection.cursor()
+				cursor.execute(
+					'INSERT INTO sentiment_scores (body_hash, model_version, probability) '
+					'SELECT body_hash, %s, probability FROM unnest(%s::TEXT[], %s::REAL[]) AS s (body_hash, probability) '
+					'ON CONFLICT DO NOTHING',
+					(model_version, list(scores.keys()), list(scores.values()))
+				)
+		except psycopg2.DatabaseError as e:
+			logger.warning('Failed to store sentiments: {e}'.format(e=e))
+
+
+class SentimentCache(object):
+	"""
+	Maps the hash of a review body and the model version to the probability of the review being positive.
+
+	Lookups go to a bounded in-memory LRU first, and to the optional store for the
+	remaining hashes; hits from the store are promoted to the LRU.
+	"""
+
+	def __init__(self, max_size=100000, store=None):
+		"""
+		:param max_size: maximum number of probabilities kept in memory
+		:type max_size: int
+		:param store: optional second tier with `get_many` and `put_many`, see `PostgresSentimentStore`
+		"""
+		self.max_size = max_size
+		self.store = store
+		self._entries = OrderedDict()
+		self._lock = threading.Lock()
+		self._stats = dict(hits=0, store_hits=0, misses=0)
+
+	def init_app(self, app):
+		self.max_size = app.config.get('SENTIMENT_CACHE_SIZE', self.max_size)
+		if app.config.get('SENTIMENT_CACHE_POSTGRES'):
+			self.store = PostgresSentimentStore()
+
+	def _remember(self, model_version, scores):
+		with self._lock:
+			for body_hash, probability in scores.items():
+				self._entries[(model_version, body_hash)] = probability
+				self._entries.move_to_end((model_version, body_hash))
+			while len(self._entries) > self.max_size:
+				self._entries.popitem(last=False)
+
+	def get_many(self, model_version, body_hashes):
+		"""
+		looks up the probabilities of the reviews
+
+		:param model_version: version of the model the probabilities were computed with
+		:type model_version: str
+		:param body_hashes: hashes of the review bodies, see `review_hash`
+		:type body_hashes: list[str]
+		:return: dict mapping the hashes which were found to their probability
+		"""
+		found = dict()
+		with self._lock:
+			for body_hash in body_hashes:
+				probability = self._entries.get((model_version, body_hash))
+				if probability is not None:
+					self._entries.move_to_end((model_version, body_hash))
+					found[body_hash] = probability
+			self._stats['hits'] += len(found)
+		missing = [body_hash for body_hash in body_hashes if body_hash not in found]
+		if missing and self.store is not None:
+			stored = self.store.get_many(model_version, missing)
+			self._stats['store_hits'] += len(stored)
+			self._remember(model_version, stored)
+			found.update(stored)
+		self._stats['misses'] += len(body_hashes) - len(found)
+		return found
+
+	def put_many(self, model_version, scores):
+		"""
+		stores freshly computed probabilities
+
+		:param model_version: version of the model the probabilities were computed with
+		:type model_version: str
+		:param scores: dict mapping the review hashes to their probability
+		:type scores: dict[str, float]
+		"""
+		self._remember(model_version, scores)
+		if self.store is not None:
+			self.store.put_many(model_version, scores)
+
+	def metrics(self):
+		"""
+		Returns the usage statistics of the cache
+
+		:return: dict
+		"""
+		return dict(self._stats, size=len(self._entries), max_size=self.max_size, store=self.store is not None)
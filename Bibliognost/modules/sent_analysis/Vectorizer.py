@@ -1,20 +1,268 @@
+import atexit
+import hashlib
+import json
+import multiprocessing
+import os
+import threading
+import time
+from abc import ABCMeta, abstractmethod
+from collections import OrderedDict
+
 import nltk
 import numpy as np
 from nltk.stem import WordNetLemmatizer
-from sklearn.feature_extraction.text import TfidfVectorizer, BaseEstimator
+import scipy.sparse as sp
+from sklearn.feature_extraction.text import TfidfVectorizer, HashingVectorizer, BaseEstimator
+from sklearn.pipeline import FeatureUnion
+
+from . import PathInfo
+from .PathInfo import pickle_path
 
 lemmatizer = WordNetLemmatizer()
 
+#: Penn treebank tag prefixes counted by the LinguisticVectorizer, in feature order
+POS_TAG_PREFIXES = ('NN', 'JJ', 'VB', 'RB')
+
+
+class PosCache(object):
+	"""
+	Maps the hash of a document to its noun, adjective, verb and adverb ratios.
+
+	Entries live in a bounded LRU which is snapshotted to a json file, so the
+	ratios of frequently scored reviews survive restarts of the process.
+	"""
+	FLUSH_INTERVAL = 60
+
+	def __init__(self, path, max_size=50000):
+		"""
+		:param path: path of the json file backing the cache
+		:type path: str
+		:param max_size: maximum number of documents kept in the cache
+		:type max_size: int
+		"""
+		self.path = path
+		self.max_size = max_size
+		self._entries = None
+		self._dirty = False
+		#: worker processes hand their freshly tagged documents back to
+		#: the parent, which owns the snapshot on the disk.
+		self.track_new = False
+		self._new = []
+		self._last_flush = time.time()
+		self._lock = threading.Lock()
+
+	@staticmethod
+	def key(document):
+		return hashlib.md5(document.encode('utf-8')).hexdigest()
+
+	def _load(self):
+		self._entries = OrderedDict()
+		try:
+			with open(self.path, 'r', encoding='UTF-8') as f:
+				entries = json.load(f)
+		except (OSError, ValueError):
+			return
+		#: the snapshot is written least recently used first
+		for key, ratios in entries[-self.max_size:]:
+			self._entries[key] = ratios
+
+	def get_many(self, keys):
+		"""
+		looks up the ratios of the given documents
+
+		:param keys: document hashes, see `PosCache.key`
+		:type keys: list[str]
+		:return: list with the ratios for every hit and None for every miss
+		"""
+		with self._lock:
+			if self._entries is None:
+				self._load()
+			found = []
+			for key in keys:
+				ratios = self._entries.get(key)
+				if ratios is not None:
+					self._entries.move_to_end(key)
+				found.append(ratios)
+			return found
+
+	def put_many(self, items):
+		"""
+		stores the ratios of freshly tagged documents
+
+		:param items: pairs of document hash and ratios
+		:type items: iterable[tuple[str, list[float]]]
+		"""
+		with self._lock:
+			if self._entries is None:
+				self._load()
+			items = list(items)
+			for key, ratios in items:
+				self._entries[key] = ratios
+				self._entries.move_to_end(key)
+			while len(self._entries) > self.max_size:
+				self._entries.popitem(last=False)
+			self._dirty = True
+		if self.track_new:
+			self._new.extend(items)
+		elif time.time() - self._last_flush >= self.FLUSH_INTERVAL:
+			self.flush()
+
+	def take_new(self):
+		"""
+		returns the entries added since the last call, requires `track_new` to be set
+
+		:return: list[tuple[str, list[float]]]
+		"""
+		with self._lock:
+			new, self._new = self._new, []
+		return new
+
+	def flush(self):
+		"""writes the cache to the disk, if anything has changed since the last flush"""
+		with self._lock:
+			if not self._dirty:
+				return
+			entries = list(self._entries.items())
+			self._dirty = False
+			self._last_flush = time.time()
+		tmp_path = '{path}.{pid}.tmp'.format(path=self.path, pid=os.getpid())
+		try:
+			os.makedirs(os.path.dirname(self.path), exist_ok=True)
+			with open(tmp_path, 'w', encoding='UTF-8') as f:
+				json.dump(entries, f)
+			os.replace(tmp_path, self.path)
+		except OSError as e:
+			print('Failed to persist the POS cache, ({})'.format(e))
+
+
+pos_cache = PosCache(pickle_path(PathInfo.POS_CACHE))
+atexit.register(pos_cache.flush)
+
+
+class LemmaMemo(object):
+	"""
+	Bounded memo table from token to lemma.
+
+	Tokens follow a Zipfian distribution, so a few hundred thousand distinct
+	tokens cover almost every occurrence. Once full, the least recently used
+	token is evicted for every new one, so the table follows the vocabulary of
+	the reviews being scored.
+	"""
+
+	def __init__(self, max_size=200000):
+		"""
+		:param max_size: maximum number of tokens remembered
+		:type max_size: int
+		"""
+		self.max_size = max_size
+		self.table = OrderedDict()
+		self.hits = 0
+		self.misses = 0
+
+	def __setstate__(self, state):
+		#: memos pickled before the eviction existed hold a plain dict
+		self.__dict__.update(state)
+		self.table = OrderedDict(self.table)
+
+	def lemmatize(self, token):
+		"""
+		lemmatizes a token missing from the table and remembers it, evicting the least recently used one if it's full
+
+		:param token: word or n-gram produced by the analyzer
+		:type token: str
+		:return: `str`, the lemma
+		"""
+		lemma = lemmatizer.lemmatize(token)
+		self.table[token] = lemma
+		if len(self.table) > self.max_size:
+			self.table.popitem(last=False)
+		return lemma
+
+	def stats(self):
+		"""
+		Returns the usage statistics of the memo table, including the lookups of the transform workers
+
+		:return: dict
+		"""
+		lookups = self.hits + self.misses
+		return dict(
+			size=len(self.table), max_size=self.max_size, hits=self.hits, misses=self.misses,
+			hit_ratio=self.hits / lookups if lookups else None
+		)
+
+
+#: lemmas don't depend on the model, so the vectorizers loaded from model artifacts share one table
+shared_lemma_memo = LemmaMemo()
+
+
+class LemmatizingAnalyzerMixin(object):
+	"""Lemmatizes the tokens produced by the word analyzer of a sklearn text vectorizer"""
+
+	@property
+	def lemma_memo(self):
+		"""
+		The memo table is kept in the instance dict, so it is pickled along with the vectorizer.
+		Vectorizers pickled before it existed start with an empty one.
+		"""
+		memo = self.__dict__.get('_lemma_memo')
+		if memo is None:
+			memo = self._lemma_memo = LemmaMemo()
+		return memo
 
-class LemmatizedTfidfVectorizer(TfidfVectorizer):
 	def build_analyzer(self):
 		"""
-		Returns the Tfidf values on the lemmatized sequence of words obtained from the document string
+		Returns the lemmatized sequence of words obtained from the document string
 
-		:return: function, that lemmatized the words extracted by the TfidfVectorizer's Word Analyser
+		:return: function, that lemmatized the words extracted by the vectorizer's Word Analyser
 		"""
-		analyser = super(TfidfVectorizer, self).build_analyzer()
-		return lambda doc: (lemmatizer.lemmatize(w) for w in analyser(doc))
+		analyser = super(LemmatizingAnalyzerMixin, self).build_analyzer()
+		memo = self.lemma_memo
+		lookup = memo.table.get
+		touch = memo.table.move_to_end
+		lemmatize = memo.lemmatize
+
+		def analyse(doc):
+			lemmas = []
+			append = lemmas.append
+			misses = 0
+			for w in analyser(doc):
+				lemma = lookup(w)
+				if lemma is None:
+					lemma = lemmatize(w)
+					misses += 1
+				else:
+					touch(w)
+				append(lemma)
+			memo.hits += len(lemmas) - misses
+			memo.misses += misses
+			return lemmas
+
+		return analyse
+
+
+def find_lemma_memo(vectorizer):
+	"""
+	:param vectorizer: a `CompactVectorizer`, or a FeatureUnion with a lemmatizing step
+	:return: LemmaMemo of the lemmatizing step of the vectorizer, None if it doesn't lemmatize
+	"""
+	memo = getattr(vectorizer, 'lemma_memo', None)
+	if memo is not None:
+		return memo
+	for _, transformer in getattr(vectorizer, 'transformer_list', ()):
+		if isinstance(transformer, LemmatizingAnalyzerMixin):
+			return transformer.lemma_memo
+
+
+class LemmatizedTfidfVectorizer(LemmatizingAnalyzerMixin, TfidfVectorizer):
+	"""Returns the Tfidf values on the lemmatized sequence of words obtained from the document string"""
+
+
+class LemmatizedHashingVectorizer(LemmatizingAnalyzerMixin, HashingVectorizer):
+	"""
+	Hashes the lemmatized sequence of words obtained from the document string.
+
+	It holds no vocabulary, so it can vectorize a corpus chunk by chunk without being fitted.
+	"""
 
 
 class LinguisticVectorizer(BaseEstimator):
@@ -37,39 +285,248 @@ class LinguisticVectorizer(BaseEstimator):
 		:param d: String, document string is passed
 		:return: array with the respective feature(noun, verb, adjective, adverb) extracted from the document string
 		"""
-		words = tuple(d.split())
-		tagged = nltk.pos_tag(words)
-
-		nouns = 0
-		adjectives = 0
-		verbs = 0
-		adverbs = 0
-
-		for word, pos_tag in tagged:
+		return list(self.transform([d])[0])
 
-			if pos_tag.startswith("NN"):
-				nouns += 1
-
-			if pos_tag.startswith("JJ"):
-				adjectives += 1
-
-			if pos_tag.startswith("VB"):
-				verbs += 1
+	@staticmethod
+	def pos_ratios(tagged_documents):
+		"""
+		Counts the nouns, adjectives, verbs and adverbs of a batch of tagged documents
 
-			if pos_tag.startswith("RB"):
-				adverbs += 1
+		:param tagged_documents: list of documents, each a list of (word, pos_tag) pairs
+		:return: np array of dimension (M x 4), each count divided by the number of words + 1
+		"""
+		lengths = np.array([len(tagged) for tagged in tagged_documents])
+		doc_ids = np.repeat(np.arange(len(tagged_documents)), lengths)
+		prefixes = np.array([pos_tag[:2] for tagged in tagged_documents for _, pos_tag in tagged], dtype='U2')
+		counts = np.empty((len(tagged_documents), len(POS_TAG_PREFIXES)))
+		for idx, prefix in enumerate(POS_TAG_PREFIXES):
+			counts[:, idx] = np.bincount(doc_ids[prefixes == prefix], minlength=len(tagged_documents))
 		# adding one to consider empty document
-		l = len(words) + 1
-		return [nouns / l, adjectives / l, verbs / l, adverbs / l]
+		return counts / (lengths + 1)[:, np.newaxis]
 
 	def transform(self, documents):
 		"""
 		Returns np array of the feature vector obtained from the sets of document strings
 
+		Ratios of documents seen before are served from the POS cache, the rest
+		are tagged in a single batch.
+
 		:param documents: np array of documents of dimension (M, 1), M = number of documents and each entry is a string
 		:return: np array of sets of feature vector of dimension (M x N) where M is number of documents and N is the
 				 features (here N = 4 as features are noun, verb, adjective, adverb)
 		"""
-		nouns, adjectives, verbs, adverbs = np.array([self.get_sentiments(d) for d in documents]).T
-		result = np.array([nouns, adjectives, verbs, adverbs]).T
+		documents = list(documents)
+		result = np.empty((len(documents), len(POS_TAG_PREFIXES)))
+		keys = [pos_cache.key(d) for d in documents]
+		#: a document repeated within the batch is tagged only once
+		misses = OrderedDict()
+		for idx, ratios in enumerate(pos_cache.get_many(keys)):
+			if ratios is None:
+				misses.setdefault(keys[idx], []).append(idx)
+			else:
+				result[idx] = ratios
+		if misses:
+			tagged = nltk.pos_tag_sents([tuple(documents[idxs[0]].split()) for idxs in misses.values()])
+			ratios = self.pos_ratios(tagged)
+			for row, idxs in enumerate(misses.values()):
+				result[idxs] = ratios[row]
+			pos_cache.put_many(zip(misses.keys(), ratios.tolist()))
 		return result
+
+
+#: vectorizer of a worker process of a `TransformPool`
+_worker_vectorizer = None
+
+
+def _init_transform_worker(factory, args):
+	global _worker_vectorizer
+	_worker_vectorizer = factory(*args)
+	pos_cache.track_new = True
+
+
+def _same_vectorizer(vectorizer):
+	return vectorizer
+
+
+def _transform_chunk(documents):
+	"""
+	transforms a chunk of documents inside a worker process
+
+	:param documents: list of document strings
+	:return: tuple, sparse feature matrix, the POS cache entries added for the chunk
+			 and the lemma memo hits and misses of the chunk
+	"""
+	if _worker_vectorizer is None:
+		raise RuntimeError('the worker could not load the vectorizer of the pool')
+	memo = find_lemma_memo(_worker_vectorizer)
+	hits, misses = (memo.hits, memo.misses) if memo is not None else (0, 0)
+	X = _worker_vectorizer.transform_local(documents)
+	if memo is not None:
+		hits, misses = memo.hits - hits, memo.misses - misses
+	return sp.csr_matrix(X), pos_cache.take_new(), (hits, misses)
+
+
+class TransformPool(object):
+	"""
+	Persistent pool of processes transforming chunks of documents with the same vectorizer.
+
+	The processes are started on first use and build their copy of the
+	vectorizer once, with `factory(*args)`, every later transform of the
+	process reuses them. They're started from a forkserver where available,
+	so the threads of the server are never forked along. A closed pool
+	transforms nothing, its vectorizer falls back to the calling process.
+	"""
+
+	def __init__(self, n_workers, factory, args):
+		"""
+		:param n_workers: number of worker processes
+		:type n_workers: int
+		:param factory: picklable function building the vectorizer of a worker
+		:param args: picklable arguments of the factory
+		:type args: tuple
+		"""
+		self.n_workers = n_workers
+		self.factory = factory
+		self.args = args
+		self._pool = None
+		self._pid = None
+		self._closed = False
+		self._lock = threading.Lock()
+
+	def _get(self):
+		with self._lock:
+			if self._closed:
+				return None
+			if self._pool is None or self._pid != os.getpid():
+				methods = multiprocessing.get_all_start_methods()
+				context = multiprocessing.get_context('forkserver' if 'forkserver' in methods else None)
+				if 'forkserver' in methods:
+					#: the server preloads `__main__` by default, i.e. all of manage.py
+					context.set_forkserver_preload([__name__])
+				self._pool = context.Pool(
+					self.n_workers, initializer=_init_transform_worker, initargs=(self.factory, self.args)
+				)
+				self._pid = os.getpid()
+			return self._pool
+
+	def map(self, chunks):
+		"""
+		:param chunks: lists of document strings
+		:type chunks: list[list[str]]
+		:return: list of the feature matrix, new POS cache entries and lemma memo counts of every chunk,
+				 None if the pool can't be used
+		"""
+		pool = self._get()
+		if pool is None:
+			return None
+		try:
+			return pool.map(_transform_chunk, chunks)
+		except Exception as e:
+			print('Transforming in the calling process, the transform pool failed ({})'.format(e))
+			return None
+
+	def close(self):
+		"""lets the running transforms finish and stops the processes"""
+		with self._lock:
+			self._closed = True
+			pool, self._pool = self._pool, None
+		if pool is not None and self._pid == os.getpid():
+			pool.close()
+
+
+class ChunkedTransformMixin(object, metaclass=ABCMeta):
+	"""
+	Shards the transform of large batches of documents across a `TransformPool`.
+
+	Every worker transforms whole chunks, the chunks are stacked back in the
+	order of the input. Batches of at most `chunk_size` documents, or a pool of
+	a single worker, are transformed in the calling process. The pool is kept
+	for the lifetime of the vectorizer, `close` stops it when the model is
+	swapped out. Subclasses can't be instantiated without `transform_local` and
+	`transform_pool_args`.
+	"""
+
+	_pool_lock = threading.Lock()
+
+	@abstractmethod
+	def transform_local(self, documents):
+		"""
+		:param documents: list of document strings
+		:return: feature matrix of the documents, computed in the calling process
+		"""
+
+	@abstractmethod
+	def transform_pool_args(self):
+		"""
+		:return: tuple, the picklable factory and arguments building the vectorizer in a worker
+		"""
+
+	def _transform_pool(self):
+		pool = self.__dict__.get('_pool')
+		if pool is None:
+			with self._pool_lock:
+				pool = self.__dict__.get('_pool')
+				if pool is None:
+					factory, args = self.transform_pool_args()
+					pool = TransformPool(self.n_workers or multiprocessing.cpu_count(), factory, args)
+					self.__dict__['_pool'] = pool
+		return pool
+
+	def transform(self, X):
+		"""
+		Transform X separately by each transformer, concatenate results.
+
+		:param X: iterable of document strings
+		:return: sparse matrix of dimension (M x N), with rows in the order of X
+		"""
+		documents = list(X)
+		n_workers = self.n_workers or multiprocessing.cpu_count()
+		if n_workers > 1 and len(documents) > self.chunk_size:
+			chunks = [documents[i:i + self.chunk_size] for i in range(0, len(documents), self.chunk_size)]
+			results = self._transform_pool().map(chunks)
+			if results is not None:
+				memo = find_lemma_memo(self)
+				for _, pos_entries, (hits, misses) in results:
+					pos_cache.put_many(pos_entries)
+					if memo is not None:
+						memo.hits += hits
+						memo.misses += misses
+				return sp.vstack([X_chunk for X_chunk, _, _ in results]).tocsr()
+		return self.transform_local(documents)
+
+	def close(self):
+		"""stops the transform pool of the vectorizer, if it was started"""
+		pool = self.__dict__.get('_pool')
+		if pool is not None:
+			pool.close()
+
+	def __getstate__(self):
+		#: the pool stays with the process, the workers get the vectorizer without it
+		getstate = getattr(super(ChunkedTransformMixin, self), '__getstate__', None)
+		state = dict(getstate() if getstate is not None else self.__dict__)
+		state.pop('_pool', None)
+		return state
+
+
+class ChunkedFeatureUnion(ChunkedTransformMixin, FeatureUnion):
+	"""FeatureUnion which shards large batches of documents across a pool of processes, see `ChunkedTransformMixin`"""
+
+	def __init__(self, transformer_list, n_jobs=1, transformer_weights=None, n_workers=1, chunk_size=500):
+		"""
+		:param n_workers: number of worker processes, None to use every core
+		:type n_workers: int
+		:param chunk_size: number of documents transformed by a worker at a time
+		:type chunk_size: int
+		"""
+		super(ChunkedFeatureUnion, self).__init__(
+			transformer_list, n_jobs=n_jobs, transformer_weights=transformer_weights
+		)
+		self.n_workers = n_workers
+		self.chunk_size = chunk_size
+
+	def transform_local(self, documents):
+		return FeatureUnion.transform(self, documents)
+
+	def transform_pool_args(self):
+		#: pickled once per worker, when the pool starts
+		return _same_vectorizer, (self, )
@@ -1,30 +1,40 @@
 import csv
+import multiprocessing
 import os
 import pickle
 import time
+from collections import OrderedDict
 
 import numpy as np
-from sklearn.metrics import f1_score
+from sklearn.metrics import accuracy_score, f1_score
 from sklearn.model_selection import ShuffleSplit
 from sklearn.naive_bayes import MultinomialNB
-from sklearn.pipeline import FeatureUnion
 
 from . import PathInfo
-from .Vectorizer import LinguisticVectorizer, LemmatizedTfidfVectorizer
+from .ModelArtifact import export_model
+from .ModelRegistry import ModelRegistry, pickles_version
+from .PathInfo import pickle_path
+from .SentimentCache import SentimentCache, review_hash
+from .Vectorizer import (
+	LinguisticVectorizer, LemmatizedTfidfVectorizer, LemmatizedHashingVectorizer, ChunkedFeatureUnion,
+	find_lemma_memo
+)
 
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 
 
-def load_data(dirname=PathInfo.DATA_BASE_DIR, file=PathInfo.MIXED_REVIEW_FILE):
+#: labels of the review data sets, negative = 0 and positive = 1
+CLASSES = np.array([0, 1], dtype='u1')
+
+
+def iter_reviews(dirname=PathInfo.DATA_BASE_DIR, file=PathInfo.MIXED_REVIEW_FILE):
 	"""
-	Loads data from file and converts it into X, Y pairs w
+	Reads the reviews from the file one at a time
 
 	:param dirname: `str`, the name of directory
 	:param file: takes any one of intially processed review file (positive, negative and mixed)
-	:return: tuple, Data set in form of X, Y where both X and Y are np array
+	:return: generator of (review, label) pairs, label is 1 for positive and 0 otherwise
 	"""
-	data = []
-	# reading datasets from the file
 	path = os.path.join(BASE_DIR, '{dir}{file}'.format(dir=dirname, file=file))
 	with open(path, 'r', newline='') as f:
 		csvreader = csv.reader(f, delimiter='\t')
@@ -35,16 +45,49 @@ def load_data(dirname=PathInfo.DATA_BASE_DIR, file=PathInfo.MIXED_REVIEW_FILE):
 				y = 1
 			else:
 				y = 0
-			data.append([x, y])
+			yield x, y
+
+
+def load_data(dirname=PathInfo.DATA_BASE_DIR, file=PathInfo.MIXED_REVIEW_FILE):
+	"""
+	Loads data from file and converts it into X, Y pairs w
+
+	:param dirname: `str`, the name of directory
+	:param file: takes any one of intially processed review file (positive, negative and mixed)
+	:return: tuple, Data set in form of X, Y where both X and Y are np array
+	"""
+	data = list(iter_reviews(dirname, file))
 	X = np.asarray([d[0] for d in data], dtype=object)
 	Y = np.asarray([d[1] for d in data], dtype='u1')
 	return X, Y
 
 
-def all_feature_vectorizer():
+def iter_data_chunks(files=(PathInfo.MIXED_REVIEW_FILE,), chunk_size=1000, dirname=PathInfo.DATA_BASE_DIR):
+	"""
+	Streams the review files as X, Y chunks, holding at most one chunk in memory
+
+	:param files: names of the review files to read, one after another
+	:param chunk_size: `int`, maximum number of reviews in a chunk
+	:param dirname: `str`, the name of directory
+	:return: generator of (X, Y) np array pairs
+	"""
+	for file in files:
+		chunk = []
+		for pair in iter_reviews(dirname, file):
+			chunk.append(pair)
+			if len(chunk) == chunk_size:
+				yield np.asarray([d[0] for d in chunk], dtype=object), np.asarray([d[1] for d in chunk], dtype='u1')
+				chunk = []
+		if chunk:
+			yield np.asarray([d[0] for d in chunk], dtype=object), np.asarray([d[1] for d in chunk], dtype='u1')
+
+
+def all_feature_vectorizer(n_workers=1, chunk_size=500):
 	"""
 	Combines the linguistic vectorizer and lemmatized TfidfVectorizer
 
+	:param n_workers: `int`, number of processes used by transform, None to use every core
+	:param chunk_size: `int`, number of documents transformed by a process at a time
 	:return: Vectorizer class, which is combination of the above two vectorizer in respective order
 	"""
 	linguistic_vectorizer = LinguisticVectorizer()
@@ -53,11 +96,81 @@ def all_feature_vectorizer():
 		smooth_idf=True, stop_words=None, sublinear_tf=True, binary=False
 	)
 	# Feature union acts as pipeline that combines the features from the individual Vectorizer
-	all_features = FeatureUnion([('lingVec', linguistic_vectorizer), ('lemmaVec', lemm_tf_idf_vect)])
+	all_features = ChunkedFeatureUnion(
+		[('lingVec', linguistic_vectorizer), ('lemmaVec', lemm_tf_idf_vect)],
+		n_workers=n_workers, chunk_size=chunk_size
+	)
 	return all_features
 
 
-def train_model(clf_generator, X, Y, dev=False):
+def streaming_feature_vectorizer(n_features=2 ** 20, n_workers=1, chunk_size=500):
+	"""
+	Combines the linguistic vectorizer and lemmatized HashingVectorizer, neither of them needs to be fitted
+
+	:param n_features: `int`, number of columns the lemmatized n-grams are hashed into
+	:param n_workers: `int`, number of processes used by transform, None to use every core
+	:param chunk_size: `int`, number of documents transformed by a process at a time
+	:return: Vectorizer class, which is combination of the above two vectorizer in respective order
+	"""
+	linguistic_vectorizer = LinguisticVectorizer()
+	lemm_hashing_vect = LemmatizedHashingVectorizer(
+		analyzer='word', ngram_range=(1, 2), n_features=n_features,
+		stop_words=None, non_negative=True, norm='l2', binary=False
+	)
+	return ChunkedFeatureUnion(
+		[('lingVec', linguistic_vectorizer), ('lemmaVec', lemm_hashing_vect)],
+		n_workers=n_workers, chunk_size=chunk_size
+	)
+
+
+def train_streaming(files=(PathInfo.MIXED_REVIEW_FILE,), chunk_size=1000, n_features=2 ** 20):
+	"""
+	Trains the classifier incrementally, one chunk of the review files at a time
+
+	Peak memory depends on `chunk_size` and `n_features`, not on the size of the corpus.
+
+	:param files: names of the review files to train on
+	:param chunk_size: `int`, number of reviews vectorized and learnt at a time
+	:param n_features: `int`, number of columns the lemmatized n-grams are hashed into
+	:return: tuple, the vectorizer and the trained classifier
+	"""
+	vectorizer = streaming_feature_vectorizer(n_features)
+	clf = MultinomialNB(alpha=0.1)
+	num_reviews = 0
+	for X_chunk, Y_chunk in iter_data_chunks(files, chunk_size):
+		clf.partial_fit(vectorizer.transform(X_chunk), Y_chunk, classes=CLASSES)
+		num_reviews += len(Y_chunk)
+	print("Classifier trained on %d reviews." % num_reviews)
+	return vectorizer, clf
+
+
+def _score_fold(clf_generator, X, Y, train_index, test_index):
+	"""
+	Trains a classifier on one fold and scores it with a single prediction of the test set
+
+	:return: tuple, the classifier, its accuracy and F1-Score
+	"""
+	clf = clf_generator(alpha=0.1)
+	clf.fit(X[train_index], Y[train_index])
+	Y_test = Y[test_index]
+	testresult = clf.predict(X[test_index])
+	return clf, accuracy_score(Y_test, testresult), f1_score(Y_test, testresult)
+
+
+#: data set of a cross validation worker process
+_fold_data = None
+
+
+def _init_fold_worker(clf_generator, X, Y):
+	global _fold_data
+	_fold_data = clf_generator, X, Y
+
+
+def _score_fold_in_worker(split):
+	return _score_fold(*_fold_data, *split)
+
+
+def train_model(clf_generator, X, Y, dev=False, n_jobs=1):
 	"""
 	Trains the classifier and return the best classifer based on the F1 Score
 
@@ -65,65 +178,71 @@ def train_model(clf_generator, X, Y, dev=False):
 	:param X: np array of the feature vector with dimension (M, N), where M is number of entries and N is feature vector
 	:param Y: np array of result vector with dimension (M x 1), where M is number of entries and entries are binary(0/1)
 	:param dev: boolean , for displaying statistic of each itreation within the training loop
-	:return: object, the best classifier's object based on the F1-Score
+	:param n_jobs: `int`, number of processes the folds are spread across, None to use every core
+	:return: tuple, the best classifier's object based on the F1-Score and a list with the scores of every fold
 	"""
-	score, f1score = [], []
+	rs = ShuffleSplit(n_splits=15, test_size=0.25, train_size=None, random_state=0)
+	splits = list(rs.split(X))
+	n_jobs = n_jobs or multiprocessing.cpu_count()
+	if n_jobs > 1:
+		n_jobs = min(n_jobs, len(splits))
+		with multiprocessing.Pool(n_jobs, initializer=_init_fold_worker, initargs=(clf_generator, X, Y)) as pool:
+			results = pool.map(_score_fold_in_worker, splits)
+	else:
+		results = [_score_fold(clf_generator, X, Y, train_index, test_index) for train_index, test_index in splits]
+
 	# best classifier variable
 	bestclf = clf_generator()
 	# max f1score
 	maxf1score = 0
 	# test score for the max f1score
 	selectedtestscore = 0
-
-	rs = ShuffleSplit(n_splits=15, test_size=0.25, train_size=None, random_state=0)
-	# training loop
-	for train_index, test_index in rs.split(X):
-		# training set
-		X_train, Y_train = X[train_index], Y[train_index]
-		# test set
-		X_test, Y_test = X[test_index], Y[test_index]
-
-		clf = clf_generator(alpha=0.1)
-		clf.fit(X_train, Y_train)
-		testscore = clf.score(X_test, Y_test)
-		testresult = clf.predict(X_test)
-		testf1score = f1_score(Y_test, testresult)
+	fold_scores = []
+	for fold, (clf, testscore, testf1score) in enumerate(results):
 		if dev:
 			print('>>testscore : ', testscore, 'f1-score: ', testf1score)
 		if testf1score > maxf1score:
 			maxf1score = testf1score
 			selectedtestscore = testscore
 			bestclf = clf
-		score.append(testscore)
-		f1score.append(testf1score)
+		fold_scores.append(dict(fold=fold, accuracy=testscore, f1_score=testf1score))
+	score = [fold_score['accuracy'] for fold_score in fold_scores]
+	f1score = [fold_score['f1_score'] for fold_score in fold_scores]
 	print('-' * 80)
 	print("Overall | Avg_acc: %.3f\tStd_dev: %.3f\tAvg_f1score: %.3f\tStd_dev: %.3f" % (
 		np.mean(score), np.std(score), np.mean(f1score), np.std(f1score)))
 	print("Selected Classifier | Acc: %.3f\tF1score: %.3f" % (selectedtestscore, maxf1score))
 	print('-' * 80)
-	return bestclf
+	return bestclf, fold_scores
 
 
-def predict_sentiment(review):
+def _dump_atomically(obj, path):
 	"""
-	Returns the sentiment of the document string (positive or negative)
+	pickles the object to a temporary file and moves it in place, so
+	that readers never see a partially written pickle
 
-	:param review: string, document string is passed as an argument
-	:return: binary value 0 for negative and 1 for positive
+	:param obj: object to pickle
+	:param path: `str`, destination path
 	"""
-	if os.path.isfile(os.path.join(BASE_DIR, PathInfo.PICKLE_BASE_DIR + PathInfo.INIT_CLASSIFIER)):
-		print("Loading the vectorizer")
-		start = time.time()
-		with open(os.path.join(BASE_DIR, PathInfo.PICKLE_BASE_DIR + PathInfo.INIT_VECTORIZER), 'rb') as vect_f:
-			vectorizer = pickle.load(vect_f)
-		print("Vectorizer loaded in  %.3f" % (time.time() - start))
+	tmp_path = '{path}.tmp'.format(path=path)
+	with open(tmp_path, 'wb') as f:
+		pickle.dump(obj, f)
+	os.replace(tmp_path, path)
 
-		print("Loading the classifier.")
-		start = time.time()
-		with open(os.path.join(BASE_DIR, PathInfo.PICKLE_BASE_DIR + PathInfo.INIT_CLASSIFIER), 'rb') as clf_f:
-			clf = pickle.load(clf_f)
-		print("Classifier loaded in  %.3f" % (time.time() - start))
 
+def train_and_persist(streaming=False, n_jobs=None):
+	"""
+	Trains the vectorizer and classifier on the mixed review data set and pickles them
+
+	:param streaming: `bool`, train chunk by chunk with `train_streaming` instead of loading the whole data set
+	:param n_jobs: `int`, number of processes the cross validation folds are spread across, None to use every core
+	:return: tuple, the fitted vectorizer and classifier
+	"""
+	if streaming:
+		print("Training the classifier on streamed data sets.")
+		start = time.time()
+		vectorizer, clf = train_streaming()
+		print("Classifier trained in %.3f secs." % (time.time() - start))
 	else:
 		print("Loading the data sets.")
 		start = time.time()
@@ -136,17 +255,61 @@ def predict_sentiment(review):
 		X_Features = vectorizer.fit_transform(X)
 		print("Feature Extraction done in %.3f" % (time.time() - start))
 
-		with open(os.path.join(BASE_DIR, PathInfo.PICKLE_BASE_DIR + PathInfo.INIT_VECTORIZER), 'wb') as vect_f:
-			pickle.dump(vectorizer, vect_f)
-
 		print("Training the classifier.")
 		start = time.time()
-		clf = train_model(MultinomialNB, X_Features, Y)
+		clf, _ = train_model(MultinomialNB, X_Features, Y, n_jobs=n_jobs)
 		print("Classifier trained in %.3f secs." % (time.time() - start))
 
-		with open(os.path.join(BASE_DIR, PathInfo.PICKLE_BASE_DIR + PathInfo.INIT_CLASSIFIER), 'wb') as clf_f:
-			pickle.dump(clf, clf_f)
+	os.makedirs(pickle_path(''), exist_ok=True)
+	#: the classifier is written last, the registry picks up
+	#: a new model once both the pickles are in place.
+	_dump_atomically(vectorizer, pickle_path(PathInfo.INIT_VECTORIZER))
+	_dump_atomically(clf, pickle_path(PathInfo.INIT_CLASSIFIER))
+	export_model(vectorizer, clf, pickle_path(PathInfo.INIT_MODEL), model_version=pickles_version())
+	return vectorizer, clf
+
 
+def export_pickled_model():
+	"""
+	Writes the pickled vectorizer and classifier as a model artifact, see `ModelArtifact`
+
+	:return: `str`, version of the exported model
+	"""
+	with open(pickle_path(PathInfo.INIT_VECTORIZER), 'rb') as vect_f:
+		vectorizer = pickle.load(vect_f)
+	with open(pickle_path(PathInfo.INIT_CLASSIFIER), 'rb') as clf_f:
+		clf = pickle.load(clf_f)
+	model_version = pickles_version()
+	export_model(vectorizer, clf, pickle_path(PathInfo.INIT_MODEL), model_version=model_version)
+	return model_version
+
+
+model_registry = ModelRegistry(trainer=train_and_persist)
+
+
+def lemmatizer_metrics():
+	"""
+	Returns the statistics of the lemma memo table of the current vectorizer
+
+	:return: dict, empty if the vectorizer doesn't lemmatize
+	"""
+	vectorizer, _ = model_registry.get()
+	memo = find_lemma_memo(vectorizer)
+	return memo.stats() if memo is not None else dict()
+
+
+sentiment_cache = SentimentCache()
+
+
+def classify(reviews, vectorizer, clf):
+	"""
+	Returns the probability of the reviews being positive, without looking at the cache
+
+	:param reviews: list of review strings
+	:param vectorizer: fitted vectorizer
+	:param clf: fitted classifier
+	:return: np array of probabilities
+	"""
 	# statistics :
 	# Best Multinomail Classifier with allFeature Vectorizer gives the following output for negative(only) data sets and
 	# positive(only) data sets.
@@ -154,7 +317,7 @@ def predict_sentiment(review):
 
 	print("Extracting the Features from the input.")
 	start = time.time()
-	X_test = vectorizer.transform(review)
+	X_test = vectorizer.transform(reviews)
 	print("Feature Extraction done in  %.3f secs" % (time.time() - start))
 
 	print("Sentiment classification of the the input.")
@@ -164,4 +327,32 @@ def predict_sentiment(review):
 	return sentiment[:, 1]
 
 
+def predict_sentiment(review, scorer=None):
+	"""
+	Returns the sentiment of the document string (positive or negative)
 
+	Only the reviews missing from `sentiment_cache` for the current model version are classified.
+
+	:param review: list of document strings
+	:param scorer: callable classifying a list of documents, returning their probabilities and
+				   the model version used; by default they are classified in the calling thread
+	:return: np array with the probability of every document being positive
+	"""
+	vectorizer, clf, model_version = model_registry.get_versioned()
+	reviews = list(review)
+	body_hashes = [review_hash(text) for text in reviews]
+	cached = sentiment_cache.get_many(model_version, list(set(body_hashes)))
+	#: the same body is classified only once, even if it repeats in the input
+	missing = OrderedDict()
+	for text, body_hash in zip(reviews, body_hashes):
+		if body_hash not in cached:
+			missing.setdefault(body_hash, text)
+	if missing:
+		if scorer is None:
+			probabilities, scored_version = classify(list(missing.values()), vectorizer, clf), model_version
+		else:
+			probabilities, scored_version = scorer(list(missing.values()))
+		scores = dict(zip(missing.keys(), np.asarray(probabilities).tolist()))
+		sentiment_cache.put_many(scored_version, scores)
+		cached.update(scores)
+	return np.array([cached[body_hash] for body_hash in body_hashes], dtype=float)
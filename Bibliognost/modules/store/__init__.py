@@ -0,0 +1 @@
+from .bookstore import BookStore, book_store
@@ -0,0 +1,135 @@
+import hashlib
+import time
+
+import psycopg2
+from flask import g, has_app_context
+
+from Bibliognost import get_logger
+from Bibliognost.models import upsert_books, fetch_books, fetch_book_id, upsert_reviews
+from connection import savepoint
+from dateparser import parse_review_date
+from ..sent_analysis.SentimentCache import review_hash
+
+logger = get_logger('bookstore')
+
+
+def review_key(review):
+	"""
+	Returns the id of a scraped review, the sources don't expose one, so
+	it's derived from the author, date and body of the review
+
+	:param review: a scraped review
+	:type review: dict
+	:return: `str`, hex digest
+	"""
+	key = '\x1f'.join(str(review.get(field) or '') for field in ('author', 'date', 'body'))
+	return hashlib.sha1(key.encode('utf-8')).hexdigest()
+
+
+def _rating(review):
+	try:
+		return int(review.get('rating'))
+	except (TypeError, ValueError):
+		return None
+
+
+class BookStore(object):
+	"""
+	Persists the books looked up on goodreads and the scraped reviews in postgres.
+
+	Books fetched less than `ttl` seconds ago are served from the store instead
+	of goodreads. It uses the connection opened for the request by
+	`PostgresConnection`, outside of a request nothing is found or stored, and
+	a database error never fails the request.
+	"""
+
+	def __init__(self, ttl=24 * 60 * 60, enabled=True):
+		"""
+		:param ttl: seconds a stored book is served without being looked up again
+		:type ttl: int
+		:param enabled: if False, nothing is stored or served from the store
+		:type enabled: bool
+		"""
+		self.ttl = ttl
+		self.enabled = enabled
+
+	def init_app(self, app):
+		self.ttl = app.config.get('BOOK_STORE_TTL', self.ttl)
+		self.enabled = app.config.get('BOOK_STORE', self.enabled)
+
+	def _connection(self):
+		if self.enabled and has_app_context():
+			return getattr(g, 'db', None)
+
+	def load_books(self, goodreads_ids, max_age=None):
+		"""
+		:param goodreads_ids: goodreads ids of the books
+		:type goodreads_ids: list[str]
+		:param max_age: seconds after which a stored book is stale, defaults to `ttl`
+		:type max_age: int
+		:return: dict mapping the goodreads id of every fresh stored book to its data
+		"""
+		connection = self._connection()
+		if connection is None or not goodreads_ids:
+			return dict()
+		try:
+			with savepoint(connection):
+				return fetch_books(goodreads_ids, fetched_after=int((time.time() - (max_age or self.ttl)) * 1000))
+		except psycopg2.DatabaseError as e:
+			logger.warning('Failed to read the stored books: {e}'.format(e=e))
+			return dict()
+
+	def save_books(self, books):
+		"""
+		:param books: book data as returned by `GoodReads.get_book_data`
+		:type books: list[dict]
+		"""
+		connection = self._connection()
+		if connection is None or not books:
+			return
+		try:
+			with savepoint(connection):
+				upsert_books(books, int(time.time() * 1000))
+		except psycopg2.DatabaseError as e:
+			logger.warning('Failed to store the books: {e}'.format(e=e))
+
+	def save_reviews(self, isbn, reviews):
+		"""
+		stores the scraped reviews of a book, if the book itself is stored
+
+		:param isbn: isbn of the book
+		:type isbn: str
+		:param reviews: list of reviews of every source
+		:type reviews: dict[str, list[dict]]
+		:return: `dict[str, list[dict]]`, the reviews of every source which weren't stored yet,
+				 None if nothing was stored
+		"""
+		connection = self._connection()
+		if connection is None or not isbn:
+			return None
+		try:
+			with savepoint(connection):
+				book_id = fetch_book_id(isbn)
+				if book_id is None:
+					logger.warning('Dropped the reviews of {isbn}, the book isn\'t stored'.format(isbn=isbn))
+					return None
+				fetched_at = int(time.time() * 1000)
+				new_reviews = dict()
+				for source, source_reviews in reviews.items():
+					keys = [review_key(review) for review in source_reviews]
+					rows = [
+						(
+							key, review.get('author'), review.get('title'), _rating(review),
+							review.get('date'), parse_review_date(review.get('date')), review.get('body') or '',
+							review_hash(review.get('body') or '')
+						)
+						for key, review in zip(keys, source_reviews)
+					]
+					inserted = upsert_reviews(book_id, source, rows, fetched_at)
+					new_reviews[source] = list({key: review for key, review in zip(keys, source_reviews) if key in inserted}.values())
+				return new_reviews
+		except psycopg2.DatabaseError as e:
+			logger.warning('Failed to store the reviews: {e}'.format(e=e))
+			return None
+
+book_store = BookStore()
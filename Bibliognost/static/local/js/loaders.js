@@ -47,6 +47,7 @@ $(document).ready(function() {
 	var bookReviewsContainer = $("#reviews");
 	var url = bookReviewsContainer.attr("data-url");
 	var isbn = bookReviewsContainer.attr("data-isbn");
+	var numReviews = bookReviewsContainer.attr("data-num-reviews");
 
 	var options = {
 		method: 'GET',
@@ -84,31 +85,38 @@ $(document).ready(function() {
 		bookReviewsContainer.append(reviewNode);
 	};
 
-	fetch('/reviews?isbn=' + isbn + '&url=' + url, options)
-		.then(function(response) {
-			return response.json();
-		})
-		.then(function(data) {
+	// every page of reviews is rendered as soon as the server has scored it
+	var reviewEvents = new EventSource(
+		'/reviews?stream=sse&isbn=' + isbn + '&url=' + url + '&num_reviews=' + numReviews
+	);
+	var index = 1;
+
+	reviewEvents.addEventListener('page', function(event) {
+		var page = JSON.parse(event.data);
+		if (index === 1) {
 			bookReviewsContainer.html('');
-			var index = 1;
-			data.amazon.forEach(function(review) {
-				sentiments.push(review.sentiment);
-				labels.push('#' + index + ', Rating(' + review.rating + ')');
-				index++;
-				buildReviewNode(review);
-			});
-			data.goodreads.forEach(function(review) {
-				sentiments.push(review.sentiment);
-				labels.push('#' + index + ', Rating(' + review.rating + ')');
-				index++;
-				buildReviewNode(review);
-			});
-			initLineChart(labels, sentiments);
-		})
-		.catch(function(err) {
-			Materialize.toast('Error while loading reviews !', 4000)
-			console.log(err);
+		}
+		page.reviews.forEach(function(review) {
+			sentiments.push(review.sentiment);
+			labels.push('#' + index + ', Rating(' + review.rating + ')');
+			index++;
+			buildReviewNode(review);
 		});
+	});
+
+	reviewEvents.addEventListener('summary', function() {
+		reviewEvents.close();
+		if (index === 1) {
+			bookReviewsContainer.html('');
+		}
+		initLineChart(labels, sentiments);
+	});
+
+	reviewEvents.onerror = function(err) {
+		reviewEvents.close();
+		Materialize.toast('Error while loading reviews !', 4000)
+		console.log(err);
+	};
 
 	/**
 	 * similar books loader
@@ -2,6 +2,127 @@ class Config:
     DEBUG = False
     SECRET_KEY = 'superSECUREcipherTHATyouCANnotDECIPHER!'
 
+    #: threads shared by all the requests for fetching reviews and book data
+    WORKER_POOL_SIZE = 16
+    #: maximum number of those threads a single request can keep busy
+    WORKER_POOL_REQUEST_LIMIT = 8
+
+    #: postgres connections kept open per process, and the most that may be open
+    DB_POOL_MIN_SIZE = 1
+    DB_POOL_MAX_SIZE = 10
+    #: seconds a request waits for a free postgres connection
+    DB_POOL_TIMEOUT = 5
+    #: seconds a connection may be idle before it's checked with a `SELECT 1` when handed out
+    DB_POOL_HEALTH_CHECK_INTERVAL = 30
+    #: seconds a loaded user is served from memory, and the most users kept there
+    USER_CACHE_TTL = 30
+    USER_CACHE_SIZE = 10000
+
+    #: maximum number of concurrent review page requests to a single host,
+    #: fewer are sent while the host is blocking requests
+    REVIEW_FETCH_LIMIT_PER_HOST = 10
+    #: seconds an idle connection to a review source is kept open
+    REVIEW_FETCH_KEEPALIVE = 30
+    #: seconds after which a review page request is abandoned
+    REVIEW_FETCH_TIMEOUT = 20
+    #: initial and maximum number of review page requests per second to a single host,
+    #: the rate is halved when the host blocks a request and grows back while it doesn't
+    REVIEW_FETCH_RATE = 5.0
+    REVIEW_FETCH_MAX_RATE = 20.0
+    #: maximum number of review page requests sent back to back to a single host
+    REVIEW_FETCH_BURST = 5
+    #: number of times a blocked or failed review page request is retried
+    REVIEW_FETCH_RETRIES = 3
+    #: seconds before the first retry of a review page, doubled by every further retry, with jitter
+    REVIEW_FETCH_BACKOFF = 0.5
+    REVIEW_FETCH_MAX_BACKOFF = 8.0
+    #: number of threads parsing the review pages, off the event loop of the fetcher
+    REVIEW_PARSE_WORKERS = 4
+    #: parser of the review pages of every source, 'xpath' evaluates compiled
+    #: xpath expressions on the lxml tree, 'soup' walks a full bs4 tree
+    REVIEW_PARSERS = {'amazon': 'xpath', 'goodreads': 'xpath'}
+    #: seconds a goodreads api response is served from the cache as is
+    GOODREADS_API_TTL = 60 * 60
+    #: seconds after GOODREADS_API_TTL a response is still served, while revalidated in the background
+    GOODREADS_API_STALE_TTL = 24 * 60 * 60
+    #: maximum number of cached goodreads api responses
+    GOODREADS_API_CACHE_SIZE = 2000
+    #: connect and read timeouts of a goodreads api request, in seconds
+    GOODREADS_API_TIMEOUT = (3.05, 10)
+    #: maximum number of connections kept open to the goodreads api
+    GOODREADS_API_POOL_SIZE = 16
+    #: maximum number of books of a /book-meta request looked up at a time
+    BOOK_META_CONCURRENCY = 8
+    #: store the books and reviews in postgres, and serve the books from there
+    BOOK_STORE = True
+    #: seconds a stored book is served without being looked up on goodreads again
+    BOOK_STORE_TTL = 24 * 60 * 60
+    #: maximum number of goodreads review pages (30 reviews each) fetched for a book, None for all
+    GOODREADS_REVIEW_MAX_PAGES = 50
+    #: maximum number of goodreads review pages of a book fetched at the same time
+    GOODREADS_REVIEW_CONCURRENCY = 5
+    #: remember the fetched review pages of every book and fetch only the missing or stale ones
+    REVIEW_LEDGER = True
+    #: seconds after which a stored review page is fetched again
+    REVIEW_PAGE_TTL = 6 * 60 * 60
+    #: seconds a running background job may take before it's considered abandoned and queued again
+    JOB_TIMEOUT = 5 * 60
+    #: number of times a background job is run before it's failed for good
+    JOB_MAX_ATTEMPTS = 3
+    #: seconds the result of a background job is served to later requests for the same book
+    JOB_RESULT_TTL = 6 * 60 * 60
+    #: seconds an idle job worker waits before polling the queue again
+    JOB_POLL_INTERVAL = 1.0
+    #: seconds the events of a background job are streamed for, the clients reconnect to wait longer
+    JOB_EVENTS_TIMEOUT = 5 * 60
+    #: remember the fingerprints of the reviews of every book in postgres, so the
+    #: sources a review was seen on are known across requests
+    REVIEW_DEDUP_STORE = True
+    #: seconds the review fingerprints of a book are served from memory, and the most books kept there
+    REVIEW_DEDUP_TTL = 60
+    REVIEW_DEDUP_CACHE_SIZE = 1000
+    #: store the sentiment summaries of the books in postgres, besides the memory of every worker
+    SENTIMENT_SUMMARY_STORE = True
+    #: seconds a sentiment summary is served from memory, and the most books kept there
+    SENTIMENT_SUMMARY_TTL = 60
+    SENTIMENT_SUMMARY_CACHE_SIZE = 10000
+    #: count the requests for every book in the book_hits table, to keep the hottest ones warm
+    BOOK_HITS = True
+    #: seconds after which a request for a book counts half as much
+    BOOK_HITS_HALF_LIFE = 24 * 60 * 60
+    #: seconds the requests are counted in memory before being written
+    BOOK_HITS_FLUSH_INTERVAL = 10
+    #: number of the most requested books, and of isbns, refreshed by `manage.py prewarm`
+    PREWARM_TOP_N = 50
+    #: seconds between two prewarming rounds
+    PREWARM_INTERVAL = 15 * 60
+    #: maximum number of book lookups in flight and of reviews jobs queued or running while prewarming
+    PREWARM_CONCURRENCY = 4
+    #: seconds after which the data of a hot book is refreshed, keep it below
+    #: JOB_RESULT_TTL, REVIEW_PAGE_TTL and BOOK_STORE_TTL so hot books never go stale
+    PREWARM_REFRESH_AGE = 3 * 60 * 60
+
+    #: load the sentiment model while creating the app instead of on the first request
+    SENTIMENT_PREWARM = True
+    #: seconds between two checks for a newer sentiment model on the disk
+    SENTIMENT_RELOAD_INTERVAL = 30
+    #: processes used to vectorize large batches of reviews, None to use every core
+    SENTIMENT_WORKERS = None
+    #: number of reviews vectorized by a process at a time
+    SENTIMENT_CHUNK_SIZE = 500
+    #: train a missing model chunk by chunk with a hashing vectorizer instead of in memory
+    SENTIMENT_STREAMING_TRAINING = False
+    #: number of review sentiments cached in memory by every worker
+    SENTIMENT_CACHE_SIZE = 100000
+    #: share the sentiment cache between the workers through the sentiment_scores table
+    SENTIMENT_CACHE_POSTGRES = True
+    #: classify the reviews of concurrent requests in shared batches
+    SENTIMENT_BATCHING = True
+    #: seconds a batch waits for reviews of other requests before being classified
+    SENTIMENT_BATCH_LATENCY = 0.005
+    #: number of reviews after which a batch is classified without waiting
+    SENTIMENT_BATCH_SIZE = 256
+
 
 class DevelopmentConfig(Config):
     DEBUG = True
@@ -13,6 +134,13 @@ class DevelopmentConfig(Config):
 class TestingConfig(Config):
     TESTING = True
     WTF_CSRF_ENABLED = False
+    SENTIMENT_PREWARM = False
+    SENTIMENT_CACHE_POSTGRES = False
+    REVIEW_LEDGER = False
+    BOOK_STORE = False
+    BOOK_HITS = False
+    SENTIMENT_SUMMARY_STORE = False
+    REVIEW_DEDUP_STORE = False
 
 
 class ProductionConfig(Config):
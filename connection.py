@@ -1,28 +1,229 @@
+import os
+import threading
+import time
+from contextlib import contextmanager
+
 import psycopg2
 from flask import g
+from psycopg2.pool import ThreadedConnectionPool
 
 
-class PostgresConnection:
-    def __init__(self, config):
+class PoolTimeout(psycopg2.OperationalError):
+    """Raised when no connection of the pool is free within the checkout timeout"""
+
+
+@contextmanager
+def savepoint(connection):
+    """
+    runs the statements of a `with` block in a savepoint, so a database error
+    rolls back the block only and not the rest of the transaction. Used by
+    best-effort reads and writes sharing the connection of a request.
+    """
+    cursor = connection.cursor()
+    cursor.execute('SAVEPOINT best_effort')
+    try:
+        yield
+    except psycopg2.DatabaseError:
+        cursor.execute('ROLLBACK TO SAVEPOINT best_effort')
+        raise
+    else:
+        cursor.execute('RELEASE SAVEPOINT best_effort')
+
+
+class RequestConnection:
+    """
+    Stands in for the connection of a request on `g.db`.
+
+    A connection is checked out of the pool on first use only, so requests
+    which never touch the database, like static pages, don't pay for one.
+    A failed checkout is remembered for the rest of the request.
+    """
+
+    def __init__(self, pool):
+        self.__pool = pool
         self.__connection = None
+        self.__error = None
+
+    @property
+    def checked_out(self):
+        return self.__connection is not None
+
+    def __get(self):
+        if self.__connection is None:
+            if self.__error is not None:
+                raise self.__error
+            try:
+                self.__connection = self.__pool.checkout()
+            except psycopg2.DatabaseError as e:
+                self.__error = e
+                raise
+        return self.__connection
+
+    def cursor(self, *args, **kwargs):
+        return self.__get().cursor(*args, **kwargs)
+
+    def commit(self):
+        if self.__connection is not None:
+            self.__connection.commit()
+
+    def rollback(self):
+        if self.__connection is not None:
+            self.__connection.rollback()
+
+    def release(self, exception=None):
+        """commits, or rolls back if the request failed, and returns the connection to the pool"""
+        connection, self.__connection = self.__connection, None
+        if connection is not None:
+            self.__pool.checkin(connection, commit=exception is None)
+
+    def __getattr__(self, name):
+        return getattr(self.__get(), name)
+
+
+class PostgresConnection:
+    """
+    Pool of postgres connections shared by the threads of a process.
+
+    Every request gets a `RequestConnection` on `g.db`, which checks a connection
+    out of the pool when it's first used and returns it at the end of the request.
+    Code running outside of a request uses `connection()`.
+
+    At most `max_size` connections are open at a time, a checkout waits up to
+    `checkout_timeout` seconds for a free one. Connections idle for more than
+    `health_check_interval` seconds are checked with a `SELECT 1` before being
+    handed out, and broken ones are replaced.
+    """
+
+    def __init__(self, config, min_size=1, max_size=10, checkout_timeout=5, health_check_interval=30):
         self.__db_config = config['db']
+        self.min_size = min_size
+        self.max_size = max_size
+        self.checkout_timeout = checkout_timeout
+        self.health_check_interval = health_check_interval
+        self.__pool = None
+        self.__slots = None
+        self.__pid = None
+        self.__lock = threading.Lock()
+        self.__last_used = dict()
+        self.__stats = dict(checkouts=0, timeouts=0, discarded=0, in_use=0, total_wait=0.0, max_wait=0.0)
 
     def init_app(self, app):
+        self.min_size = app.config.get('DB_POOL_MIN_SIZE', self.min_size)
+        self.max_size = app.config.get('DB_POOL_MAX_SIZE', self.max_size)
+        self.checkout_timeout = app.config.get('DB_POOL_TIMEOUT', self.checkout_timeout)
+        self.health_check_interval = app.config.get('DB_POOL_HEALTH_CHECK_INTERVAL', self.health_check_interval)
+
         @app.before_request
         def get_db():
-            """Opens a new database connection if there is none yet"""
+            """Hands the request a connection, checked out of the pool on first use"""
             if not hasattr(g, 'db'):
-                try:
-                    self.__connection = psycopg2.connect(**self.__db_config)
-                except psycopg2.DatabaseError as e:
-                    print('DatabaseError: could not connect to the databse, ({})'.format(e))
-                else:
-                    g.db = self.__connection
+                g.db = RequestConnection(self)
 
         @app.teardown_appcontext
         def close_db(exception):
-            """Closes the database at the end of the request."""
-            if hasattr(g, 'db') and self.__connection.close:
-                self.__connection.commit()
-                self.__connection.close()
+            """Returns the connection of the request to the pool"""
+            if isinstance(getattr(g, 'db', None), RequestConnection):
+                g.db.release(exception)
             return exception
+
+    @property
+    def pool(self):
+        """The pool of the current process, connections don't survive a fork"""
+        if self.__pid != os.getpid():
+            with self.__lock:
+                if self.__pid != os.getpid():
+                    self.__pool = ThreadedConnectionPool(self.min_size, self.max_size, **self.__db_config)
+                    self.__slots = threading.BoundedSemaphore(self.max_size)
+                    self.__last_used = dict()
+                    self.__stats['in_use'] = 0
+                    self.__pid = os.getpid()
+        return self.__pool
+
+    def __is_healthy(self, connection):
+        if connection.closed:
+            return False
+        if time.time() - self.__last_used.get(id(connection), 0) < self.health_check_interval:
+            return True
+        try:
+            cursor = connection.cursor()
+            cursor.execute('SELECT 1')
+            connection.rollback()
+            return True
+        except psycopg2.Error:
+            return False
+
+    def checkout(self):
+        """
+        takes a healthy connection out of the pool, waiting for one to be free
+
+        :return: psycopg2 connection
+        :raises: PoolTimeout if none is free within `checkout_timeout`, psycopg2.OperationalError if it can't connect
+        """
+        pool = self.pool
+        start = time.time()
+        if not self.__slots.acquire(timeout=self.checkout_timeout):
+            self.__stats['timeouts'] += 1
+            raise PoolTimeout('no free connection within {0} s'.format(self.checkout_timeout))
+        wait = time.time() - start
+        try:
+            connection = pool.getconn()
+            while not self.__is_healthy(connection):
+                self.__stats['discarded'] += 1
+                pool.putconn(connection, close=True)
+                connection = pool.getconn()
+        except Exception:
+            self.__slots.release()
+            raise
+        with self.__lock:
+            self.__stats['checkouts'] += 1
+            self.__stats['in_use'] += 1
+            self.__stats['total_wait'] += wait
+            self.__stats['max_wait'] = max(self.__stats['max_wait'], wait)
+        return connection
+
+    def checkin(self, connection, commit=True):
+        """
+        ends the transaction of a connection and returns it to the pool
+
+        :param commit: commit the transaction if True, roll it back otherwise
+        :type commit: bool
+        """
+        close = connection.closed
+        if not close:
+            try:
+                if commit:
+                    connection.commit()
+                else:
+                    connection.rollback()
+            except psycopg2.Error:
+                close = True
+        self.__last_used[id(connection)] = time.time()
+        if close:
+            self.__last_used.pop(id(connection), None)
+        self.pool.putconn(connection, close=bool(close))
+        with self.__lock:
+            self.__stats['in_use'] -= 1
+        self.__slots.release()
+
+    @contextmanager
+    def connection(self):
+        """
+        checks a connection out for the duration of a `with` block,
+        committing at the end or rolling back if the block raised
+        """
+        connection = self.checkout()
+        try:
+            yield connection
+        except Exception:
+            self.checkin(connection, commit=False)
+            raise
+        else:
+            self.checkin(connection)
+
+    def metrics(self):
+        checkouts = self.__stats['checkouts']
+        return dict(
+            self.__stats,
+            min_size=self.min_size, max_size=self.max_size,
+            avg_wait=self.__stats['total_wait'] / checkouts if checkouts else None
+        )
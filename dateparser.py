@@ -6,6 +6,21 @@ def parse_epoch(epoch):
     return date.strftime("%d/%m/%Y")
 
 
+def parse_review_date(text):
+    """
+    parses the date of a scraped review, i.e. '3 May 2016' on amazon or 'Jan 01, 2016' on goodreads
+
+    :param text: date as shown on the review page
+    :type text: str
+    :return: datetime.date, None if the date isn't in a known format
+    """
+    for date_format in ('%d %B %Y', '%B %d, %Y', '%b %d, %Y'):
+        try:
+            return datetime.strptime(text.strip(), date_format).date()
+        except (ValueError, AttributeError):
+            continue
+
+
 def format_age(created_at):
     now = datetime.utcnow()
     then = datetime.fromtimestamp(created_at/1000)
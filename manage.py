@@ -1,12 +1,16 @@
 from Bibliognost import create_app
+from flask import current_app
 from flask_script import Manager, Shell
 
-app = create_app('dev')
-manager = Manager(app)
+#: the app is created by the command being run, not on import, so the processes
+#: importing this module as their main module, like the forkserver of the
+#: transform pools, don't build an app of their own
+manager = Manager(create_app)
+manager.add_option('-c', '--config', dest='config_name', default='dev', required=False)
 
 
 def make_shell_context():
-    return dict(app=app)
+    return dict(app=current_app._get_current_object())
 
 manager.add_command('shell', Shell(make_context=make_shell_context))
 
@@ -19,5 +23,54 @@ def test():
     unittest.TextTestRunner(verbosity=2).run(tests)
 
 
+@manager.command
+def train(streaming=False):
+    """Train and pickle the sentiment model, running workers pick it up on their next reload"""
+    from Bibliognost.modules.sent_analysis import fastClassifier
+    fastClassifier.train_and_persist(streaming=streaming)
+
+
+@manager.command
+def export_model():
+    """Convert the pickled sentiment model into the memory mapped artifact format"""
+    from Bibliognost.modules.sent_analysis import fastClassifier
+    print('Exported model version {0}'.format(fastClassifier.export_pickled_model()))
+
+
+def run_job_worker(app):
+    from Bibliognost.modules.jobs import JobWorker
+    from Bibliognost.modules.reviews import REVIEWS_JOB, run_reviews_job
+    JobWorker(app, {REVIEWS_JOB: run_reviews_job}).run()
+
+
+@manager.command
+def worker(processes=1):
+    """Run background jobs, like the /reviews?job=1 scraping and scoring, in worker processes"""
+    import multiprocessing
+    app = current_app._get_current_object()
+    workers = [multiprocessing.Process(target=run_job_worker, args=(app, )) for _ in range(int(processes))]
+    for process in workers:
+        process.start()
+    for process in workers:
+        process.join()
+
+
+@manager.command
+def prewarm(once=False, top=None, interval=None, concurrency=None):
+    """Keep the metadata and reviews of the most requested books fresh, the reviews are scraped by `worker`"""
+    from Bibliognost.modules.prewarm import prewarmer
+    if top is not None:
+        prewarmer.top_n = int(top)
+    if interval is not None:
+        prewarmer.interval = int(interval)
+    if concurrency is not None:
+        prewarmer.concurrency = int(concurrency)
+    app = current_app._get_current_object()
+    if once:
+        prewarmer.run_once(app)
+    else:
+        prewarmer.run(app)
+
+
 if __name__ == "__main__":
     manager.run()
@@ -1,4 +1,15 @@
 DROP TABLE IF EXISTS users;
+DROP TABLE IF EXISTS jobs;
+DROP TABLE IF EXISTS book_hits;
+DROP TABLE IF EXISTS sentiment_summaries;
+DROP TABLE IF EXISTS review_fingerprints;
+DROP TABLE IF EXISTS sentiment_scores;
+DROP TABLE IF EXISTS review_pages;
+DROP TABLE IF EXISTS reviews;
+DROP TABLE IF EXISTS similar_books;
+DROP TABLE IF EXISTS book_authors;
+DROP TABLE IF EXISTS authors;
+DROP TABLE IF EXISTS books;
 
 DROP EXTENSION IF EXISTS CITEXT CASCADE;
 CREATE EXTENSION CITEXT;
@@ -15,4 +26,128 @@ CREATE TABLE users (
     createtime BIGINT NOT NULL,
     updatetime BIGINT NOT NULL,
     lastscene BIGINT NOT NULL
-);
\ No newline at end of file
+);
+
+CREATE TABLE sentiment_scores (
+    body_hash TEXT NOT NULL,
+    model_version TEXT NOT NULL,
+    probability REAL NOT NULL,
+    PRIMARY KEY (body_hash, model_version)
+);
+
+CREATE TABLE review_pages (
+    source TEXT NOT NULL,
+    book_key TEXT NOT NULL,
+    page_no INTEGER NOT NULL,
+    num_pages INTEGER NOT NULL,
+    fetched_at BIGINT NOT NULL,
+    content_hash TEXT NOT NULL,
+    reviews JSONB NOT NULL,
+    PRIMARY KEY (source, book_key, page_no)
+);
+
+CREATE TABLE books (
+    id BIGSERIAL PRIMARY KEY,
+    goodreads_id TEXT NOT NULL UNIQUE,
+    isbn TEXT,
+    title TEXT,
+    image_url TEXT,
+    small_image_url TEXT,
+    publication_year TEXT,
+    publication_month TEXT,
+    publication_day TEXT,
+    publisher TEXT,
+    description TEXT,
+    url TEXT,
+    num_pages TEXT,
+    ratings_count TEXT,
+    reviews_count TEXT,
+    fetched_at BIGINT NOT NULL
+);
+
+CREATE INDEX books_isbn_idx ON books (isbn);
+
+CREATE TABLE authors (
+    id TEXT PRIMARY KEY,
+    name TEXT
+);
+
+CREATE TABLE book_authors (
+    book_id BIGINT NOT NULL REFERENCES books (id) ON DELETE CASCADE,
+    author_id TEXT NOT NULL REFERENCES authors (id),
+    position SMALLINT NOT NULL,
+    PRIMARY KEY (book_id, author_id)
+);
+
+CREATE TABLE similar_books (
+    book_id BIGINT NOT NULL REFERENCES books (id) ON DELETE CASCADE,
+    similar_goodreads_id TEXT NOT NULL,
+    position SMALLINT NOT NULL,
+    PRIMARY KEY (book_id, similar_goodreads_id)
+);
+
+CREATE TABLE reviews (
+    id BIGSERIAL PRIMARY KEY,
+    book_id BIGINT NOT NULL REFERENCES books (id) ON DELETE CASCADE,
+    source TEXT NOT NULL,
+    external_id TEXT NOT NULL,
+    author TEXT,
+    title TEXT,
+    rating SMALLINT,
+    date TEXT,
+    reviewed_on DATE,
+    body TEXT NOT NULL,
+    body_hash TEXT NOT NULL,
+    fetched_at BIGINT NOT NULL,
+    UNIQUE (book_id, source, external_id)
+);
+
+CREATE INDEX reviews_book_source_date_idx ON reviews (book_id, source, reviewed_on);
+CREATE INDEX reviews_body_hash_idx ON reviews (body_hash);
+
+CREATE TABLE jobs (
+    id BIGSERIAL PRIMARY KEY,
+    kind TEXT NOT NULL,
+    dedupe_key TEXT NOT NULL,
+    params JSONB NOT NULL,
+    status TEXT NOT NULL,
+    progress JSONB,
+    result JSONB,
+    error TEXT,
+    attempts SMALLINT NOT NULL DEFAULT 0,
+    created_at BIGINT NOT NULL,
+    started_at BIGINT,
+    updated_at BIGINT NOT NULL,
+    finished_at BIGINT
+);
+
+CREATE UNIQUE INDEX jobs_active_key_idx ON jobs (kind, dedupe_key) WHERE status IN ('queued', 'running');
+CREATE INDEX jobs_status_idx ON jobs (status, id);
+CREATE INDEX jobs_done_key_idx ON jobs (kind, dedupe_key, finished_at) WHERE status = 'done';
+
+CREATE TABLE book_hits (
+    kind TEXT NOT NULL,
+    key TEXT NOT NULL,
+    hits BIGINT NOT NULL,
+    score DOUBLE PRECISION NOT NULL,
+    params JSONB,
+    last_hit_at BIGINT NOT NULL,
+    PRIMARY KEY (kind, key)
+);
+
+CREATE TABLE sentiment_summaries (
+    isbn TEXT NOT NULL,
+    source TEXT NOT NULL,
+    summary JSONB NOT NULL,
+    updated_at BIGINT NOT NULL,
+    PRIMARY KEY (isbn, source)
+);
+
+CREATE TABLE review_fingerprints (
+    isbn TEXT NOT NULL,
+    exact_hash TEXT NOT NULL,
+    simhash BIGINT,
+    sources TEXT[] NOT NULL,
+    updated_at BIGINT NOT NULL,
+    PRIMARY KEY (isbn, exact_hash)
+);
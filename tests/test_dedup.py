@@ -0,0 +1,142 @@
+import sys
+import unittest
+from unittest import mock
+
+import psycopg2
+from flask import Flask, g
+
+from Bibliognost.modules.reviews.dedup import (
+    MAX_DISTANCE, DedupRun, ReviewDedupIndex, exact_hash, normalize, simhash
+)
+
+dedup_module = sys.modules['Bibliognost.modules.reviews.dedup']
+
+REVIEW = (
+    'I could not put this book down, the characters are vivid and the plot twists kept me guessing until the '
+    'very last page of the story'
+)
+#: the same review, with one word changed
+EDITED_REVIEW = REVIEW.replace('of the story', 'of this story')
+OTHER_REVIEW = (
+    'A dull and slow novel with flat characters, a predictable ending and far too many pages spent on the '
+    'weather and the food'
+)
+
+
+class RecordingConnection(object):
+    """Stands in for the connection of a request, recording the statements"""
+
+    def __init__(self):
+        self.executed = []
+
+    def cursor(self, *args, **kwargs):
+        return self
+
+    def execute(self, sql, params=None):
+        self.executed.append(sql)
+
+
+def review(body):
+    return dict(body=body)
+
+
+def distance(a, b):
+    return bin(simhash(normalize(a).split()) ^ simhash(normalize(b).split())).count('1')
+
+
+class DedupRunTestCase(unittest.TestCase):
+    def test_normalize(self):
+        self.assertEqual(normalize('  Great,  GREAT book!!_really '), 'great great book really')
+        self.assertEqual(normalize(None), '')
+
+    def test_exact_duplicates_are_dropped_across_sources(self):
+        run = DedupRun()
+        kept = run.filter('amazon', [review('Loved it!'), review('loved   it')])
+        self.assertEqual(len(kept), 1)
+        self.assertEqual(run.filter('goodreads', [review('LOVED IT.')]), [])
+        self.assertEqual(kept[0]['sources'], ['amazon', 'goodreads'])
+        self.assertEqual(run.dropped, 2)
+
+    def test_near_duplicates_are_dropped(self):
+        self.assertLessEqual(distance(REVIEW, EDITED_REVIEW), MAX_DISTANCE)
+        self.assertGreater(distance(REVIEW, OTHER_REVIEW), MAX_DISTANCE)
+        run = DedupRun()
+        kept = run.filter('amazon', [review(REVIEW), review(OTHER_REVIEW)])
+        self.assertEqual(run.filter('goodreads', [review(EDITED_REVIEW)]), [])
+        self.assertEqual(len(kept), 2)
+        self.assertEqual(kept[0]['sources'], ['amazon', 'goodreads'])
+        self.assertEqual(kept[1]['sources'], ['amazon'])
+
+    def test_short_reviews_are_only_matched_exactly(self):
+        run = DedupRun()
+        kept = run.filter('amazon', [review('a great book'), review('a great novel'), review('')])
+        self.assertEqual(len(kept), 3)
+        self.assertEqual(kept[2]['sources'], ['amazon'])
+
+    def test_reviews_seen_before_are_labeled_with_their_sources(self):
+        words = normalize(REVIEW).split()
+        value = simhash(words)
+        signed = value - (1 << 64) if value >= 1 << 63 else value
+        run = DedupRun([(exact_hash(words), signed, ['goodreads'])])
+        kept = run.filter('goodreads', [review(EDITED_REVIEW)])
+        self.assertEqual(kept[0]['sources'], ['goodreads'])
+        self.assertEqual(run.changes(), [])
+        self.assertEqual(run.filter('amazon', [review(REVIEW)]), [])
+        self.assertEqual(kept[0]['sources'], ['amazon', 'goodreads'])
+        self.assertEqual(run.changes(), [(exact_hash(words), signed, ['amazon', 'goodreads'])])
+
+    def test_changes_list_a_fingerprint_once(self):
+        run = DedupRun()
+        run.filter('amazon', [review(REVIEW), review(EDITED_REVIEW), review('short one')])
+        changes = run.changes()
+        self.assertEqual(len(changes), 2)
+        self.assertIsNone(changes[1][1])
+
+
+class ReviewDedupIndexTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = Flask(__name__)
+        self.index = ReviewDedupIndex()
+        self.fetch = mock.Mock(return_value=[])
+        self.upsert = mock.Mock()
+        for patcher in (
+            mock.patch.object(dedup_module, 'fetch_fingerprints', self.fetch),
+            mock.patch.object(dedup_module, 'upsert_fingerprints', self.upsert)
+        ):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def dedup(self, reviews):
+        with self.app.app_context():
+            g.db = RecordingConnection()
+            run = self.index.start('123')
+            kept = run.filter('amazon', reviews)
+            self.index.finish('123', run)
+        return kept
+
+    def test_fingerprints_are_served_from_memory(self):
+        self.dedup([])
+        self.dedup([])
+        self.assertEqual(self.fetch.call_count, 1)
+        self.assertEqual(self.index.metrics()['hits'], 1)
+
+    def test_stored_fingerprints_are_read_again(self):
+        #: storing a run drops the fingerprints kept in memory
+        self.dedup([review(REVIEW)])
+        self.assertEqual(self.upsert.call_args[0][1][0][2], ['amazon'])
+        self.fetch.return_value = [self.upsert.call_args[0][1][0]]
+        with self.app.app_context():
+            g.db = RecordingConnection()
+            run = self.index.start('123')
+            self.assertEqual(run.filter('goodreads', [review(EDITED_REVIEW)])[0]['sources'], ['amazon', 'goodreads'])
+        self.assertEqual(self.fetch.call_count, 2)
+
+    def test_failed_read_starts_from_scratch(self):
+        self.fetch.side_effect = psycopg2.OperationalError('gone')
+        self.assertEqual(len(self.dedup([review(REVIEW)])), 1)
+
+    def test_disabled_index_neither_reads_nor_stores(self):
+        self.index.enabled = False
+        self.dedup([review(REVIEW)])
+        self.fetch.assert_not_called()
+        self.upsert.assert_not_called()
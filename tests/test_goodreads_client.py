@@ -0,0 +1,74 @@
+import sys
+import unittest
+from unittest import mock
+
+import requests
+
+from Bibliognost.modules.goodreads.client import GoodreadsClient
+
+client_module = sys.modules['Bibliognost.modules.goodreads.client']
+
+
+def response(status_code=200, content=b'<GoodreadsResponse/>', etag='"v1"'):
+    answer = mock.Mock(status_code=status_code, content=content, headers={'ETag': etag})
+    if status_code >= 400:
+        answer.raise_for_status.side_effect = requests.HTTPError(status_code)
+    return answer
+
+
+class GoodreadsClientTestCase(unittest.TestCase):
+    def setUp(self):
+        self.client = GoodreadsClient(ttl=10, stale_ttl=100, max_entries=2)
+        self.client._session = self.session = mock.Mock()
+        self.client._pid = client_module.os.getpid()
+        self.session.get.return_value = response()
+        self.now = client_module.time.time()
+        patcher = mock.patch.object(client_module.time, 'time', side_effect=lambda: self.now)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        patcher = mock.patch.object(client_module, 'worker_pool')
+        self.worker_pool = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_fresh_response_is_served_from_the_cache(self):
+        self.assertEqual(self.client.get('book/show', id='1'), b'<GoodreadsResponse/>')
+        self.assertEqual(self.client.get('book/show', id='1'), b'<GoodreadsResponse/>')
+        self.assertEqual(self.session.get.call_count, 1)
+        self.assertEqual(self.client.metrics()['hits'], 1)
+
+    def test_stale_response_is_revalidated_in_the_background(self):
+        self.client.get('book/show', id='1')
+        self.now += 20
+        self.assertEqual(self.client.get('book/show', id='1'), b'<GoodreadsResponse/>')
+        self.client.get('book/show', id='1')
+        #: a single refresh is scheduled while one is running
+        self.assertEqual(self.worker_pool.submit.call_count, 1)
+        self.assertEqual(self.session.get.call_count, 1)
+
+    def test_expired_response_is_revalidated_with_its_etag(self):
+        self.client.get('book/show', id='1')
+        self.now += 200
+        self.session.get.return_value = response(304, content=b'')
+        self.assertEqual(self.client.get('book/show', id='1'), b'<GoodreadsResponse/>')
+        self.assertEqual(self.session.get.call_args[1]['headers'], {'If-None-Match': '"v1"'})
+        self.assertEqual(self.client.metrics()['not_modified'], 1)
+        #: the revalidated response is fresh again
+        self.client.get('book/show', id='1')
+        self.assertEqual(self.session.get.call_count, 2)
+
+    def test_cached_response_is_served_when_goodreads_fails(self):
+        self.client.get('book/show', id='1')
+        self.now += 200
+        self.session.get.return_value = response(503)
+        self.assertEqual(self.client.get('book/show', id='1'), b'<GoodreadsResponse/>')
+        with self.assertRaises(requests.HTTPError):
+            self.client.get('book/show', revalidate=True, id='1')
+        with self.assertRaises(requests.HTTPError):
+            self.client.get('book/show', id='2')
+
+    def test_least_recently_used_response_is_evicted(self):
+        for book_id in ('1', '2', '1', '3'):
+            self.client.get('book/show', id=book_id)
+        self.client.get('book/show', id='1')
+        self.client.get('book/show', id='2')
+        self.assertEqual(self.session.get.call_count, 4)
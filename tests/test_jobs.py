@@ -0,0 +1,126 @@
+import unittest
+from contextlib import contextmanager
+
+from flask import Flask
+
+from Bibliognost.modules.jobs.jobqueue import JobQueue, QUEUED, RUNNING, DONE, FAILED
+from Bibliognost.modules.jobs.worker import JobWorker
+
+
+class ScriptedCursor(object):
+    """Cursor answering every statement with the next scripted row and row count"""
+
+    def __init__(self, script):
+        self.script = script
+        self.executed = []
+        self.row = None
+        self.rowcount = 0
+
+    def execute(self, sql, params=None):
+        self.executed.append((sql, params))
+        self.row, self.rowcount = self.script.pop(0) if self.script else (None, 0)
+
+    def fetchone(self):
+        return self.row
+
+
+class ScriptedConnections(object):
+    """Stands in for `PostgresConnection`, every checkout shares the same scripted cursor"""
+
+    def __init__(self, *script):
+        self._cursor = ScriptedCursor(list(script))
+
+    @contextmanager
+    def connection(self):
+        yield self
+
+    def cursor(self):
+        return self._cursor
+
+    @property
+    def executed(self):
+        return self._cursor.executed
+
+
+class JobQueueTestCase(unittest.TestCase):
+    def test_enqueue_inserts_a_new_job(self):
+        connections = ScriptedConnections(((7, ), 1))
+        queue = JobQueue(connections)
+        self.assertEqual(queue.enqueue('reviews', '123', dict(isbn='123')), 7)
+        self.assertEqual(queue.metrics()['enqueued'], 1)
+
+    def test_enqueue_joins_the_job_in_flight(self):
+        connections = ScriptedConnections((None, 0), ((3, ), 1))
+        queue = JobQueue(connections)
+        self.assertEqual(queue.enqueue('reviews', '123', dict(isbn='123')), 3)
+        self.assertEqual(queue.metrics()['coalesced'], 1)
+
+    def test_enqueue_inserts_again_if_the_job_in_flight_finished_meanwhile(self):
+        connections = ScriptedConnections((None, 0), (None, 0), ((8, ), 1))
+        queue = JobQueue(connections)
+        self.assertEqual(queue.enqueue('reviews', '123', dict(isbn='123')), 8)
+        self.assertEqual([sql.split()[0] for sql, _ in connections.executed], ['INSERT', 'SELECT', 'INSERT'])
+        self.assertEqual(queue.metrics()['enqueued'], 1)
+
+    def test_updates_are_limited_to_the_claimed_attempt(self):
+        connections = ScriptedConnections((None, 1))
+        queue = JobQueue(connections)
+        queue.finish(5, 2, dict(amazon=[]))
+        sql, params = connections.executed[0]
+        self.assertIn('WHERE id = %s AND status = %s AND attempts = %s', sql)
+        self.assertEqual(params[-3:], (5, RUNNING, 2))
+        self.assertEqual(params[0], DONE)
+        self.assertEqual(queue.metrics()['done'], 1)
+
+    def test_update_of_a_job_taken_over_is_ignored(self):
+        connections = ScriptedConnections((None, 0), (None, 0))
+        queue = JobQueue(connections)
+        queue.finish(5, 1, dict(amazon=[]))
+        self.assertFalse(queue.retry(5, 1, RuntimeError('boom')))
+        self.assertEqual(queue.metrics()['done'], 0)
+        self.assertEqual(queue.metrics()['requeued'], 0)
+
+    def test_retry_requeues_until_the_last_attempt(self):
+        connections = ScriptedConnections((None, 1), (None, 1))
+        queue = JobQueue(connections, max_attempts=3)
+        self.assertTrue(queue.retry(5, 2, RuntimeError('boom')))
+        self.assertFalse(queue.retry(5, 3, RuntimeError('boom')))
+        self.assertEqual([params[0] for _, params in connections.executed], [QUEUED, FAILED])
+        self.assertEqual(queue.metrics()['requeued'], 1)
+        self.assertEqual(queue.metrics()['failed'], 1)
+
+
+class JobWorkerTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = Flask(__name__)
+
+    def test_failed_job_is_requeued(self):
+        connections = ScriptedConnections(((1, 'reviews', dict(isbn='123'), 1), 1), (None, 1))
+        queue = JobQueue(connections, max_attempts=3)
+
+        def handler(params, report_progress):
+            raise RuntimeError('boom')
+
+        self.assertTrue(JobWorker(self.app, dict(reviews=handler), queue).run_once())
+        self.assertEqual(connections.executed[-1][1][0], QUEUED)
+
+    def test_done_job_reports_progress_and_its_result(self):
+        connections = ScriptedConnections(((1, 'reviews', dict(isbn='123'), 1), 1), (None, 1), (None, 1))
+        queue = JobQueue(connections)
+
+        def handler(params, report_progress):
+            report_progress(dict(pages=1))
+            return dict(isbn=params['isbn'])
+
+        self.assertTrue(JobWorker(self.app, dict(reviews=handler), queue).run_once())
+        self.assertEqual(connections.executed[-1][1][0], DONE)
+        self.assertEqual(queue.metrics()['done'], 1)
+
+    def test_job_without_handler_fails_at_once(self):
+        connections = ScriptedConnections(((1, 'unknown', dict(), 1), 1), (None, 1))
+        queue = JobQueue(connections, max_attempts=3)
+        self.assertTrue(JobWorker(self.app, dict(), queue).run_once())
+        self.assertEqual(connections.executed[-1][1][0], FAILED)
+
+    def test_empty_queue(self):
+        self.assertFalse(JobWorker(self.app, dict(), JobQueue(ScriptedConnections())).run_once())
@@ -0,0 +1,89 @@
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+import numpy as np
+import scipy.sparse as sp
+from sklearn.naive_bayes import MultinomialNB
+from sklearn.pipeline import FeatureUnion
+
+from Bibliognost.modules.sent_analysis import ModelRegistry as registry_module
+from Bibliognost.modules.sent_analysis import Vectorizer
+from Bibliognost.modules.sent_analysis.ModelArtifact import export_model, load_model, read_header
+from Bibliognost.modules.sent_analysis.Vectorizer import LinguisticVectorizer, LemmatizedTfidfVectorizer
+
+DOCUMENTS = ['the cats chased the dogs', 'a great story', 'dogs and cats', 'a dull story of birds']
+LABELS = ['pos', 'pos', 'neg', 'neg']
+
+
+class PluralLemmatizer(object):
+    """Stands in for the wordnet lemmatizer, whose corpus may not be installed"""
+
+    def lemmatize(self, token):
+        return token[:-1] if token.endswith('s') else token
+
+
+def linguistic_features(self, documents):
+    """Stands in for the POS ratios, the nltk tagger may not be installed"""
+    return np.zeros((len(documents), len(Vectorizer.POS_TAG_PREFIXES)))
+
+
+class ModelArtifactTestCase(unittest.TestCase):
+    def setUp(self):
+        for patcher in (
+            mock.patch.object(Vectorizer, 'lemmatizer', PluralLemmatizer()),
+            mock.patch.object(LinguisticVectorizer, 'transform', linguistic_features)
+        ):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        self.path = os.path.join(self.directory, 'model.bin')
+        self.vectorizer = FeatureUnion([
+            ('linguistic', LinguisticVectorizer()), ('lemmatized', LemmatizedTfidfVectorizer(sublinear_tf=True))
+        ])
+        X = self.vectorizer.fit_transform(DOCUMENTS)
+        self.clf = MultinomialNB().fit(X, LABELS)
+        export_model(self.vectorizer, self.clf, self.path, 'v1')
+
+    def test_round_trip(self):
+        vectorizer, clf, version = load_model(self.path)
+        self.assertEqual(version, 'v1')
+        self.assertEqual(read_header(self.path)['model_version'], 'v1')
+        documents = DOCUMENTS + ['an unseen review of a dog', '']
+        X = vectorizer.transform(documents)
+        expected = self.vectorizer.transform(documents)
+        self.assertTrue(np.allclose(X.toarray(), sp.csr_matrix(expected).toarray()))
+        self.assertEqual(list(clf.classes_), list(self.clf.classes_))
+        self.assertTrue(np.allclose(clf.predict_proba(X), self.clf.predict_proba(expected)))
+
+    def test_file_which_isnt_an_artifact_is_rejected(self):
+        with open(self.path, 'wb') as f:
+            f.write(b'not a model at all')
+        with self.assertRaises(ValueError):
+            read_header(self.path)
+
+    def test_loaded_vectorizers_share_the_lemmas(self):
+        first, _, _ = load_model(self.path)
+        first.transform(DOCUMENTS)
+        second, _, _ = load_model(self.path)
+        self.assertIs(first.lemma_memo, second.lemma_memo)
+        self.assertIn('cats', second.lemma_memo.table)
+
+    def test_registry_load_doesnt_transform_a_document(self):
+        registry = registry_module.ModelRegistry()
+        with mock.patch.object(registry_module, 'pickle_path', return_value=self.path):
+            with mock.patch.object(LinguisticVectorizer, 'transform') as transform:
+                vectorizer, clf, version = registry._load(('artifact', 'v1'))
+        transform.assert_not_called()
+        self.assertEqual(version, ('artifact', 'v1'))
+        self.assertEqual(vectorizer.n_features_out, clf.n_features_in)
+
+    def test_registry_rejects_a_mismatched_pickled_model(self):
+        clf = MultinomialNB().fit(np.ones((2, 3)), ['pos', 'neg'])
+        with mock.patch.object(LinguisticVectorizer, 'transform') as transform:
+            self.assertNotEqual(*registry_module.feature_widths(self.vectorizer, clf))
+            self.assertEqual(*registry_module.feature_widths(self.vectorizer, self.clf))
+        transform.assert_not_called()
@@ -0,0 +1,44 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from Bibliognost.modules.sent_analysis.Vectorizer import PosCache
+
+
+class PosCacheTestCase(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        self.path = os.path.join(self.directory, 'poscache.json')
+
+    def test_snapshot_survives_a_restart(self):
+        cache = PosCache(self.path)
+        cache.put_many([(PosCache.key('a story'), [0.5, 0.0, 0.0, 0.0])])
+        cache.flush()
+        self.assertEqual(PosCache(self.path).get_many([PosCache.key('a story'), PosCache.key('other')]), [
+            [0.5, 0.0, 0.0, 0.0], None
+        ])
+
+    def test_least_recently_used_entries_are_dropped(self):
+        cache = PosCache(self.path, max_size=2)
+        cache.put_many([('a', [1.0]), ('b', [2.0])])
+        cache.get_many(['a'])
+        cache.put_many([('c', [3.0])])
+        self.assertEqual(cache.get_many(['a', 'b', 'c']), [[1.0], None, [3.0]])
+        cache.flush()
+        #: the snapshot keeps the order of use, a smaller cache loads the most recent entries
+        self.assertEqual(PosCache(self.path, max_size=1).get_many(['a', 'c']), [None, [3.0]])
+
+    def test_workers_hand_new_entries_back(self):
+        cache = PosCache(self.path)
+        cache.track_new = True
+        cache.put_many([('a', [1.0])])
+        self.assertEqual(cache.take_new(), [('a', [1.0])])
+        self.assertEqual(cache.take_new(), [])
+        self.assertFalse(os.path.exists(self.path))
+
+    def test_unreadable_snapshot_starts_empty(self):
+        with open(self.path, 'w') as f:
+            f.write('{not json')
+        self.assertEqual(PosCache(self.path).get_many(['a']), [None])
@@ -0,0 +1,36 @@
+import sys
+import unittest
+from unittest import mock
+
+from flask import Flask
+
+from Bibliognost.modules.prewarm.prewarmer import Prewarmer
+
+#: the package exports the `prewarmer` instance under the name of the module
+prewarm_module = sys.modules['Bibliognost.modules.prewarm.prewarmer']
+
+
+class Stop(BaseException):
+    """Breaks out of the endless loop of `Prewarmer.run`"""
+
+
+class PrewarmerTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = Flask(__name__)
+        self.prewarmer = Prewarmer(interval=0)
+
+    def test_round_is_logged_when_it_fails(self):
+        self.prewarmer.warm_books = mock.Mock(return_value=2)
+        self.prewarmer.warm_reviews = mock.Mock(side_effect=ValueError('boom'))
+        with mock.patch.object(prewarm_module.logger, 'info') as info:
+            with self.assertRaises(ValueError):
+                self.prewarmer.run_once(self.app)
+        self.assertIn('Prewarmed 2 book(s) and queued 0 reviews job(s)', info.call_args[0][0])
+
+    def test_failed_round_doesnt_stop_the_loop(self):
+        self.prewarmer.warm_books = mock.Mock(side_effect=ValueError('boom'))
+        self.prewarmer.warm_reviews = mock.Mock(return_value=0)
+        with mock.patch.object(prewarm_module.time, 'sleep', side_effect=[None, Stop()]):
+            with self.assertRaises(Stop):
+                self.prewarmer.run(self.app)
+        self.assertEqual(self.prewarmer.warm_books.call_count, 2)
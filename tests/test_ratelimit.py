@@ -0,0 +1,115 @@
+import asyncio
+import time
+import unittest
+
+from Bibliognost.modules.scraper.fetcher import ReviewFetcher
+from Bibliognost.modules.scraper.ratelimit import Blocked, HostLimiter, backoff_delay
+
+
+class HostLimiterTestCase(unittest.TestCase):
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+
+    def tearDown(self):
+        self.loop.close()
+
+    def run_async(self, coro):
+        return self.loop.run_until_complete(coro)
+
+    def test_backoff_delay_is_capped(self):
+        for attempt in range(10):
+            self.assertTrue(0 <= backoff_delay(attempt, 0.5, 8.0) <= min(8.0, 0.5 * 2 ** attempt))
+
+    def test_blocked_request_halves_the_limits_once_per_cooldown(self):
+        limiter = HostLimiter(rate=8.0, max_rate=20.0, max_concurrency=8, cooldown=60)
+
+        async def blocked_twice():
+            for _ in range(2):
+                await limiter.acquire()
+                await limiter.release(ok=False)
+
+        self.run_async(blocked_twice())
+        self.assertEqual(limiter.rate, 4.0)
+        self.assertEqual(limiter.concurrency, 4.0)
+        self.assertEqual(limiter.metrics()['blocked'], 2)
+        self.assertEqual(limiter.metrics()['decreases'], 1)
+        self.assertEqual(limiter.in_flight, 0)
+
+    def test_served_request_grows_the_limits(self):
+        limiter = HostLimiter(rate=2.0, max_rate=20.0, max_concurrency=10)
+        limiter.concurrency = 2.0
+
+        async def served():
+            await limiter.acquire()
+            await limiter.release(ok=True)
+
+        self.run_async(served())
+        self.assertEqual(limiter.rate, 2.5)
+        self.assertEqual(limiter.concurrency, 2.5)
+
+    def test_cancelled_token_wait_frees_the_slot(self):
+        limiter = HostLimiter(rate=0.1, min_rate=0.1, burst=1, max_concurrency=2)
+        limiter._tokens = 0.0
+
+        async def cancel_while_waiting():
+            waiter = asyncio.ensure_future(limiter.acquire())
+            await asyncio.sleep(0.05)
+            self.assertEqual(limiter.in_flight, 1)
+            waiter.cancel()
+            with self.assertRaises(asyncio.CancelledError):
+                await waiter
+
+        self.run_async(cancel_while_waiting())
+        self.assertEqual(limiter.in_flight, 0)
+
+
+class ReviewFetcherTestCase(unittest.TestCase):
+    def setUp(self):
+        self.fetcher = ReviewFetcher(rate_per_host=0.1, burst=1, max_retries=1, backoff=0.001, max_backoff=0.001)
+
+    def tearDown(self):
+        self.fetcher.close()
+
+    def limiter(self):
+        return self.fetcher.submit(self._limiter()).result(1)
+
+    async def _limiter(self):
+        return self.fetcher._limiter('http://example.com/')
+
+    def test_cancelled_fetch_waiting_for_a_token_frees_the_slot(self):
+        async def served(url, headers):
+            return 'page'
+
+        self.fetcher._get = served
+        limiter = self.limiter()
+        limiter._tokens, limiter._updated = 0.0, time.monotonic()
+        #: no token is left, the fetch waits ~10 s for one
+        waiting = self.fetcher.submit(self.fetcher.fetch('http://example.com/'))
+        time.sleep(0.1)
+        self.assertEqual(self.limiter().in_flight, 1)
+        waiting.cancel()
+        time.sleep(0.1)
+        self.assertEqual(self.limiter().in_flight, 0)
+
+    def test_cancelled_request_frees_the_slot(self):
+        async def hanging(url, headers):
+            await asyncio.sleep(10)
+
+        self.fetcher._get = hanging
+        running = self.fetcher.submit(self.fetcher.fetch('http://example.com/'))
+        time.sleep(0.1)
+        self.assertEqual(self.limiter().in_flight, 1)
+        running.cancel()
+        time.sleep(0.1)
+        self.assertEqual(self.limiter().in_flight, 0)
+
+    def test_blocked_fetch_is_retried_then_raised(self):
+        async def blocked(url, headers):
+            raise Blocked('503')
+
+        self.fetcher._get = blocked
+        self.limiter().rate = 1000.0
+        with self.assertRaises(Blocked):
+            self.fetcher.submit(self.fetcher.fetch('http://example.com/')).result(1)
+        self.assertEqual(self.limiter().in_flight, 0)
+        self.assertEqual(self.limiter().metrics()['blocked'], 2)
@@ -0,0 +1,70 @@
+import unittest
+
+import psycopg2
+from flask import Flask, g
+
+from Bibliognost.modules.sent_analysis.SentimentCache import PostgresSentimentStore, SentimentCache, review_hash
+
+
+class DictStore(object):
+    """Stands in for `PostgresSentimentStore`, keeping the probabilities in a dict"""
+
+    def __init__(self):
+        self.scores = dict()
+
+    def get_many(self, model_version, body_hashes):
+        return {h: self.scores[(model_version, h)] for h in body_hashes if (model_version, h) in self.scores}
+
+    def put_many(self, model_version, scores):
+        self.scores.update({(model_version, h): p for h, p in scores.items()})
+
+
+class FailingConnection(object):
+    """Stands in for the connection of a request, failing every statement but the savepoints"""
+
+    def cursor(self, *args, **kwargs):
+        return self
+
+    def execute(self, sql, params=None):
+        if 'SAVEPOINT' not in sql:
+            raise psycopg2.OperationalError('gone')
+
+
+class SentimentCacheTestCase(unittest.TestCase):
+    def test_probabilities_are_keyed_by_model_version(self):
+        cache = SentimentCache()
+        cache.put_many('v1', {review_hash('great'): 0.9})
+        self.assertEqual(cache.get_many('v1', [review_hash('great')]), {review_hash('great'): 0.9})
+        self.assertEqual(cache.get_many('v2', [review_hash('great')]), dict())
+        self.assertEqual(cache.metrics()['hits'], 1)
+        self.assertEqual(cache.metrics()['misses'], 1)
+
+    def test_least_recently_used_probability_is_evicted(self):
+        cache = SentimentCache(max_size=2)
+        cache.put_many('v1', dict(a=0.1, b=0.2))
+        cache.get_many('v1', ['a'])
+        cache.put_many('v1', dict(c=0.3))
+        self.assertEqual(cache.get_many('v1', ['a', 'b', 'c']), dict(a=0.1, c=0.3))
+
+    def test_store_hits_are_promoted_to_memory(self):
+        store = DictStore()
+        store.put_many('v1', dict(a=0.1))
+        cache = SentimentCache(store=store)
+        cache.put_many('v1', dict(b=0.2))
+        self.assertEqual(store.scores[('v1', 'b')], 0.2)
+        self.assertEqual(cache.get_many('v1', ['a', 'b', 'c']), dict(a=0.1, b=0.2))
+        store.scores.clear()
+        self.assertEqual(cache.get_many('v1', ['a']), dict(a=0.1))
+        self.assertEqual(cache.metrics()['store_hits'], 1)
+        self.assertEqual(cache.metrics()['misses'], 1)
+
+    def test_store_failures_are_misses(self):
+        app = Flask(__name__)
+        store = PostgresSentimentStore()
+        with app.app_context():
+            g.db = FailingConnection()
+            self.assertEqual(store.get_many('v1', ['a']), dict())
+            store.put_many('v1', dict(a=0.1))
+
+    def test_store_outside_of_a_request_finds_nothing(self):
+        self.assertEqual(PostgresSentimentStore().get_many('v1', ['a']), dict())
@@ -0,0 +1,108 @@
+import json
+import sys
+import unittest
+from unittest import mock
+
+from flask import Flask, g
+
+from Bibliognost.modules.reviews.summary import SentimentSummaries, add_reviews, describe, empty_summary
+
+summary_module = sys.modules['Bibliognost.modules.reviews.summary']
+
+
+class SummaryTable(object):
+    """Stands in for the connection of a request, keeping `sentiment_summaries` in a dict"""
+
+    def __init__(self, rows=None):
+        self.rows = dict(rows or {})
+        self.executed = []
+        self._result = []
+
+    def cursor(self, *args, **kwargs):
+        return self
+
+    def execute(self, sql, params=None):
+        self.executed.append(sql)
+        if sql.startswith('SELECT source, summary'):
+            self._result = [(source, json.loads(json.dumps(summary))) for source, summary in self.rows.items()]
+        elif sql.startswith('INSERT INTO sentiment_summaries'):
+            _, _, sources, summaries = params
+            self.rows.update(zip(sources, [json.loads(summary) for summary in summaries]))
+
+    def fetchall(self):
+        return self._result
+
+
+def review(sentiment, rating=None, date=None):
+    return dict(sentiment=sentiment, rating=rating, date=date)
+
+
+class SummaryTestCase(unittest.TestCase):
+    def test_add_reviews_counts_every_scored_review(self):
+        summary = add_reviews(empty_summary('v1'), [
+            review(0.9, '5', '3 May 2016'), review(0.2, '1', 'May 20, 2016'), review(0.7), review(None, '4')
+        ])
+        self.assertEqual(summary['count'], 3)
+        self.assertEqual(summary['positive'], 2)
+        self.assertEqual(summary['histogram'], {'5': [0, 0, 0, 0, 1], '1': [0, 1, 0, 0, 0], 'unrated': [0, 0, 0, 1, 0]})
+        self.assertEqual(summary['trend'], {'2016-05': [2, 1.1]})
+
+    def test_adding_new_reviews_is_the_same_as_summarizing_them_all(self):
+        reviews = [review(0.9, '5', '3 May 2016'), review(0.3, '2', 'Jun 01, 2016'), review(0.6, None)]
+        merged = add_reviews(add_reviews(empty_summary('v1'), reviews[:1]), reviews[1:])
+        self.assertEqual(describe(merged), describe(add_reviews(empty_summary('v1'), reviews)))
+
+    def test_describe_an_empty_summary(self):
+        described = describe(empty_summary('v1'))
+        self.assertEqual(described['count'], 0)
+        self.assertIsNone(described['mean'])
+
+
+class SentimentSummariesTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = Flask(__name__)
+        self.summaries = SentimentSummaries()
+        patcher = mock.patch.object(summary_module, 'model_registry', mock.Mock(version='v1'))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def update(self, table, reviews, new_reviews):
+        with self.app.app_context():
+            g.db = table
+            self.summaries.update('123', reviews, new_reviews)
+
+    def get(self, table):
+        with self.app.app_context():
+            g.db = table
+            return self.summaries.get('123')
+
+    def test_update_merges_into_the_stored_summary(self):
+        table = SummaryTable()
+        self.update(table, dict(amazon=[review(0.9)]), None)
+        #: another worker counted a review meanwhile
+        table.rows['amazon'] = add_reviews(table.rows['amazon'], [review(0.1)])
+        self.update(table, dict(amazon=[review(0.9), review(0.8)]), dict(amazon=[review(0.8)]))
+        self.assertEqual(table.rows['amazon']['count'], 3)
+        self.assertEqual(self.get(table)['amazon']['count'], 3)
+
+    def test_update_locks_the_book_before_reading_it(self):
+        table = SummaryTable()
+        self.update(table, dict(amazon=[review(0.9)]), None)
+        statements = [sql.split()[0] + ' ' + sql.split()[1] for sql in table.executed]
+        self.assertEqual(
+            statements, ['SAVEPOINT best_effort', 'SELECT pg_advisory_xact_lock(%s,', 'SELECT source,',
+                         'INSERT INTO', 'RELEASE SAVEPOINT']
+        )
+
+    def test_update_rebuilds_the_summary_of_another_model(self):
+        table = SummaryTable(dict(amazon=add_reviews(empty_summary('v0'), [review(0.1)] * 5)))
+        self.update(table, dict(amazon=[review(0.9)]), dict(amazon=[]))
+        self.assertEqual(table.rows['amazon']['model_version'], 'v1')
+        self.assertEqual(table.rows['amazon']['count'], 1)
+
+    def test_update_drops_the_summary_kept_in_memory(self):
+        table = SummaryTable(dict(amazon=add_reviews(empty_summary('v1'), [review(0.1)])))
+        self.assertEqual(self.get(table)['amazon']['count'], 1)
+        self.update(table, dict(amazon=[review(0.1), review(0.9)]), dict(amazon=[review(0.9)]))
+        self.assertEqual(self.get(table)['amazon']['count'], 2)
+        self.assertEqual(self.summaries.metrics()['misses'], 2)
@@ -0,0 +1,79 @@
+import unittest
+from unittest import mock
+
+from flask import Flask, g
+
+from Bibliognost.models import user as user_module
+from Bibliognost.models.user import User, UserCache
+
+
+class RecordingConnection(object):
+    """Stands in for the connection of a request, recording the statements and the commits in order"""
+
+    def __init__(self):
+        self.log = []
+
+    def cursor(self, *args, **kwargs):
+        return self
+
+    def execute(self, sql, params=None):
+        self.log.append(sql.split()[0])
+
+    def commit(self):
+        self.log.append('COMMIT')
+
+
+class UserCacheTestCase(unittest.TestCase):
+    def setUp(self):
+        self.cache = UserCache(ttl=30, max_size=2)
+
+    def test_entries_are_keyed_by_lowercased_email(self):
+        self.cache.put('Reader@Example.com', dict(name='reader'))
+        self.assertEqual(self.cache.get('reader@example.com'), dict(name='reader'))
+
+    def test_entries_expire(self):
+        self.cache.put('reader@example.com', dict(name='reader'))
+        with mock.patch.object(user_module.time, 'time', return_value=user_module.time.time() + 31):
+            self.assertIsNone(self.cache.get('reader@example.com'))
+
+    def test_least_recently_put_entry_is_evicted(self):
+        for email in ('a@example.com', 'b@example.com', 'c@example.com'):
+            self.cache.put(email, dict(email=email))
+        self.assertIsNone(self.cache.get('a@example.com'))
+        self.assertIsNotNone(self.cache.get('c@example.com'))
+
+    def test_update_changes_a_cached_row_only(self):
+        self.cache.put('reader@example.com', dict(name='reader', lastscene=1))
+        self.cache.update('reader@example.com', lastscene=2)
+        self.cache.update('other@example.com', lastscene=2)
+        self.assertEqual(self.cache.get('reader@example.com')['lastscene'], 2)
+        self.assertIsNone(self.cache.get('other@example.com'))
+
+    def test_get_returns_a_copy(self):
+        self.cache.put('reader@example.com', dict(name='reader'))
+        self.cache.get('reader@example.com')['name'] = 'changed'
+        self.assertEqual(self.cache.get('reader@example.com')['name'], 'reader')
+
+
+class UserWritesTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = Flask(__name__)
+        self.cache = UserCache()
+        patcher = mock.patch.object(user_module, 'user_cache', self.cache)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.user = User(id='1', name='Reader', email='reader@example.com', lastscene=1)
+        self.cache.put(self.user.email, dict(name='Reader', email=self.user.email, lastscene=1))
+
+    def test_ping_keeps_the_user_cached(self):
+        with self.app.app_context():
+            g.db = RecordingConnection()
+            self.user.ping()
+        self.assertEqual(self.cache.get(self.user.email)['lastscene'], self.user.lastscene)
+
+    def test_profile_update_invalidates_after_the_commit(self):
+        with self.app.app_context():
+            g.db = connection = RecordingConnection()
+            with mock.patch.object(self.cache, 'invalidate', side_effect=lambda email: connection.log.append('INVALIDATE')):
+                self.user.update_profile(bio='reads a lot')
+        self.assertEqual(connection.log, ['UPDATE', 'COMMIT', 'INVALIDATE'])
@@ -0,0 +1,100 @@
+import pickle
+import re
+import unittest
+from collections import OrderedDict
+from unittest import mock
+
+import numpy as np
+
+from Bibliognost.modules.sent_analysis import Vectorizer
+from Bibliognost.modules.sent_analysis.Vectorizer import (
+    ChunkedFeatureUnion, LemmaMemo, LemmatizedHashingVectorizer, find_lemma_memo
+)
+
+DOCUMENTS = [
+    'the cats chased the dogs', 'dogs and cats', 'a story of birds', 'birds sing', 'cats sleep all day',
+    'the dogs barked', 'an ending'
+]
+
+
+class PluralLemmatizer(object):
+    """Stands in for the wordnet lemmatizer, whose corpus may not be installed"""
+
+    def lemmatize(self, token):
+        return token[:-1] if token.endswith('s') else token
+
+
+def _plural_union(union):
+    """factory of the transform workers, which don't inherit the patched lemmatizer"""
+    Vectorizer.lemmatizer = PluralLemmatizer()
+    return union
+
+
+class PluralFeatureUnion(ChunkedFeatureUnion):
+    def transform_pool_args(self):
+        return _plural_union, (self, )
+
+
+class LemmaMemoTestCase(unittest.TestCase):
+    def setUp(self):
+        patcher = mock.patch.object(Vectorizer, 'lemmatizer', PluralLemmatizer())
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_least_recently_used_token_is_evicted(self):
+        vectorizer = LemmatizedHashingVectorizer(n_features=64)
+        vectorizer._lemma_memo = LemmaMemo(max_size=2)
+        analyse = vectorizer.build_analyzer()
+        self.assertEqual(analyse('cats dogs'), ['cat', 'dog'])
+        self.assertEqual(analyse('cats birds'), ['cat', 'bird'])
+        self.assertEqual(list(vectorizer.lemma_memo.table), ['cats', 'birds'])
+        self.assertEqual(vectorizer.lemma_memo.stats()['hits'], 1)
+        self.assertEqual(vectorizer.lemma_memo.stats()['misses'], 3)
+
+    def test_memo_pickled_with_a_plain_dict_is_loaded(self):
+        memo = LemmaMemo()
+        memo.__dict__['table'] = {'cats': 'cat'}
+        memo = pickle.loads(pickle.dumps(memo))
+        self.assertIsInstance(memo.table, OrderedDict)
+        self.assertEqual(memo.lemmatize('dogs'), 'dog')
+        self.assertEqual(list(memo.table), ['cats', 'dogs'])
+
+
+class ChunkedFeatureUnionTestCase(unittest.TestCase):
+    def setUp(self):
+        patcher = mock.patch.object(Vectorizer, 'lemmatizer', PluralLemmatizer())
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def union(self, n_workers):
+        union = PluralFeatureUnion(
+            [('words', LemmatizedHashingVectorizer(n_features=64))], n_workers=n_workers, chunk_size=2
+        )
+        self.addCleanup(union.close)
+        return union
+
+    def test_pool_transform_matches_the_local_one(self):
+        expected = self.union(1).transform(DOCUMENTS)
+        union = self.union(2)
+        X = union.transform(DOCUMENTS)
+        self.assertEqual(X.shape, expected.shape)
+        self.assertTrue(np.allclose(X.toarray(), expected.toarray()))
+        #: the same workers serve the next batch
+        self.assertIs(union._transform_pool(), union._transform_pool())
+        self.assertTrue(np.allclose(union.transform(DOCUMENTS).toarray(), expected.toarray()))
+
+    def test_worker_lookups_are_counted_by_the_parent(self):
+        union = self.union(2)
+        union.transform(DOCUMENTS)
+        stats = find_lemma_memo(union).stats()
+        self.assertEqual(stats['hits'] + stats['misses'], sum(len(re.findall(r'\b\w\w+\b', doc)) for doc in DOCUMENTS))
+
+    def test_closed_pool_falls_back_to_the_calling_process(self):
+        union = self.union(2)
+        union.close()
+        self.assertEqual(union.transform(DOCUMENTS).shape, (len(DOCUMENTS), 64))
+
+    def test_vectorizer_is_pickled_without_its_pool(self):
+        union = self.union(2)
+        union.transform(DOCUMENTS)
+        self.assertNotIn('_pool', pickle.loads(pickle.dumps(union)).__dict__)
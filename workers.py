@@ -0,0 +1,86 @@
+import atexit
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+
+class WorkerPool:
+    """
+    App-lifetime pool of worker threads for the blocking fan-out of the views.
+
+    The threads are started on first use and reused by every request, the pool
+    is bounded by `max_workers` and every `map` call keeps at most
+    `per_request_limit` of its tasks in flight, so a single request can't
+    occupy the whole pool. The pool is shut down gracefully at exit.
+    """
+
+    def __init__(self, max_workers=16, per_request_limit=8):
+        self.max_workers = max_workers
+        self.per_request_limit = per_request_limit
+        self.__executor = None
+        self.__pid = None
+        self.__closed = False
+        self.__lock = threading.Lock()
+
+    def init_app(self, app):
+        self.max_workers = app.config.get('WORKER_POOL_SIZE', self.max_workers)
+        self.per_request_limit = app.config.get('WORKER_POOL_REQUEST_LIMIT', self.per_request_limit)
+        atexit.register(self.shutdown)
+
+    @property
+    def executor(self):
+        """The executor of the current process, threads don't survive a fork so every process has its own"""
+        if self.__pid != os.getpid():
+            with self.__lock:
+                if self.__closed:
+                    raise RuntimeError('WorkerPool: cannot schedule new tasks after shutdown')
+                if self.__pid != os.getpid():
+                    self.__executor = ThreadPoolExecutor(max_workers=self.max_workers)
+                    self.__pid = os.getpid()
+        return self.__executor
+
+    def submit(self, fn, *args, **kwargs):
+        """
+        schedules a single call on the pool
+
+        :return: concurrent.futures.Future
+        """
+        return self.executor.submit(fn, *args, **kwargs)
+
+    def map(self, fn, iterable, limit=None):
+        """
+        calls `fn` on every item of the iterable in parallel
+
+        :param fn: function taking a single item
+        :param iterable: items to call the function with
+        :param limit: maximum number of calls in flight at a time, defaults to `per_request_limit`
+        :type limit: int
+        :return: list of the results, in the order of the items
+        :raises: the first exception raised by a call
+        """
+        slots = threading.BoundedSemaphore(limit or self.per_request_limit)
+
+        def call(item):
+            try:
+                return fn(item)
+            finally:
+                slots.release()
+
+        futures = []
+        for item in iterable:
+            slots.acquire()
+            futures.append(self.submit(call, item))
+        return [future.result() for future in futures]
+
+    def shutdown(self, wait=True):
+        """stops accepting new tasks and waits for the running ones to finish"""
+        with self.__lock:
+            self.__closed = True
+            if self.__executor is not None and self.__pid == os.getpid():
+                self.__executor.shutdown(wait=wait)
+
+    def metrics(self):
+        return dict(
+            max_workers=self.max_workers, per_request_limit=self.per_request_limit,
+            queued_tasks=self.__executor._work_queue.qsize() if self.__executor else 0
+        )